@@ -0,0 +1,56 @@
+"""
+Cost of updating hash and sorted indexes as the indexed tree grows, of
+lookups against a walk of the tree, and memory of the indexes. Trees are
+those of bench_serialize.
+
+    python benchmarks/bench_index.py [largest tree size]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "pymodel"))
+
+from bench_serialize import build
+from index import HashIndex, SortedIndex
+from journal import iter_preorder
+
+UPDATES = 10000
+
+def measure(size):
+    root = build(size)
+    nodes = list(iter_preorder(root))[1:]
+    by_name = HashIndex(root, "name")
+    by_amount = SortedIndex(root, "amount")
+
+    start = time.time()
+    for i in xrange(UPDATES):
+        node = random.choice(nodes)
+        node.amount = random.random() * size
+        node.name = "node%d" % random.randrange(size)
+    update = (time.time() - start) / UPDATES
+
+    low, high, name = size * 0.5, size * 0.5001, "node%d" % (size // 2)
+    start = time.time()
+    list(by_amount.range(low, high))
+    by_name.get(name)
+    lookup = time.time() - start
+    start = time.time()
+    [node for node in iter_preorder(root) if low <= node.amount <= high or
+        node.name == name]
+    walk = time.time() - start
+
+    print "%8d nodes: update %5.1fus, lookups %7.3fms, walk %8.2fms, " \
+        "indexes %5.1f bytes/node" % (size, update * 1e6, lookup * 1000,
+        walk * 1000, (by_name.get_memory() + by_amount.get_memory()) /
+        float(size))
+
+if __name__ == "__main__":
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    size = 1000
+    while size <= largest:
+        measure(size)
+        size *= 10
@@ -0,0 +1,56 @@
+"""
+Cost of saving edits through a journal, against writing the whole tree with
+the serialize module, as the tree grows. Trees are those of
+bench_serialize.
+
+    python benchmarks/bench_journal.py [largest tree size]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "pymodel"))
+
+from bench_serialize import build
+from journal import Journal
+import serialize
+
+EDITS = 1000
+
+def measure(size, directory):
+    root = build(size)
+    path = os.path.join(directory, "document%d" % size)
+    journal = Journal(path, root)
+    nodes = list(root.iter_children())
+    start = time.time()
+    for i in xrange(EDITS):
+        nodes[i % len(nodes)].amount = i
+        if i % 10 == 9:
+            # an autosave every 10 edits
+            journal.flush()
+    journaled = (time.time() - start) / (EDITS // 10)
+    journal.close()
+
+    start = time.time()
+    with open(path + ".full", "wb") as file:
+        serialize.dump(root, file)
+        file.flush()
+        os.fsync(file.fileno())
+    full = time.time() - start
+    print "%8d nodes: journaled autosave %7.2fms, full save %8.2fms" % (
+        size, journaled * 1000, full * 1000)
+
+if __name__ == "__main__":
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    directory = tempfile.mkdtemp()
+    try:
+        size = 1000
+        while size <= largest:
+            measure(size, directory)
+            size *= 10
+    finally:
+        shutil.rmtree(directory)
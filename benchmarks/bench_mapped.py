@@ -0,0 +1,74 @@
+"""
+Open time and resident memory of a document in the mapped format, against
+loading it with the serialize module, and time to save it back after
+editing one node. The tree is that of bench_serialize, with a million
+nodes by default. Documents are opened in a new process, so that memory
+freed by building the tree isn't reused.
+
+    python benchmarks/bench_mapped.py [nodes]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "pymodel"))
+
+from bench_serialize import build, rss
+import mapped
+import serialize
+
+def timed(name, function):
+    start = time.time()
+    result = function()
+    print "%-28s %7.3fs" % (name, time.time() - start)
+    return result
+
+def open_stream(path):
+    with open(path, "rb") as file:
+        return serialize.load(file)
+
+def open_mapped(path):
+    # and read down to the first leaf
+    document = node = mapped.load(path)
+    while node.get_child_count():
+        node = next(node.iter_children())
+    return document
+
+def measure_open(kind, path):
+    start = rss()
+    document = timed("open with " + kind,
+        lambda : globals()["open_" + kind](path))
+    print "%-28s %7.1fMB" % ("  resident", (rss() - start) / 1e6)
+    if kind == "mapped":
+        node = document
+        while node.get_child_count():
+            node = next(node.iter_children())
+        node.name = "edited"
+        timed("mapped.save after one edit",
+            lambda : mapped.save(document, path))
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--open"]:
+        measure_open(sys.argv[2], sys.argv[3])
+        sys.exit()
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "document")
+        stream = os.path.join(directory, "stream")
+        root = build(size)
+        timed("mapped.save", lambda : mapped.save(root, path))
+        with open(stream, "wb") as file:
+            timed("serialize.dump", lambda : serialize.dump(root, file))
+        sys.stdout.flush()
+        for kind, filename in (("stream", stream), ("mapped", path)):
+            subprocess.check_call([sys.executable, __file__, "--open", kind,
+                filename])
+    finally:
+        shutil.rmtree(directory)
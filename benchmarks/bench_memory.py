@@ -0,0 +1,61 @@
+"""
+Bytes per instance of a model class with the default layout, where
+property values live in the instance __dict__, and with the compact layout
+generated by BaseMeta for classes declaring __compact__ = True.
+
+    python benchmarks/bench_memory.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "pymodel"))
+
+from basemodel import BaseModel, property
+
+def transaction_class(compact):
+    """Return a Transaction model class, with the compact layout or not"""
+
+    class Transaction(BaseModel):
+
+        __compact__ = compact
+
+        debit = property(0.0)
+        credit = property(0.0)
+        balance = property(0.0)
+
+        def __init__(self, debit, credit):
+            BaseModel.__init__(self)
+            self.debit = debit
+            self.credit = credit
+            self.balance = lambda : self.credit - self.debit
+
+    return Transaction
+
+def size(instance):
+    """Return the memory used by instance, its __dict__ and its list of
+    children. The values and the constraint are the same in both
+    layouts."""
+    total = sys.getsizeof(instance)
+    if hasattr(instance, "__dict__"):
+        total += sys.getsizeof(instance.__dict__)
+    total += sys.getsizeof(list(instance.iter_children()))
+    return total
+
+def rss():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def measure(name, cls, count=100000):
+    start = rss()
+    instances = [cls(i, i + 1) for i in xrange(count)]
+    resident = float(rss() - start) / count
+    print "%-20s %5d bytes/instance, %5d resident" % (name,
+        size(instances[0]), resident)
+    # keep them, so that the next measure doesn't reuse their memory
+    return instances
+
+if __name__ == "__main__":
+    default = measure("default", transaction_class(False))
+    compact = measure("compact", transaction_class(True))
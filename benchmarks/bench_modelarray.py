@@ -0,0 +1,61 @@
+"""
+Clock tick times of many shapes whose position is a function of the time,
+with one constraint per shape, and with a single vectorized constraint
+over a ModelArray.
+
+    python benchmarks/bench_modelarray.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "pymodel"))
+
+import numpy
+from basemodel import BaseModel, property, batch_notify
+from modelarray import ModelArray
+
+class Clock(BaseModel):
+
+    time = property(0)
+
+class Shape(BaseModel):
+
+    x = property(0)
+    y = property(0)
+
+def per_instance(clock, count):
+    shapes = []
+    for i in xrange(count):
+        shape = Shape()
+        shape.x = (lambda i: lambda : i * clock.time)(i)
+        shape.y = (lambda shape: lambda : shape.x * 0.5)(shape)
+        shapes.append(shape)
+    return shapes
+
+def vectorized(clock, count):
+    shapes = ModelArray(Shape, ["x", "y"], capacity=count)
+    with batch_notify():
+        for i in xrange(count):
+            shapes.new()
+    shapes.constrain("x",
+        lambda shapes: numpy.arange(len(shapes)) * clock.time)
+    shapes.constrain("y", lambda shapes: shapes.column("x") * 0.5)
+    return shapes
+
+def measure(name, build, count, ticks=20):
+    clock = Clock()
+    shapes = build(clock, count)
+    start = time.time()
+    for i in xrange(ticks):
+        clock.time = i + 1
+    elapsed = time.time() - start
+    print "%-20s %.3f ms/tick" % ("%s(%d)" % (name, count),
+        elapsed * 1000 / ticks)
+
+if __name__ == "__main__":
+    for count in (100, 1000, 10000):
+        measure("per_instance", per_instance, count)
+        measure("vectorized", vectorized, count)
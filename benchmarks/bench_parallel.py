@@ -0,0 +1,63 @@
+"""
+Update times of a wide fan-out graph of CPU-heavy constraints, evaluated
+serially and on thread pools. The constraints sort large numpy arrays,
+which releases the GIL.
+
+    python benchmarks/bench_parallel.py
+"""
+
+import os
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "pymodel"))
+
+import numpy
+import basemodel
+from basemodel import BaseModel, property
+
+class Source(BaseModel):
+
+    seed = property(0)
+
+class Serial(BaseModel):
+
+    value = property(0.0)
+
+class Parallel(BaseModel):
+
+    value = property(0.0, parallel=True)
+
+def fanout(cls, width, size):
+    """width heavy constraints reading the source, and one constraint
+    reading all of them"""
+    source = Source()
+    data = [numpy.random.random(size) for i in xrange(width)]
+    middle = []
+    for i in xrange(width):
+        node = cls()
+        node.value = (lambda values: lambda :
+            float(numpy.sort(values * source.seed)[size // 2]))(data[i])
+        middle.append(node)
+    sink = Serial()
+    sink.value = lambda : sum(node.value for node in middle)
+    return source, sink
+
+def measure(name, cls, width=32, size=200000, updates=5):
+    source, sink = fanout(cls, width, size)
+    start = time.time()
+    for i in xrange(updates):
+        source.seed = i + 1
+    elapsed = time.time() - start
+    print "%-20s %8.1f ms/update" % (name, elapsed * 1000 / updates)
+    return sink.value
+
+if __name__ == "__main__":
+    measure("serial", Serial)
+    for threads in (2, 4, 8):
+        pool = ThreadPool(threads)
+        basemodel.set_pool(pool)
+        measure("parallel(%d)" % threads, Parallel)
+        pool.close()
@@ -0,0 +1,62 @@
+"""
+Constraint recompute counts and update times on diamond shaped and deep
+chain dependency graphs.
+
+    python benchmarks/bench_propagation.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "pymodel"))
+
+import basemodel
+from basemodel import BaseModel, property
+
+class Node(BaseModel):
+
+    value = property(0)
+
+def diamond(width):
+    """One source, width constraints reading it, and one constraint reading
+    all of them"""
+    source = Node()
+    middle = []
+    for i in xrange(width):
+        node = Node()
+        node.value = lambda : source.value + 1
+        middle.append(node)
+    sink = Node()
+    sink.value = lambda : sum(node.value for node in middle)
+    return source, sink
+
+def chain(length):
+    """Each constraint reads the previous one"""
+    source = previous = Node()
+    for i in xrange(length):
+        node = Node()
+        node.value = (lambda previous: lambda : previous.value + 1)(previous)
+        previous = node
+    return source, node
+
+def measure(name, source, expected, updates=100):
+    propagator = basemodel._propagator
+    recomputes = propagator.recomputes
+    start = time.time()
+    for i in xrange(updates):
+        source.value = i + 1
+    elapsed = time.time() - start
+    per_update = (propagator.recomputes - recomputes) / updates
+    print "%-20s %6d recomputes/update (graph has %d constraints), " \
+        "%.3f ms/update" % (name, per_update, expected,
+            elapsed * 1000 / updates)
+
+if __name__ == "__main__":
+    for width in (10, 100, 1000):
+        source, sink = diamond(width)
+        measure("diamond(%d)" % width, source, width + 1)
+    for length in (10, 100, 5000):
+        source, sink = chain(length)
+        measure("chain(%d)" % length, source, length)
@@ -0,0 +1,72 @@
+"""
+Throughput and size of serialize.dump()/load() against cPickle, on a tree
+of models. The tree has a fan-out of 10, and a million nodes by default.
+
+    python benchmarks/bench_serialize.py [nodes]
+"""
+
+import cPickle
+import os
+import sys
+import time
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "pymodel"))
+
+from basemodel import BaseModel, property
+import serialize
+
+class Node(BaseModel):
+
+    name = property("")
+    amount = property(0.0)
+    count = property(0)
+
+def build(size, fanout=10):
+    """Return the root of a tree of size nodes, built breadth first"""
+    root = Node()
+    parents = [root]
+    made = 1
+    while made < size:
+        children = []
+        for parent in parents:
+            batch = []
+            for i in xrange(min(fanout, size - made)):
+                node = Node()
+                node.name = "node%d" % made
+                node.amount = made * 0.5
+                node.count = made
+                batch.append(node)
+                made += 1
+            parent.add_children(batch)
+            children.extend(batch)
+            if made >= size:
+                break
+        parents = children
+    return root
+
+def rss():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def measure(name, size, dump, load):
+    output = StringIO()
+    start = time.time()
+    dump(output)
+    dumped = time.time() - start
+    data = output.getvalue()
+    start = time.time()
+    load(StringIO(data))
+    loaded = time.time() - start
+    print "%-10s dump %6.2fs (%8d nodes/s)  load %6.2fs (%8d nodes/s)  " \
+        "%6.1f bytes/node" % (name, dumped, size / dumped, loaded,
+        size / loaded, len(data) / float(size))
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    root = build(size)
+    measure("serialize", size, lambda f: serialize.dump(root, f),
+        serialize.load)
+    measure("cPickle", size, lambda f: cPickle.dump(root, f, 2),
+        cPickle.load)
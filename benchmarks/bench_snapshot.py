@@ -0,0 +1,38 @@
+"""
+Time to take a snapshot of a tree after a few edits, and to diff it with
+the previous one, against taking the first, full, snapshot. Trees are those
+of bench_serialize, with a million nodes by default.
+
+    python benchmarks/bench_snapshot.py [nodes]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "pymodel"))
+
+from bench_serialize import build
+from journal import iter_preorder
+from snapshot import Tracker, diff
+
+def timed(name, function):
+    start = time.time()
+    result = function()
+    print "%-32s %9.3fms" % (name, (time.time() - start) * 1000)
+    return result
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    root = build(size)
+    nodes = list(iter_preorder(root))
+    tracker = timed("tracking", lambda : Tracker(root))
+    first = timed("first snapshot", tracker.snapshot)
+    for edits in (1, 10, 100):
+        for node in random.sample(nodes, edits):
+            node.amount += 1
+        snapshot = timed("snapshot after %d edits" % edits, tracker.snapshot)
+        changes = timed("  diff", lambda : diff(first, snapshot))
+        first = snapshot
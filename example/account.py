@@ -1,5 +1,5 @@
 from basemodel import property, BaseModel
-from observable import ObservableList
+from listmodel import ObservableList
 
 # Design the basic account object
 
@@ -0,0 +1,233 @@
+"""
+Properties aggregating a property of the children of a model
+
+    class Transaction(BaseModel):
+
+        debit = property(0)
+        credit = property(0)
+
+    class Account(BaseModel):
+
+        # sums over the transactions and sub-accounts
+        debit = aggregate(Sum, "debit")
+        credit = aggregate(Sum, "credit")
+        largest_debit = aggregate(Max, "debit")
+        count = aggregate(Count)
+
+An aggregate property is updated incrementally when children are added or
+removed, and when the aggregated property of a child changes, from its
+-changed signal. Sums, counts, means and folds are updated in constant
+time, minimums and maximums in logarithmic time. As an aggregate property
+emits its own -changed signal, aggregating an aggregate over nested models
+costs time proportional to the depth of the change, not to the size of the
+tree.
+
+Aggregates must not be assigned to, and can't aggregate lazy properties,
+which don't emit -changed signals.
+"""
+
+from heapq import heappush, heappop, heapify
+from itertools import count
+import operator
+from basemodel import property, signame
+
+class Fold(object):
+
+    """Aggregates the values with function(value, item), starting from
+    initial. inverse(value, item) must undo function."""
+
+    def __init__(self, function, inverse, initial):
+        self.function = function
+        self.inverse = inverse
+        self.value = initial
+
+    def add(self, key, value):
+        self.value = self.function(self.value, value)
+
+    def remove(self, key, value):
+        self.value = self.inverse(self.value, value)
+
+    def replace(self, key, old, new):
+        self.value = self.function(self.inverse(self.value, old), new)
+
+    def get_value(self):
+        return self.value
+
+class Sum(Fold):
+
+    def __init__(self):
+        Fold.__init__(self, operator.add, operator.sub, 0)
+
+class Count(object):
+
+    """Counts the children. It doesn't need an aggregated property."""
+
+    def __init__(self):
+        self.value = 0
+
+    def add(self, key, value):
+        self.value += 1
+
+    def remove(self, key, value):
+        self.value -= 1
+
+    def replace(self, key, old, new):
+        pass
+
+    def get_value(self):
+        return self.value
+
+class Mean(object):
+
+    """Mean of the values, None without any"""
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, key, value):
+        self.total += value
+        self.count += 1
+
+    def remove(self, key, value):
+        self.total -= value
+        self.count -= 1
+
+    def replace(self, key, old, new):
+        self.total += new - old
+
+    def get_value(self):
+        if not self.count:
+            return None
+        return self.total / float(self.count)
+
+class Min(object):
+
+    """Smallest value, None without any. None values are ignored.
+
+    The values are kept in a heap. Removed and replaced values are left in
+    the heap until they reach its top, and the heap is rebuilt when they
+    make up most of it."""
+
+    def __init__(self):
+        # (sort key, sequence number, key, value) entries; the sequence
+        # number makes them unique, so that keys and values are never
+        # compared
+        self.heap = []
+        # key: child key
+        # value: its current entry in the heap
+        self.entries = {}
+        self.counter = count()
+
+    def sort_key(self, value):
+        return value
+
+    def add(self, key, value):
+        if value is None:
+            return
+        entry = (self.sort_key(value), next(self.counter), key, value)
+        self.entries[key] = entry
+        heappush(self.heap, entry)
+
+    def remove(self, key, value):
+        if self.entries.pop(key, None) is None:
+            return
+        if len(self.heap) > 2 * len(self.entries) + 16:
+            self.heap = self.entries.values()
+            heapify(self.heap)
+
+    def replace(self, key, old, new):
+        self.remove(key, old)
+        self.add(key, new)
+
+    def get_value(self):
+        heap = self.heap
+        entries = self.entries
+        while heap and entries.get(heap[0][2]) is not heap[0]:
+            heappop(heap)
+        if not heap:
+            return None
+        return heap[0][3]
+
+class Reversed(object):
+
+    """Orders values in reverse"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+class Max(Min):
+
+    """Largest value, None without any. None values are ignored."""
+
+    def sort_key(self, value):
+        return Reversed(value)
+
+class aggregate(property):
+
+    """Declares a property whose value aggregates the property attribute
+    of the children of the model, with an instance of kind created with
+    the given arguments, one of Sum, Count, Mean, Min, Max or Fold, or any
+    class with the same methods."""
+
+    def __init__(self, kind, attribute=None, *args):
+        property.__init__(self, kind(*args).get_value())
+        self.kind = kind
+        self.attribute = attribute
+        self.args = args
+
+    def bind(self, model, name):
+        """Return the object maintaining the aggregate for model"""
+        return Aggregate(model, name, self.kind(*self.args), self.attribute)
+
+class Aggregate(object):
+
+    """Maintains the value of the aggregate property name of model"""
+
+    def __init__(self, model, name, aggregator, attribute):
+        self.model = model
+        self.name = name
+        self.aggregator = aggregator
+        self.attribute = attribute
+        # key: id(child)
+        # value: the value of the child's property added to the aggregator
+        self.values = {}
+        # key: id(child)
+        # value: handler id of the connection to the child
+        self.handlers = {}
+
+    def update(self, added=(), removed=()):
+        aggregator = self.aggregator
+        attribute = self.attribute
+        for child in removed:
+            key = id(child)
+            aggregator.remove(key, self.values.pop(key))
+            if attribute is not None:
+                child.disconnect(self.handlers.pop(key))
+        for child in added:
+            key = id(child)
+            value = None
+            if attribute is not None:
+                value = getattr(child, attribute)
+                self.handlers[key] = child.connect(signame(attribute),
+                    self.changed)
+            self.values[key] = value
+            aggregator.add(key, value)
+        setattr(self.model, self.name, aggregator.get_value())
+
+    def changed(self, child, oldvalue, value):
+        # the signal may be deferred by a batch, in which case its values
+        # may predate the addition of the child
+        key = id(child)
+        value = getattr(child, self.attribute)
+        self.aggregator.replace(key, self.values[key], value)
+        self.values[key] = value
+        setattr(self.model, self.name, self.aggregator.get_value())
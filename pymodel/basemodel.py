@@ -1,4 +1,13 @@
 from observable import Observable
+from constraint import Constraint, Propagator, equal, identical, close, \
+    get_constraints, get_dependents, _tracking
+from formula import Formula, formula
+from childlist import ChildList
+from dispatch import get_main_dispatcher
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from timeit import default_timer
 import types
 
 def private(attrname):
@@ -7,93 +16,348 @@ def private(attrname):
 def signame(attrname):
     return attrname + "-changed"
 
+class NotifyBatch(object):
+
+    """Global scope in which change notifications of every model are
+    deferred. See batch_notify()."""
+
+    def __init__(self):
+        self.depth = 0
+        # models with deferred notifications, in order of first change
+        self.models = OrderedDict()
+
+    def flush(self):
+        # stay deferred while flushing, so that the notifications of
+        # constraints recomputed here are coalesced as well
+        self.depth += 1
+        try:
+            while True:
+                _propagator.run()
+                if not self.models:
+                    break
+                model, dummy = self.models.popitem(last=False)
+                if not model._notify_frozen:
+                    model._thaw_notify()
+        finally:
+            self.depth -= 1
+
+_batch = NotifyBatch()
+_propagator = Propagator()
+
+@contextmanager
+def batch_notify():
+    """Defer the change notifications of all models until the outermost
+    batch_notify() block exits. Then, each changed property of each model
+    emits once, with its first old value and its last new value, and
+    constraints depending on it are recomputed once."""
+    _batch.depth += 1
+    try:
+        yield
+    finally:
+        _batch.depth -= 1
+        if not _batch.depth:
+            _batch.flush()
+
+def compute(constraint):
+    """Call the function of a constraint in a new tracking frame. Returns
+    its value and the set of properties it read. This may be done from
+    any thread."""
+    frame = set()
+    outer = _tracking.frame
+    _tracking.frame = frame
+    start = default_timer()
+    try:
+        value = constraint.function()
+    finally:
+        _tracking.frame = outer
+        constraint.evaluations += 1
+        constraint.time += default_timer() - start
+    return value, frame
+
+def commit(constraint, frame):
+    """Update the dependencies of a constraint to the properties it read"""
+    constraint.update_dependencies(frame)
+    constraint.record_version()
+
+def evaluate(constraint):
+    """Evaluate a constraint, and update its dependencies to the properties
+    it read"""
+    value, frame = compute(constraint)
+    commit(constraint, frame)
+    return value
+
+def set_pool(pool):
+    """Set the pool on which parallel constraints are evaluated. It must
+    have a map() method like the thread pools of multiprocessing.pool and
+    concurrent.futures, and run the calls in this process, so that the
+    properties they read can be tracked."""
+    _propagator.pool = pool
+
+def queue_to_main(instance, function, args, kwargs=None):
+    """If instance is thread-safe (see Observable.__threadsafe__) and this
+    isn't the thread of the main dispatcher, queue function(*args,
+    **kwargs) on the main dispatcher and return True.
+
+    Changes of thread-safe models made from other threads are marshalled
+    this way, so that they are made, propagated to the constraints
+    depending on them and notified from the main loop, where the global
+    propagation and batch state lives. They take effect once the main
+    loop runs them."""
+    if not instance.__threadsafe__:
+        return False
+    dispatcher = get_main_dispatcher()
+    if dispatcher is None or dispatcher.is_owner():
+        return False
+    dispatcher.queue(function, args, kwargs)
+    return True
+
+def main_loop_method(method):
+    """Decorates a method changing a thread-safe model, so that calls from
+    other threads are queued to the main loop (see queue_to_main()). They
+    then return None."""
+    def wrapper(self, *args, **kwargs):
+        if queue_to_main(self, method, (self,) + args, kwargs):
+            return None
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+def propagate(instance, descriptor, oldvalue, value, run=True):
+    """Record a change of the property of instance described by
+    descriptor. Unless run is False, propagate it right away, or at the
+    end of the current batch_notify() block."""
+    # the notifications are emitted by the propagator, after the
+    # constraints depending on this property have been updated
+    _propagator.changed(instance, descriptor, oldvalue, value)
+    if run and not _batch.depth:
+        _propagator.run()
+
 class property_descriptor(object):
 
-    prop_access = []
-    n_checkpoints = 0
+    # see property()
+    lazy = False
 
-    def __init__(self, name):
+    def __init__(self, name, compare=equal, parallel=False):
         self.name = name
+        self.compare = compare
+        self.parallel = parallel
         self.attrname = private(name)
         self.funcattrname = private(name) + '_func'
         self.signame = signame(name)
 
     def __set__(self, instance, value):
+        if queue_to_main(instance, self.__set__, (instance, value)):
+            return
         oldvalue = getattr(instance, self.attrname)
-        if oldvalue != value:
+        if isinstance(value, types.FunctionType):
+            self._initialize_constraint(instance, value, oldvalue)
+        elif isinstance(value, Formula):
+            self._initialize_constraint(instance, value.bind(instance),
+                oldvalue)
+        elif not self.compare(oldvalue, value):
             setattr(instance, self.attrname, value)
-            if isinstance(value, types.FunctionType):
-                self._initialize_constraint(instance, value, oldvalue)
-            else:
-                self._remove_constraint(instance)
-                instance.emit("attribute-changed", self.name, oldvalue, value)
-                instance.emit(self.signame, oldvalue, value)
+            self._remove_constraint(instance)
+            self._changed(instance, oldvalue, value)
 
     def __get__(self, instance, cls):
-        self.push_prop_access(self, instance)
+        if instance is None:
+            return self
+        frame = _tracking.frame
+        if frame is not None:
+            frame.add((instance, self.name))
         return getattr(instance, self.attrname)
 
     def _initialize_constraint(self, instance, function, oldvalue):
-        setattr(instance, self.funcattrname, function)
+        constraint = Constraint(instance, self, function)
+        value = evaluate(constraint)
+        # a rejected constraint leaves the previous one in place
+        try:
+            constraint.check_cycle()
+        except:
+            constraint.clear()
+            raise
+        self._remove_constraint(instance)
+        setattr(instance, self.funcattrname, constraint)
+        setattr(instance, self.attrname, value)
+        self._changed(instance, oldvalue, value)
+
+    def _remove_constraint(self, instance):
+        constraint = getattr(instance, self.funcattrname, None)
+        if constraint is not None:
+            delattr(instance, self.funcattrname)
+            constraint.clear()
+
+    def _recompute(self, instance, constraint):
+        if getattr(instance, self.funcattrname, None) is not constraint:
+            return None
+        oldvalue = getattr(instance, self.attrname)
+        value = evaluate(constraint)
+        setattr(instance, self.attrname, value)
+        return oldvalue, value
 
-        checkpoint = self.checkpoint()
-        value = function()
-        dependencies = self.pop_prop_access(checkpoint)
+    def _compute(self, instance, constraint):
+        return compute(constraint)
 
+    def _commit(self, instance, constraint, result):
+        if getattr(instance, self.funcattrname, None) is not constraint:
+            return None
+        value, frame = result
+        commit(constraint, frame)
+        oldvalue = getattr(instance, self.attrname)
         setattr(instance, self.attrname, value)
+        return oldvalue, value
 
-        for prop, object in dependencies:
-            self.addDependency(prop, object, instance)
+    def _changed(self, instance, oldvalue, value):
+        propagate(instance, self, oldvalue, value)
 
-        instance.emit("attribute-changed", self.name, oldvalue, value)
-        instance.emit(self.signame, oldvalue, value)
+    def _notify(self, instance, oldvalue, value):
+        if instance._notify_frozen or _batch.depth:
+            instance._queue_notify(self.name, oldvalue, value)
+        else:
+            instance.emit("attribute-changed", self.name, oldvalue, value)
+            instance.emit(self.signame, oldvalue, value)
 
-    def _remove_constraint(self, instance):
-        pass
+    def _invalidate(self, instance, constraint):
+        if getattr(instance, self.funcattrname, None) is not constraint:
+            return False
+        if constraint.dirty:
+            return False
+        constraint.dirty = True
+        return True
 
-    def addDependency(self, prop, object, instance):
-        sigid = object.connect(prop.signame, self._updateValue, instance)
+    def _notify_invalidated(self, instance):
+        instance.emit("attribute-invalidated", self.name)
 
-    def _updateValue(self, sender, old, new, instance):
-        oldvalue = getattr(instance, self.attrname)
-        value = getattr(instance, self.funcattrname)()
-        setattr(instance, self.attrname, value)
-        instance.emit("attribute-changed", self.name, oldvalue,
-            value)
-        instance.emit(self.signame, oldvalue, value)
+class lazy_property_descriptor(property_descriptor):
+
+    """Descriptor of properties declared with property(lazy=True). When a
+    dependency of their constraint changes, the constraint is only marked
+    dirty, and attribute-invalidated is emitted instead of the -changed
+    signals. The constraint is evaluated again when the property is
+    next read."""
+
+    lazy = True
+
+    def __get__(self, instance, cls):
+        if instance is None:
+            return self
+        constraint = getattr(instance, self.funcattrname, None)
+        if constraint is not None and constraint.dirty:
+            if not constraint.is_current():
+                value = evaluate(constraint)
+                setattr(instance, self.attrname, value)
+            constraint.dirty = False
+        frame = _tracking.frame
+        if frame is not None:
+            frame.add((instance, self.name))
+        return getattr(instance, self.attrname)
+
+class children_descriptor(object):
 
-## Totally not threadsafe
+    """Stands for the children of a model in the dependency graph, so that
+    constraints iterating over them are recomputed when a child is added
+    or removed"""
 
-    @classmethod
-    def push_prop_access(cls, property, instance):
-        if cls.n_checkpoints > 0:
-            cls.prop_access.append((property, instance))
+    name = "__children__"
+    lazy = False
+    parallel = False
 
-    @classmethod
-    def checkpoint(cls):
-        cls.n_checkpoints += 1
-        return len(cls.prop_access)
+    def _notify(self, instance, oldvalue, value):
+        # child-added and child-removed are emitted by the model
+        pass
 
-    @classmethod
-    def pop_prop_access(cls, checkpoint):
-        cls.n_checkpoints -= 1
-        values = cls.prop_access[checkpoint:]
-        del cls.prop_access[checkpoint:]
-        return values
+_children = children_descriptor()
+
+def get_formula(instance, name):
+    """Return the text of the formula computing the property name of
+    instance, or None"""
+    descriptor = getattr(instance.__class__, name)
+    constraint = getattr(instance, descriptor.funcattrname, None)
+    if constraint is None:
+        return None
+    function = constraint.function
+    if isinstance(function, partial) and isinstance(function.func, Formula):
+        return function.func.text
+    return None
+
+# key: class
+# value: sorted names of its properties
+_property_names = {}
+
+def get_property_names(cls):
+    """Return the sorted names of the properties of the model class cls,
+    including those of its bases"""
+    names = _property_names.get(cls)
+    if names is None:
+        names = set()
+        for klass in cls.__mro__:
+            names.update(klass.__dict__.get("__properties__", ()))
+        names = _property_names[cls] = tuple(sorted(names))
+    return names
 
 class property(object):
 
-    def __init__(self, default=None):
+    """Declares a model property. default is the initial value. If lazy is
+    True, constraints on the property are only recomputed when it is read
+    (see lazy_property_descriptor). compare(old, new) decides whether a
+    new value is equal to the old one, in which case no change is
+    notified or propagated; see the comparators in the constraint
+    module.
+
+    If parallel is True, constraints on the property may be evaluated
+    concurrently with other parallel constraints, on the pool set with
+    set_pool() (by default, a thread pool with one thread per CPU). This
+    pays off for functions which release the GIL, like numpy
+    operations on large arrays. The functions must only read other
+    properties, and not lazy ones."""
+
+    def __init__(self, default=None, lazy=False, compare=equal,
+            parallel=False):
         self.default = default
+        self.lazy = lazy
+        self.compare = compare
+        self.parallel = parallel
 
 class BaseMeta(type):
 
+    """Turns the properties declared in the class into descriptors.
+
+    If the class has a true __compact__ attribute, which subclasses
+    inherit, its instances have no __dict__: the values of the properties
+    and their constraints are stored in generated __slots__. Other
+    attributes must then be declared in __slots__ as usual."""
+
     def __new__(self, name, bases, dict):
         # get a list of all the properties the user installed
         properties = [attr for attr, obj in
             dict.iteritems()
                 if isinstance(obj, property)]
 
+        compact = dict.get("__compact__")
+        if compact is None:
+            compact = any(getattr(base, "__compact__", False)
+                for base in bases)
+        if compact:
+            dict["__compact__"] = True
+            slots = list(dict.get("__slots__", ()))
+            for prop in properties:
+                slots.extend([private(prop), private(prop) + "_func"])
+            dict["__slots__"] = tuple(slots)
+
+        # the (attribute name, value) pairs set on new instances, see
+        # BaseModel.__new__()
+        if not "__initial__" in dict:
+            initial = OrderedDict()
+            for base in bases:
+                initial.update(getattr(base, "__initial__", ()))
+            if compact:
+                for prop in properties:
+                    default = dict[prop].default
+                    if not isinstance(default, types.FunctionType):
+                        initial[private(prop)] = default
+            dict["__initial__"] = tuple(initial.iteritems())
+
         # we do it this way to avoid modifying dict while iterating it
         if not "__signals__" in dict:
             dict["__signals__"] = {}
@@ -102,15 +366,30 @@ class BaseMeta(type):
         deferred = {}
         dict["__deferred__"] = deferred
 
+        # (name, declaration) pairs of the aggregate properties, see the
+        # aggregate module
+        aggregates = OrderedDict()
+        for base in bases:
+            aggregates.update(getattr(base, "__aggregates__", ()))
+        for prop in properties:
+            if hasattr(dict[prop], "bind"):
+                aggregates[prop] = dict[prop]
+        dict["__aggregates__"] = tuple(aggregates.iteritems())
+
         for prop in properties:
             dict["__properties__"] = properties
 
             # don't set the default value for functions yet
             if isinstance(dict[prop].default, types.FunctionType):
                 deferred[prop] = dict[prop].default
-            else:
+            elif not compact:
                 dict[private(prop)] = dict[prop].default
-            dict[prop] = property_descriptor(prop)
+            if dict[prop].lazy:
+                descriptor = lazy_property_descriptor
+            else:
+                descriptor = property_descriptor
+            dict[prop] = descriptor(prop, dict[prop].compare,
+                dict[prop].parallel)
             signals[signame(prop)] = ["new", "old"]
 
         return type.__new__(self, name, bases, dict)
@@ -126,29 +405,153 @@ class BaseModel(Observable):
 
     __signals__ = {
         "attribute-changed": ("name", "old_value", "new_value"),
+        "attribute-invalidated": ("name",),
         "child-added": ("child",),
         "child-removed": ("child",),
+        # emitted by the bulk operations: children are the children added
+        # at index, ranges the (index, children) runs removed, see
+        # remove_children()
+        "children-added": ("index", "children"),
+        "children-removed": ("ranges",),
     }
 
     __name__ = "BaseModel"
 
+    __slots__ = ("__children", "_signal_group", "_dependents", "_versions",
+        "_pending_notify", "_notify_frozen", "_aggregates", "__weakref__")
+
+    __initial__ = (
+        ("_dependents", None),
+        ("_versions", None),
+        ("_pending_notify", None),
+        ("_notify_frozen", 0),
+        ("_aggregates", None),
+    )
+
+    def __new__(cls, *args, **kwargs):
+        self = Observable.__new__(cls)
+        for name, value in cls.__initial__:
+            setattr(self, name, value)
+        return self
+
     def __init__(self):
-        self.__children = []
+        self.__children = ChildList()
         for prop, function in self.__deferred__.iteritems():
             method = types.MethodType(function, self, self.__class__)
             setattr(self, prop, value)
 
+    @contextmanager
+    def freeze_notify(self):
+        """Defer this model's change notifications until the outermost
+        freeze_notify() block exits, coalescing them to one per changed
+        property (see batch_notify())."""
+        self._notify_frozen += 1
+        try:
+            yield self
+        finally:
+            self._notify_frozen -= 1
+            if not self._notify_frozen and not _batch.depth:
+                self._thaw_notify()
+
+    def _queue_notify(self, name, oldvalue, value):
+        pending = self._pending_notify
+        if pending is None:
+            pending = self._pending_notify = OrderedDict()
+            _batch.models[self] = None
+        if name in pending:
+            pending[name][1] = value
+        else:
+            pending[name] = [oldvalue, value]
+
+    def _thaw_notify(self):
+        pending = self._pending_notify
+        self._pending_notify = None
+        _batch.models.pop(self, None)
+        if not pending:
+            return
+        cls = self.__class__
+        for name, (oldvalue, value) in pending.iteritems():
+            if not getattr(cls, name).compare(oldvalue, value):
+                self.emit("attribute-changed", name, oldvalue, value)
+                self.emit(signame(name), oldvalue, value)
+
+    @main_loop_method
     def add_child(self, child):
         assert isinstance(child, BaseModel)
         self.__children.append(child)
+        self._children_changed((child,), ())
         self.emit("child-added", child)
 
+    @main_loop_method
+    def insert_child(self, index, child):
+        """Insert child before the child at index, like list.insert()"""
+        assert isinstance(child, BaseModel)
+        self.__children.insert(index, (child,))
+        self._children_changed((child,), ())
+        self.emit("child-added", child)
+
+    @main_loop_method
     def remove_child(self, child):
         self.__children.remove(child)
+        self._children_changed((), (child,))
         self.emit("child-removed", child)
 
+    @main_loop_method
+    def add_children(self, children, index=None):
+        """Add the children, at the end or before the child at index. A
+        single children-added signal is emitted, instead of child-added
+        for each child."""
+        children = list(children)
+        for child in children:
+            assert isinstance(child, BaseModel)
+        if index is None:
+            index = len(self.__children)
+            self.__children.extend(children)
+        else:
+            index = self.__children.insert(index, children)
+        self._children_changed(children, ())
+        self.emit("children-added", index, children)
+
+    @main_loop_method
+    def remove_children(self, children):
+        """Remove the children. A single children-removed signal is
+        emitted, instead of child-removed for each child, with the runs of
+        consecutive removed children as (index, children) pairs. Their
+        indices are those before the removal, in decreasing order, so
+        that the runs can be removed from a copy of the list one after
+        the other."""
+        ranges = self.__children.remove_all(children)
+        self._children_changed((), [child for index, run in ranges
+            for child in run])
+        self.emit("children-removed", ranges)
+
+    def get_child_count(self):
+        return len(self.__children)
+
+    def index_of_child(self, child):
+        return self.__children.index(child)
+
+    def _children_changed(self, added, removed):
+        aggregates = self._aggregates
+        if aggregates is None and self.__aggregates__:
+            aggregates = self._aggregates = [declaration.bind(self, name)
+                for name, declaration in self.__aggregates__]
+        if aggregates:
+            for aggregate in aggregates:
+                aggregate.update(added, removed)
+        if get_dependents(self, _children.name):
+            propagate(self, _children, None, None)
+
     def iter_children(self):
         return iter(self.__children)
 
+    def _get_children(self):
+        return self.__children
+
+    def _set_children(self, children):
+        """Replace the list of children, without any notification. For
+        loaders, see the mapped module."""
+        self.__children = children
+
     def iter_attributes(self):
         return self.__attributes.iteritems()
@@ -0,0 +1,169 @@
+"""
+Ordered collection of the children of a model
+"""
+
+# indices of the links of a node
+PREV, NEXT, CHILD = 0, 1, 2
+
+class ChildList(object):
+
+    """A doubly linked list of objects, indexed by identity. Appending,
+    and removing or inserting next to a given object, are O(1). Inserting
+    at an index walks from the nearest end of the list, but never copies
+    it. Iteration is in order, and an object may only appear once."""
+
+    __slots__ = ("root", "nodes")
+
+    def __init__(self, children=()):
+        # circular list with a sentinel node
+        self.root = root = []
+        root[:] = [root, root, None]
+        # key: id(child)
+        # value: node
+        self.nodes = {}
+        self.extend(children)
+
+    def __getstate__(self):
+        # pickled as a plain list, as the nodes nest as deep as the list is
+        # long
+        return list(self)
+
+    def __setstate__(self, children):
+        self.__init__(children)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, child):
+        return id(child) in self.nodes
+
+    def __iter__(self):
+        root = self.root
+        node = root[NEXT]
+        while node is not root:
+            yield node[CHILD]
+            # the caller may have removed this child and the following
+            # ones, whose NEXT links lead back into the list
+            node = node[NEXT]
+            while node[PREV] is None:
+                node = node[NEXT]
+
+    def __getitem__(self, index):
+        return self._node_at(index)[CHILD]
+
+    def _node_at(self, index):
+        size = len(self.nodes)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("child index out of range")
+        root = self.root
+        if index < size // 2:
+            node = root[NEXT]
+            for i in xrange(index):
+                node = node[NEXT]
+        else:
+            node = root[PREV]
+            for i in xrange(size - 1 - index):
+                node = node[PREV]
+        return node
+
+    def _check_new(self, children):
+        # so that a failed insertion leaves the list unchanged
+        keys = set()
+        for child in children:
+            key = id(child)
+            if key in self.nodes or key in keys:
+                raise Exception("%r is already a child" % child)
+            keys.add(key)
+
+    def _link(self, child, following):
+        key = id(child)
+        if key in self.nodes:
+            raise Exception("%r is already a child" % child)
+        previous = following[PREV]
+        node = [previous, following, child]
+        previous[NEXT] = following[PREV] = node
+        self.nodes[key] = node
+
+    def append(self, child):
+        self._link(child, self.root)
+
+    def extend(self, children):
+        children = list(children)
+        self._check_new(children)
+        for child in children:
+            self._link(child, self.root)
+
+    def insert(self, index, children):
+        """Insert the children before the one at index, or at the end if
+        index is the length of the list or more. Negative indices count
+        from the end, like list.insert(). Returns the index of the first
+        inserted child."""
+        children = list(children)
+        self._check_new(children)
+        size = len(self.nodes)
+        if index < 0:
+            index = max(index + size, 0)
+        if index >= size:
+            following = self.root
+        else:
+            following = self._node_at(index)
+        for child in children:
+            self._link(child, following)
+        return min(index, size)
+
+    def insert_before(self, sibling, children):
+        """Insert the children before sibling"""
+        following = self.nodes[id(sibling)]
+        children = list(children)
+        self._check_new(children)
+        for child in children:
+            self._link(child, following)
+
+    def remove_all(self, children):
+        """Remove the children. Returns their runs, see get_ranges()."""
+        children = list(children)
+        keys = set()
+        for child in children:
+            key = id(child)
+            if key not in self.nodes or key in keys:
+                raise ValueError("%r is not a child" % child)
+            keys.add(key)
+        ranges = self.get_ranges(children)
+        for child in children:
+            self.remove(child)
+        return ranges
+
+    def remove(self, child):
+        node = self.nodes.pop(id(child), None)
+        if node is None:
+            raise ValueError("%r is not a child" % child)
+        previous, following = node[PREV], node[NEXT]
+        previous[NEXT] = following
+        following[PREV] = previous
+        # unlinked nodes keep their NEXT link, for iterators
+        node[PREV] = None
+
+    def index(self, child):
+        for i, other in enumerate(self):
+            if other is child:
+                return i
+        raise ValueError("%r is not a child" % child)
+
+    def get_ranges(self, children):
+        """Return the runs of the given children in the list, as (index,
+        children) pairs, in decreasing order of index"""
+        keys = set(id(child) for child in children)
+        ranges = []
+        run = None
+        for i, child in enumerate(self):
+            if id(child) in keys:
+                if run is None:
+                    run = (i, [])
+                    ranges.append(run)
+                run[1].append(child)
+            else:
+                run = None
+        ranges.reverse()
+        return ranges
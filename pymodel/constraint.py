@@ -0,0 +1,382 @@
+"""
+Dependency graph and change propagation for constraint properties
+"""
+
+from multiprocessing.pool import ThreadPool
+import operator
+import threading
+import weakref
+
+# comparators for property(compare=...), returning True when two values
+# are to be considered equal
+
+equal = operator.eq
+
+# cheap comparison for large containers, which are replaced rather than
+# mutated
+identical = operator.is_
+
+def close(tolerance=1e-9):
+    """Return a comparator considering numbers equal when they differ by
+    at most tolerance"""
+    def compare(a, b):
+        try:
+            return abs(a - b) <= tolerance
+        except TypeError:
+            return a == b
+    return compare
+
+# Versions are taken from a global clock, which ticks on every change, so
+# that a constraint only needs to remember when it was evaluated to tell
+# whether any of its dependencies changed since.
+_clock = 0
+
+def get_version(obj, name):
+    """Return the version of the property name of obj: the clock tick of
+    its last change"""
+    versions = getattr(obj, "_versions", None)
+    if versions is None:
+        return 0
+    return versions.get(name, 0)
+
+def bump_version(obj, name):
+    global _clock
+    versions = getattr(obj, "_versions", None)
+    if versions is None:
+        versions = obj._versions = {}
+    _clock += 1
+    versions[name] = _clock
+
+def get_dependents(obj, name):
+    """Return the set of constraints which depend on the property name of
+    obj"""
+    dependents = getattr(obj, "_dependents", None)
+    if dependents is None:
+        return ()
+    return dependents.get(name, ())
+
+def add_dependent(obj, name, constraint):
+    dependents = getattr(obj, "_dependents", None)
+    if dependents is None:
+        dependents = obj._dependents = {}
+    dependents.setdefault(name, set()).add(constraint)
+
+def remove_dependent(obj, name, constraint):
+    dependents = getattr(obj, "_dependents", None)
+    if dependents is None:
+        return
+    constraints = dependents.get(name)
+    if constraints is not None:
+        constraints.discard(constraint)
+        if not constraints:
+            del dependents[name]
+
+class TrackingState(threading.local):
+
+    """Per-thread dependency tracking state. frame is the set of (object,
+    property name) pairs read by the constraint being evaluated in this
+    thread, or None. Constraint functions run synchronously, so interleaved
+    asyncio tasks can't observe each other's frames either."""
+
+    frame = None
+
+_tracking = TrackingState()
+
+# every installed constraint, see get_constraints()
+_constraints = weakref.WeakSet()
+
+def get_constraints():
+    """Return a list of the installed constraints"""
+    return list(_constraints)
+
+class Constraint(object):
+
+    """A property whose value is computed by a function of other
+    properties.
+
+    @ivar dependencies: the (object, property name) pairs the function read
+    the last time it was evaluated
+    @ivar version: the clock tick at that time
+    @ivar dirty: whether the value of a lazy constraint is out of date
+    @ivar evaluations: the number of times the function was evaluated
+    @ivar time: the total time spent evaluating the function, in seconds,
+    including the evaluation of the lazy constraints it read"""
+
+    __slots__ = ("instance", "descriptor", "function", "dependencies",
+        "version", "dirty", "evaluations", "time", "__weakref__")
+
+    def __init__(self, instance, descriptor, function):
+        self.instance = instance
+        self.descriptor = descriptor
+        self.function = function
+        self.dependencies = set()
+        self.version = 0
+        self.dirty = False
+        self.evaluations = 0
+        self.time = 0.0
+        _constraints.add(self)
+
+    def __repr__(self):
+        return "<Constraint %s>" % self.get_name()
+
+    def get_name(self):
+        return "%s.%s" % (self.instance.__class__.__name__,
+            self.descriptor.name)
+
+    def get_dependents(self):
+        return get_dependents(self.instance, self.descriptor.name)
+
+    def update_dependencies(self, dependencies):
+        """Subscribe to the given (object, property name) pairs, and
+        unsubscribe from the previous dependencies which aren't among
+        them. Each pair is subscribed to once, however many times it was
+        read."""
+        dependencies = set(dependencies)
+        old = self.dependencies
+        if dependencies == old:
+            return
+        for obj, name in old - dependencies:
+            remove_dependent(obj, name, self)
+        for obj, name in dependencies - old:
+            add_dependent(obj, name, self)
+        self.dependencies = dependencies
+
+    def clear(self):
+        """Unsubscribe from all dependencies. This is done when the
+        constraint is removed."""
+        for obj, name in self.dependencies:
+            remove_dependent(obj, name, self)
+        self.dependencies = set()
+        _constraints.discard(self)
+
+    def find_cycle(self):
+        """Return the list of constraints through which a change of this
+        constraint propagates back to it, starting and ending with this
+        constraint, or None if its value doesn't depend on itself"""
+        # depth first search of the dependents of the property, with the
+        # path to the current constraint on the stack
+        stack = [(None, iter(self.get_dependents()))]
+        visited = set()
+        while stack:
+            for child in stack[-1][1]:
+                if child is self:
+                    return [self] + [c for c, dummy in stack[1:]] + [self]
+                if child not in visited:
+                    visited.add(child)
+                    stack.append((child, iter(child.get_dependents())))
+                    break
+            else:
+                stack.pop()
+        return None
+
+    def check_cycle(self):
+        """Raise an exception if the value of this constraint depends on
+        itself. This is done when the constraint is installed, after its
+        first evaluation."""
+        cycle = self.find_cycle()
+        if cycle is not None:
+            raise Exception("cyclic constraint: %s" %
+                " -> ".join(c.get_name() for c in cycle))
+
+    def record_version(self):
+        """Remember that the stored value was computed from the current
+        versions of the dependencies"""
+        self.version = _clock
+
+    def is_current(self):
+        """Return True if no dependency changed since the value was
+        computed, so that computing it again would give the same result"""
+        version = self.version
+        for obj, name in self.dependencies:
+            versions = getattr(obj, "_versions", None)
+            if versions is not None and versions.get(name, 0) > version:
+                return False
+        return True
+
+    def recompute(self):
+        """Evaluate the function and store its value. Returns the old and
+        new values, or None if the constraint is no longer installed."""
+        return self.descriptor._recompute(self.instance, self)
+
+    def invalidate(self):
+        """Mark a lazy constraint dirty. Returns False if it already was,
+        or is no longer installed."""
+        return self.descriptor._invalidate(self.instance, self)
+
+    def compute(self):
+        """Evaluate the function of a parallel constraint, without storing
+        anything. This may be called from any thread."""
+        return self.descriptor._compute(self.instance, self)
+
+    def commit(self, result):
+        """Store the result of compute(), like recompute()"""
+        return self.descriptor._commit(self.instance, self, result)
+
+class Propagator(object):
+
+    """Propagates property changes to the constraints which depend on
+    them, in waves.
+
+    Changes are recorded with changed(), and handled by run(). A wave takes
+    every pending change, finds all the constraints which transitively
+    depend on the changed properties, and recomputes each of them exactly
+    once, in topological order. Lazy constraints are only invalidated.
+    Only then are the change notifications emitted, first for the changed
+    properties, then for the recomputed constraints in the same order, and
+    last for the invalidated ones, so that observers never see a partially
+    updated graph.
+
+    Propagation stops at constraints whose recomputed value compares equal
+    to the previous one (see property(compare=...)): the constraints which
+    depend only on unchanged values are skipped, as each property has a
+    version which is only increased by actual changes.
+
+    Changes made by signal handlers start a new wave. Changes made while
+    constraints are being recomputed are handled after the current
+    wave. Dependencies a constraint gains while it is recomputed take
+    effect from the next wave.
+
+    Parallel constraints (see property(parallel=True)) which don't depend
+    on each other are evaluated concurrently on the pool. The waves which
+    include some are split into levels: the constraints of a level only
+    depend on those of the previous levels. The parallel constraints of a
+    level are evaluated on the pool, while the calling thread waits, and
+    their results are stored by the calling thread, in topological
+    order."""
+
+    def __init__(self, pool=None):
+        self.pending = []
+        self.computing = False
+        # any object with a map() method running the calls on other
+        # threads, created on first use if not given
+        self.pool = pool
+        # number of constraint evaluations made by waves
+        self.recomputes = 0
+        # number of planned constraints skipped because none of their
+        # dependencies changed
+        self.skipped = 0
+        self.waves = 0
+
+    def changed(self, instance, descriptor, oldvalue, value):
+        bump_version(instance, descriptor.name)
+        self.pending.append((instance, descriptor, oldvalue, value))
+
+    def run(self):
+        if self.computing:
+            return
+        while self.pending:
+            changes, self.pending = self.pending, []
+            self._wave(changes)
+
+    def plan(self, sources):
+        """Return the constraints depending on the given (object, property
+        name) pairs, in topological order"""
+        # iterative depth first search, so that long dependency chains
+        # don't hit the recursion limit
+        postorder = []
+        visited = set()
+        for obj, name in sources:
+            for root in get_dependents(obj, name):
+                if root in visited:
+                    continue
+                visited.add(root)
+                stack = [(root, iter(root.get_dependents()))]
+                while stack:
+                    constraint, children = stack[-1]
+                    for child in children:
+                        if child not in visited:
+                            visited.add(child)
+                            stack.append((child,
+                                iter(child.get_dependents())))
+                            break
+                    else:
+                        stack.pop()
+                        postorder.append(constraint)
+        postorder.reverse()
+        return postorder
+
+    def schedule(self, order):
+        """Split a topologically ordered list of constraints in levels
+        which only depend on the previous levels, keeping the order
+        within each level"""
+        # length of the longest path from the changed properties
+        levels = dict.fromkeys(order, 0)
+        for constraint in order:
+            level = levels[constraint] + 1
+            for child in constraint.get_dependents():
+                if levels.get(child, level) < level:
+                    levels[child] = level
+        batches = []
+        for constraint in order:
+            level = levels[constraint]
+            while len(batches) <= level:
+                batches.append([])
+            batches[level].append(constraint)
+        return batches
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = ThreadPool()
+        return self.pool
+
+    def _wave(self, changes):
+        self.waves += 1
+        sources = set((instance, descriptor.name)
+            for instance, descriptor, oldvalue, value in changes)
+        order = self.plan(sources)
+        for constraint in order:
+            if constraint.descriptor.parallel:
+                batches = self.schedule(order)
+                break
+        else:
+            batches = [order]
+
+        recomputed = []
+        invalidated = []
+        self.computing = True
+        try:
+            for batch in batches:
+                jobs = []
+                for constraint in batch:
+                    if constraint.is_current():
+                        self.skipped += 1
+                        continue
+                    descriptor = constraint.descriptor
+                    if descriptor.lazy:
+                        if constraint.invalidate():
+                            bump_version(constraint.instance, descriptor.name)
+                            invalidated.append(constraint)
+                    elif descriptor.parallel:
+                        jobs.append(constraint)
+                    else:
+                        self._update(constraint, constraint.recompute(),
+                            recomputed)
+                if len(jobs) == 1:
+                    self._update(jobs[0], jobs[0].recompute(), recomputed)
+                elif jobs:
+                    results = self.get_pool().map(Constraint.compute, jobs)
+                    for constraint, result in zip(jobs, results):
+                        self._update(constraint, constraint.commit(result),
+                            recomputed)
+        finally:
+            self.computing = False
+
+        for instance, descriptor, oldvalue, value in changes:
+            descriptor._notify(instance, oldvalue, value)
+        for constraint, oldvalue, value in recomputed:
+            constraint.descriptor._notify(constraint.instance, oldvalue,
+                value)
+        for constraint in invalidated:
+            constraint.descriptor._notify_invalidated(constraint.instance)
+
+    def _update(self, constraint, result, recomputed):
+        if result is None:
+            # the constraint has been replaced
+            return
+        self.recomputes += 1
+        oldvalue, value = result
+        descriptor = constraint.descriptor
+        if descriptor.compare(oldvalue, value):
+            return
+        bump_version(constraint.instance, descriptor.name)
+        recomputed.append((constraint, oldvalue, value))
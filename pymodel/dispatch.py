@@ -0,0 +1,259 @@
+"""
+Deferred signal delivery on an event loop
+"""
+
+from collections import deque
+import threading
+import time
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+try:
+    import gobject
+except ImportError:
+    gobject = None
+
+class AsyncDispatcher(object):
+
+    """Queues callback invocations and runs them from an event loop.
+
+    The loop only needs to provide asyncio's call_soon() and time()
+    methods; it defaults to asyncio's current event loop. At most one
+    drain callback is scheduled on the loop at a time, however many
+    deliveries are queued.
+
+    The queue holds at most maxsize deliveries. When it is full, the
+    caller of queue() drains it synchronously before queueing, which
+    keeps delivery in order and slows down producers which outrun the
+    loop.
+
+    Callbacks returning a coroutine are scheduled as tasks on the loop."""
+
+    # number of deliveries run by each drain callback before yielding
+    # back to the loop
+    chunk = 64
+
+    def __init__(self, loop=None, maxsize=1000):
+        if loop is None:
+            if asyncio is None:
+                raise Exception("asyncio is not available, a loop must be "
+                    "provided")
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.maxsize = maxsize
+        self.pending = deque()
+        self.scheduled = False
+
+        # metrics
+        self.max_depth = 0
+        self.delivered = 0
+        self.overflows = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def queue(self, callback, args=(), kwargs=None):
+        """Queue the call callback(*args, **kwargs)"""
+        if len(self.pending) >= self.maxsize:
+            self.overflows += 1
+            self.flush()
+        self.pending.append((callback, args, kwargs, self.loop.time()))
+        depth = len(self.pending)
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon(self._drain)
+
+    def flush(self):
+        """Deliver every queued call now"""
+        while self.pending:
+            self._deliver(*self.pending.popleft())
+
+    def get_depth(self):
+        return len(self.pending)
+
+    def get_stats(self):
+        """Return a dictionnary of delivery metrics. Latencies are in
+        seconds of loop time, from queue() to delivery."""
+        mean = 0.0
+        if self.delivered:
+            mean = self.total_latency / self.delivered
+        return {
+            "depth": len(self.pending),
+            "max_depth": self.max_depth,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+            "mean_latency": mean,
+            "max_latency": self.max_latency,
+        }
+
+    def _drain(self):
+        self.scheduled = False
+        pending = self.pending
+        for i in xrange(self.chunk):
+            if not pending:
+                return
+            self._deliver(*pending.popleft())
+        if pending and not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon(self._drain)
+
+    def _deliver(self, callback, args, kwargs, queued):
+        latency = self.loop.time() - queued
+        self.delivered += 1
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+        if kwargs:
+            res = callback(*args, **kwargs)
+        else:
+            res = callback(*args)
+        if asyncio is not None and asyncio.iscoroutine(res):
+            asyncio.ensure_future(res, loop=self.loop)
+
+class ThreadSafeDispatcher(AsyncDispatcher):
+
+    """An AsyncDispatcher which may be fed from any thread, and delivers
+    from the thread which created it (the owner), by waking its loop with
+    call_soon_threadsafe(). A burst of deliveries queued from other
+    threads causes a single wakeup.
+
+    When the queue is full, the owner drains it synchronously, and other
+    threads wait until the owner's loop has made room."""
+
+    def __init__(self, loop=None, maxsize=1000):
+        AsyncDispatcher.__init__(self, loop, maxsize)
+        self.thread = threading.current_thread()
+        self.lock = threading.Condition(threading.Lock())
+
+    def is_owner(self):
+        return threading.current_thread() is self.thread
+
+    def queue(self, callback, args=(), kwargs=None):
+        owner = self.is_owner()
+        with self.lock:
+            if len(self.pending) >= self.maxsize:
+                self.overflows += 1
+            while len(self.pending) >= self.maxsize:
+                if owner:
+                    self.lock.release()
+                    try:
+                        self.flush()
+                    finally:
+                        self.lock.acquire()
+                else:
+                    self.lock.wait()
+            self.pending.append((callback, args, kwargs, self.loop.time()))
+            depth = len(self.pending)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            wakeup = not self.scheduled
+            self.scheduled = True
+        if wakeup:
+            if owner:
+                self.loop.call_soon(self._drain)
+            else:
+                self.loop.call_soon_threadsafe(self._drain)
+
+    def flush(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return
+                item = self.pending.popleft()
+                self.lock.notify_all()
+            self._deliver(*item)
+
+    def get_depth(self):
+        with self.lock:
+            return len(self.pending)
+
+    def _drain(self):
+        with self.lock:
+            self.scheduled = False
+            items = []
+            pending = self.pending
+            while pending and len(items) < self.chunk:
+                items.append(pending.popleft())
+            self.lock.notify_all()
+        for item in items:
+            self._deliver(*item)
+        with self.lock:
+            wakeup = self.pending and not self.scheduled
+            if wakeup:
+                self.scheduled = True
+        if wakeup:
+            self.loop.call_soon(self._drain)
+
+class GLibLoop(object):
+
+    """Adapts the GLib main loop to the loop interface used by the
+    dispatchers. Callbacks run from idle handlers."""
+
+    def __init__(self):
+        if gobject is None:
+            raise Exception("gobject is not available")
+
+    def call_soon(self, callback, *args):
+        gobject.idle_add(self._run, callback, args)
+
+    # g_idle_add() may be called from any thread
+    call_soon_threadsafe = call_soon
+
+    def time(self):
+        return time.time()
+
+    def _run(self, callback, args):
+        callback(*args)
+        return False
+
+class QueuedCallback(object):
+
+    """Wraps a signal handler so that calling it queues the call on a
+    dispatcher instead. See Observable.connect_async()."""
+
+    __slots__ = ("callback", "dispatcher")
+
+    def __init__(self, callback, dispatcher=None):
+        self.callback = callback
+        self.dispatcher = dispatcher
+
+    def __call__(self, *args, **kwargs):
+        dispatcher = self.dispatcher or get_dispatcher()
+        dispatcher.queue(self.callback, args, kwargs)
+
+_dispatcher = None
+
+def get_dispatcher():
+    """Return the default dispatcher, creating one on asyncio's current
+    event loop if none was set"""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = AsyncDispatcher()
+    return _dispatcher
+
+def set_dispatcher(dispatcher):
+    """Set the default dispatcher used by emit_async() and
+    connect_async()"""
+    global _dispatcher
+    _dispatcher = dispatcher
+
+_main_dispatcher = None
+
+def get_main_dispatcher():
+    """Return the ThreadSafeDispatcher to which thread-safe observables
+    marshal emissions from other threads, or None"""
+    return _main_dispatcher
+
+def set_main_dispatcher(dispatcher):
+    """Set the ThreadSafeDispatcher of the main loop. This must be a
+    dispatcher created from the main loop's thread."""
+    global _main_dispatcher
+    _main_dispatcher = dispatcher
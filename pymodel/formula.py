@@ -0,0 +1,202 @@
+"""
+Spreadsheet style formulas
+
+A formula is a Python expression, given as text, computing the value of a
+property. It is assigned to the property like a constraint function:
+
+    account.balance = formula("self.credit - self.debit")
+    total.value = formula("sum(c.balance for c in children)")
+
+The expression is evaluated with self bound to the model, and children to
+the list of its children. It may read the properties of self, and of the
+children through a generator expression or comprehension over children,
+and call the builtins of _builtins. Builtins which look attributes up by
+name, run code or access files, like getattr(), eval() or open(), are
+rejected, and so are the attributes whose name starts with an underscore
+and those leading to frames and globals, like gi_frame or func_globals.
+This keeps formulas loaded with documents to the properties and methods
+of models, but isn't a sandbox: those methods may give access to
+anything, so that documents must come from trusted sources.
+
+Formulas are parsed and compiled once per expression, to a function shared
+by every model using it. The properties a formula reads are found
+from the expression itself, so that it is evaluated without the access
+tracking of lambda constraints. Formulas which read properties in other
+ways (through method calls, or attributes of other objects) are tracked
+as usual. The text of a formula can be saved, see
+basemodel.get_formula().
+"""
+
+from functools import partial
+import __builtin__
+import ast
+from constraint import _tracking
+
+# key: expression
+# value: Formula
+_cache = {}
+
+# the builtins formulas may use
+_builtins = dict((name, getattr(__builtin__, name)) for name in (
+    "abs", "all", "any", "bool", "cmp", "dict", "divmod", "enumerate",
+    "False", "filter", "float", "int", "isinstance", "iter", "len", "list",
+    "long", "map", "max", "min", "next", "None", "pow", "range", "reduce",
+    "reversed", "round", "set", "sorted", "str", "sum", "True", "tuple",
+    "unicode", "xrange", "zip"))
+
+# attributes leading to frames, code and globals, which formulas can't read
+_internals = frozenset([
+    "f_back", "f_builtins", "f_code", "f_globals", "f_locals",
+    "func_closure", "func_code", "func_globals", "gi_code", "gi_frame",
+    "im_class", "im_func", "im_self", "tb_frame", "tb_next"])
+
+def formula(text):
+    """Return the compiled formula for the expression text"""
+    compiled = _cache.get(text)
+    if compiled is None:
+        compiled = _cache[text] = Formula(text)
+    return compiled
+
+class Analyzer(ast.NodeVisitor):
+
+    """Finds the properties read by an expression"""
+
+    def __init__(self, text):
+        self.text = text
+        # names of properties of self
+        self.attributes = set()
+        # names of properties of the children
+        self.child_attributes = set()
+        self.uses_children = False
+        # False if the expression may read properties it doesn't name
+        self.static = True
+        # stack of scopes, dictionaries with a value of True for the
+        # variables iterating over children
+        self.scopes = [{"self": False, "children": False}]
+
+    def lookup(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return None
+
+    def visit_Name(self, node):
+        if node.id == "children":
+            self.uses_children = True
+        elif self.lookup(node.id) is None and node.id not in _builtins:
+            raise Exception("unknown name %r in formula %r" % (node.id,
+                self.text))
+
+    def visit_Attribute(self, node):
+        if node.attr.startswith("_") or node.attr in _internals:
+            raise Exception("attribute %r can't be read in formula %r" % (
+                node.attr, self.text))
+        if isinstance(node.value, ast.Name):
+            if node.value.id == "self":
+                self.attributes.add(node.attr)
+                return
+            if self.lookup(node.value.id):
+                self.child_attributes.add(node.attr)
+                return
+        self.static = False
+        self.visit(node.value)
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name):
+            self.static = False
+        self.generic_visit(node)
+
+    def visit_Lambda(self, node):
+        scope = {}
+        for arg in node.args.args:
+            self.bind(arg, False, scope)
+        self.scopes.append(scope)
+        self.generic_visit(node)
+        self.scopes.pop()
+
+    def bind(self, target, child, scope):
+        if isinstance(target, ast.Name):
+            scope[target.id] = child
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for element in target.elts:
+                self.bind(element, False, scope)
+        else:
+            raise Exception("unsupported target in formula %r" % self.text)
+
+    def visit_comprehension_node(self, node, elements):
+        scope = {}
+        self.scopes.append(scope)
+        for generator in node.generators:
+            self.visit(generator.iter)
+            child = isinstance(generator.iter, ast.Name) and \
+                generator.iter.id == "children"
+            self.bind(generator.target, child, scope)
+            for condition in generator.ifs:
+                self.visit(condition)
+        for element in elements:
+            self.visit(element)
+        self.scopes.pop()
+
+    def visit_GeneratorExp(self, node):
+        self.visit_comprehension_node(node, [node.elt])
+
+    visit_ListComp = visit_SetComp = visit_GeneratorExp
+
+    def visit_DictComp(self, node):
+        self.visit_comprehension_node(node, [node.key, node.value])
+
+class Formula(object):
+
+    """A compiled formula. Calling it with a model evaluates it."""
+
+    def __init__(self, text):
+        self.text = text
+        tree = ast.parse(text.strip(), "<formula>", "eval")
+        analyzer = Analyzer(text)
+        analyzer.visit(tree)
+        self.attributes = tuple(sorted(analyzer.attributes))
+        self.child_attributes = tuple(sorted(analyzer.child_attributes))
+        self.uses_children = analyzer.uses_children
+        self.static = analyzer.static
+        self.function = eval(compile("lambda self, children: (%s)" %
+            text.strip(), "<formula>", "eval"), {"__builtins__": _builtins})
+
+    def __repr__(self):
+        return "formula(%r)" % self.text
+
+    def bind(self, instance):
+        """Return the constraint function evaluating the formula for
+        instance"""
+        return partial(self, instance)
+
+    def get_dependencies(self, instance, children):
+        dependencies = [(instance, name) for name in self.attributes]
+        if self.uses_children:
+            dependencies.append((instance, "__children__"))
+            for child in children:
+                for name in self.child_attributes:
+                    dependencies.append((child, name))
+        return dependencies
+
+    def __call__(self, instance):
+        if self.uses_children:
+            children = list(instance.iter_children())
+        else:
+            children = ()
+        if not self.static:
+            # the list of children is read here, not through tracked
+            # properties
+            frame = _tracking.frame
+            if frame is not None and self.uses_children:
+                frame.add((instance, "__children__"))
+            return self.function(instance, children)
+
+        frame = _tracking.frame
+        _tracking.frame = None
+        try:
+            value = self.function(instance, children)
+        finally:
+            _tracking.frame = frame
+        if frame is not None:
+            frame.update(self.get_dependencies(instance, children))
+        return value
@@ -0,0 +1,159 @@
+"""
+Introspection of the constraint dependency graph
+
+The nodes of the graph are properties, identified by (object, property
+name) pairs. There is an edge from each property read by a constraint to
+the property computed by the constraint. Only the installed constraints
+and the properties they read are included.
+
+Each constraint counts its evaluations and the time spent in them, which
+get_hot() uses to find the expensive parts of a document. The graph, or
+the part of it which feeds some constraints, can be exported to the DOT
+format of graphviz and to JSON.
+"""
+
+import json
+from constraint import get_constraints
+
+def get_edges(constraints=None):
+    """Return the (dependency, constraint) pairs of the graph of the given
+    constraints, or of every installed constraint"""
+    if constraints is None:
+        constraints = get_constraints()
+    edges = []
+    for constraint in constraints:
+        for dependency in constraint.dependencies:
+            edges.append((dependency, constraint))
+    return edges
+
+def get_upstream(constraints):
+    """Return the given constraints and all the constraints they
+    transitively depend on"""
+    installed = {}
+    for constraint in get_constraints():
+        installed[(constraint.instance, constraint.descriptor.name)] = \
+            constraint
+    result = []
+    seen = set()
+    stack = list(constraints)
+    while stack:
+        constraint = stack.pop()
+        if constraint in seen:
+            continue
+        seen.add(constraint)
+        result.append(constraint)
+        for dependency in constraint.dependencies:
+            upstream = installed.get(dependency)
+            if upstream is not None:
+                stack.append(upstream)
+    return result
+
+def get_hot(limit=None):
+    """Return the installed constraints sorted by decreasing total
+    evaluation time, only the limit first ones if given"""
+    constraints = sorted(get_constraints(), key=lambda c: c.time,
+        reverse=True)
+    if limit is not None:
+        constraints = constraints[:limit]
+    return constraints
+
+def reset_stats():
+    """Reset the evaluation counts and times of the installed
+    constraints"""
+    for constraint in get_constraints():
+        constraint.evaluations = 0
+        constraint.time = 0.0
+
+class Graph(object):
+
+    """Snapshot of the graph of a set of constraints, with stable node
+    identifiers for export"""
+
+    def __init__(self, constraints=None):
+        if constraints is None:
+            constraints = get_constraints()
+        # sorted by name, so that exports are easy to compare
+        self.constraints = sorted(constraints, key=lambda c: c.get_name())
+        self.edges = sorted(get_edges(self.constraints),
+            key=lambda (dependency, constraint): (constraint.get_name(),
+                self.get_label(dependency)))
+        # key: (object, property name)
+        # value: node identifier
+        self.ids = {}
+        # (object, property name) pairs, in order of identifier
+        self.nodes = []
+        # key: (object, property name)
+        # value: Constraint
+        self.computed = {}
+        for constraint in self.constraints:
+            node = (constraint.instance, constraint.descriptor.name)
+            self.computed[node] = constraint
+            self._add_node(node)
+        for dependency, constraint in self.edges:
+            self._add_node(dependency)
+
+    def _add_node(self, node):
+        if node not in self.ids:
+            self.ids[node] = "n%d" % len(self.nodes)
+            self.nodes.append(node)
+
+    def get_label(self, node):
+        obj, name = node
+        return "%s.%s" % (obj.__class__.__name__, name)
+
+    def to_dict(self):
+        nodes = []
+        for node in self.nodes:
+            entry = {
+                "id": self.ids[node],
+                "object": "%s@%x" % (node[0].__class__.__name__,
+                    id(node[0])),
+                "property": node[1],
+            }
+            constraint = self.computed.get(node)
+            if constraint is not None:
+                entry["lazy"] = constraint.descriptor.lazy
+                entry["evaluations"] = constraint.evaluations
+                entry["time"] = constraint.time
+            nodes.append(entry)
+        edges = [{"from": self.ids[dependency],
+            "to": self.ids[(constraint.instance, constraint.descriptor.name)]}
+                for dependency, constraint in self.edges]
+        return {"nodes": nodes, "edges": edges}
+
+    def to_json(self, indent=None):
+        return json.dumps(self.to_dict(), indent=indent, sort_keys=True)
+
+    def to_dot(self):
+        """Return the graph in the DOT format. Constraints are drawn as
+        boxes labelled with their evaluation count and total time, lazy
+        ones dashed."""
+        lines = ["digraph constraints {"]
+        for node in self.nodes:
+            label = self.get_label(node)
+            constraint = self.computed.get(node)
+            if constraint is None:
+                attrs = 'label="%s"' % label
+            else:
+                attrs = 'shape=box, label="%s\\n%d evals, %.3f ms"' % (
+                    label, constraint.evaluations, constraint.time * 1000)
+                if constraint.descriptor.lazy:
+                    attrs += ", style=dashed"
+            lines.append("    %s [%s];" % (self.ids[node], attrs))
+        for dependency, constraint in self.edges:
+            lines.append("    %s -> %s;" % (self.ids[dependency],
+                self.ids[(constraint.instance, constraint.descriptor.name)]))
+        lines.append("}")
+        return "\n".join(lines)
+
+def to_dot(constraints=None):
+    """Return the graph of the given constraints, or of every installed
+    constraint, in the DOT format"""
+    return Graph(constraints).to_dot()
+
+def to_json(constraints=None, indent=None):
+    """Return the graph of the given constraints, or of every installed
+    constraint, as JSON: a list of nodes with their identifier, object,
+    property name and, for constraints, evaluation statistics, and a list
+    of edges between node identifiers."""
+    return Graph(constraints).to_json(indent)
@@ -0,0 +1,329 @@
+"""
+Indexes of the descendants of a model by the value of a property
+
+    class Ledger(BaseModel):
+
+        by_payee = index(HashIndex, "payee", Transaction)
+        by_debit = index(SortedIndex, "debit", Transaction)
+
+    ledger.by_payee.get("rent")                  # payee == "rent"
+    ledger.by_debit.range(100, None, (False, True))   # debit > 100
+    ledger.by_payee.get_memory()
+
+An index maps the values of the property attribute of the descendants of
+a model, at any depth, to those descendants. If a class is given, only
+the descendants of that class are indexed, otherwise those having the
+property. The index is built when it is first read, and then updated from
+the -changed signal of the property and the child-added, child-removed,
+children-added and children-removed signals of the tree.
+
+HashIndex answers equality lookups, and is updated in constant time.
+SortedIndex also answers range and prefix lookups, in order of value, and
+is updated in logarithmic time. Values must be hashable for the former,
+and comparable for the latter.
+
+Indexed properties can't be lazy, as those don't emit -changed signals.
+"""
+
+from bisect import bisect_left, insort
+import sys
+import weakref
+from basemodel import signame
+
+class SortedList(object):
+
+    """Sorted list of distinct items, kept as sorted sublists of at most
+    2 * load items, so that adding or removing an item costs a binary
+    search and moving at most that many items"""
+
+    load = 512
+
+    def __init__(self):
+        self.lists = []
+        # last item of each sublist
+        self.maxes = []
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, item):
+        lists = self.lists
+        maxes = self.maxes
+        self.size += 1
+        if not lists:
+            lists.append([item])
+            maxes.append(item)
+            return
+        i = bisect_left(maxes, item)
+        if i == len(maxes):
+            i -= 1
+            lists[i].append(item)
+            maxes[i] = item
+        else:
+            insort(lists[i], item)
+        items = lists[i]
+        if len(items) > 2 * self.load:
+            half = items[self.load:]
+            del items[self.load:]
+            maxes[i] = items[-1]
+            lists.insert(i + 1, half)
+            maxes.insert(i + 1, half[-1])
+
+    def remove(self, item):
+        lists = self.lists
+        maxes = self.maxes
+        i = bisect_left(maxes, item)
+        if i < len(maxes):
+            items = lists[i]
+            j = bisect_left(items, item)
+            if j < len(items) and items[j] == item:
+                del items[j]
+                self.size -= 1
+                if not items:
+                    del lists[i]
+                    del maxes[i]
+                elif j == len(items):
+                    maxes[i] = items[-1]
+                return
+        raise ValueError("%r is not in the list" % (item,))
+
+    def iter_from(self, start):
+        """Iterate over the items from the first which isn't smaller than
+        start"""
+        lists = self.lists
+        i = bisect_left(self.maxes, start)
+        if i == len(lists):
+            return
+        j = bisect_left(lists[i], start)
+        while i < len(lists):
+            items = lists[i]
+            while j < len(items):
+                yield items[j]
+                j += 1
+            i += 1
+            j = 0
+
+    def get_memory(self):
+        return sys.getsizeof(self.lists) + sys.getsizeof(self.maxes) + \
+            sum(sys.getsizeof(items) for items in self.lists)
+
+class Index(object):
+
+    """Base class of the indexes of the property attribute of the
+    descendants of root, of class cls if given. Subclasses store the
+    models by value, in their add(model, value) and remove(model, value)
+    methods, and look them up in get(value), which returns the list of
+    the indexed models whose value is value."""
+
+    def __init__(self, root, attribute, cls=None):
+        self.attribute = attribute
+        self.signame = signame(attribute)
+        self.cls = cls
+        # key: id(model)
+        # value: (model, its indexed value)
+        self.entries = {}
+        # root is only referenced by its handlers, see index
+        self.root = weakref.ref(root)
+        self.watch(root, False)
+
+    def is_indexed(self, model):
+        if self.cls is not None:
+            return isinstance(model, self.cls)
+        return hasattr(model.__class__, self.attribute)
+
+    def watch(self, model, indexed=True):
+        """Index model, if indexed is True, and its descendants, and
+        follow their changes"""
+        stack = [model]
+        while stack:
+            model = stack.pop()
+            model.connect("child-added", self.child_added)
+            model.connect("child-removed", self.child_removed)
+            model.connect("children-added", self.children_added)
+            model.connect("children-removed", self.children_removed)
+            if indexed and self.is_indexed(model):
+                value = getattr(model, self.attribute)
+                self.entries[id(model)] = (model, value)
+                self.add(model, value)
+                model.connect(self.signame, self.changed)
+            indexed = True
+            stack.extend(model.iter_children())
+
+    def unwatch(self, model):
+        stack = [model]
+        while stack:
+            model = stack.pop()
+            for function in (self.child_added, self.child_removed,
+                    self.children_added, self.children_removed):
+                model.disconnect_by_function(function)
+            entry = self.entries.pop(id(model), None)
+            if entry is not None:
+                self.remove(model, entry[1])
+                model.disconnect_by_function(self.changed)
+            stack.extend(model.iter_children())
+
+    def close(self):
+        """Stop updating the index, and empty it"""
+        root = self.root()
+        if root is not None:
+            self.unwatch(root)
+
+    def __len__(self):
+        return len(self.entries)
+
+    # signals
+
+    def changed(self, model, oldvalue, value):
+        # a signal deferred by batch_notify() carries the value from before
+        # the block, which predates that under which the model was indexed
+        # if it was added in the block: move it from that value to the
+        # current one instead
+        value = getattr(model, self.attribute)
+        key = id(model)
+        old = self.entries[key][1]
+        self.entries[key] = (model, value)
+        self.replace(model, old, value)
+
+    def child_added(self, parent, child):
+        self.watch(child)
+
+    def child_removed(self, parent, child):
+        self.unwatch(child)
+
+    def children_added(self, parent, index, children):
+        for child in children:
+            self.watch(child)
+
+    def children_removed(self, parent, ranges):
+        for index, run in ranges:
+            for child in run:
+                self.unwatch(child)
+
+    def replace(self, model, old, value):
+        self.remove(model, old)
+        self.add(model, value)
+
+    def get_memory(self):
+        """Return the number of bytes used by the index, not counting the
+        models and values it refers to"""
+        return sys.getsizeof(self.entries) + sum(sys.getsizeof(entry)
+            for entry in self.entries.itervalues())
+
+class HashIndex(Index):
+
+    """Equality lookups"""
+
+    def __init__(self, root, attribute, cls=None):
+        # key: value
+        # value: the model with that value, or {id(model): model} of the
+        # models with that value if there are several
+        self.buckets = {}
+        Index.__init__(self, root, attribute, cls)
+
+    def add(self, model, value):
+        buckets = self.buckets
+        bucket = buckets.get(value)
+        if bucket is None:
+            buckets[value] = model
+        elif isinstance(bucket, dict):
+            bucket[id(model)] = model
+        else:
+            buckets[value] = {id(bucket): bucket, id(model): model}
+
+    def remove(self, model, value):
+        buckets = self.buckets
+        bucket = buckets[value]
+        if not isinstance(bucket, dict):
+            del buckets[value]
+            return
+        del bucket[id(model)]
+        if len(bucket) == 1:
+            buckets[value] = bucket.itervalues().next()
+
+    def get(self, value):
+        bucket = self.buckets.get(value)
+        if bucket is None:
+            return []
+        if isinstance(bucket, dict):
+            return bucket.values()
+        return [bucket]
+
+    def get_memory(self):
+        return Index.get_memory(self) + sys.getsizeof(self.buckets) + \
+            sum(sys.getsizeof(bucket) for bucket in
+                self.buckets.itervalues() if isinstance(bucket, dict))
+
+class SortedIndex(Index):
+
+    """Equality, range and prefix lookups, in order of value"""
+
+    def __init__(self, root, attribute, cls=None):
+        # (value, id(model)) pairs
+        self.items = SortedList()
+        Index.__init__(self, root, attribute, cls)
+
+    def add(self, model, value):
+        self.items.add((value, id(model)))
+
+    def remove(self, model, value):
+        self.items.remove((value, id(model)))
+
+    def get(self, value):
+        return list(self.range(value, value))
+
+    def range(self, low=None, high=None, inclusive=(True, True)):
+        """Iterate over the indexed models whose value is between low and
+        high, in order of value. A bound of None is open. inclusive tells
+        whether models whose value is low or high are included."""
+        entries = self.entries
+        start = () if low is None else (low,)
+        for value, key in self.items.iter_from(start):
+            if low is not None and not inclusive[0] and value == low:
+                continue
+            if high is not None and (value > high or
+                    value == high and not inclusive[1]):
+                return
+            yield entries[key][0]
+
+    def prefix(self, prefix):
+        """Iterate over the indexed models whose value is a string
+        starting with prefix, in order of value"""
+        entries = self.entries
+        for value, key in self.items.iter_from((prefix,)):
+            if not isinstance(value, basestring) or \
+                    not value.startswith(prefix):
+                return
+            yield entries[key][0]
+
+    def get_memory(self):
+        return Index.get_memory(self) + self.items.get_memory() + \
+            sum(sys.getsizeof(item) for items in self.items.lists
+                for item in items)
+
+# key: model
+# value: {index declaration: Index}
+_indexes = weakref.WeakKeyDictionary()
+
+class index(object):
+
+    """Declares an index of the descendants of the model, an instance of
+    kind, HashIndex or SortedIndex, of their property attribute. If cls is
+    given, only the descendants of that class are indexed."""
+
+    def __init__(self, kind, attribute, cls=None):
+        self.kind = kind
+        self.attribute = attribute
+        self.cls = cls
+
+    def __get__(self, instance, cls):
+        if instance is None:
+            return self
+        indexes = _indexes.get(instance)
+        if indexes is None:
+            indexes = _indexes[instance] = {}
+        bound = indexes.get(self)
+        if bound is None:
+            bound = indexes[self] = self.kind(instance, self.attribute,
+                self.cls)
+        return bound
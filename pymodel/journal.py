@@ -0,0 +1,554 @@
+"""
+Write-ahead journal of the changes of a model tree, for autosave
+
+    journal = Journal(path, document)   # writes a first snapshot
+    ...                                 # changes are journaled as made
+    journal.close()
+
+    journal = Journal(path)             # after a crash, or to reopen
+    document = journal.model
+
+A journal keeps a snapshot of the tree in the file path, and appends a
+record of every change of the tree, from the attribute-changed,
+attribute-invalidated, child-added, child-removed, children-added and
+children-removed signals of its models, to the log path + ".log". Records are written by a background
+thread, which writes and syncs the records queued while it was syncing the
+previous ones in one go, so that the cost of saving follows the rate of
+changes rather than the size of the tree.
+
+Once the log grows past compact_size bytes, it is renamed path + ".old",
+a new log is started, and another thread compacts the old log into a new
+snapshot. It reads the last snapshot and applies the records to its own
+copy of the tree, made of RawNodes rather than models, so that it never
+touches the models being edited.
+
+Records carry sequence numbers, and snapshots the number of the last
+record they include. Recovery loads the snapshot and replays the records
+of the logs which came after it. A record which was only partly written
+ends the log, so that a crash loses at most the changes not yet synced,
+and so does a missing record.
+
+Records refer to models by numbers the journal gives them: in pre-order
+in the first snapshot, then in order of addition. Snapshots store the
+numbers of their models. Values are stored as by the serialize module:
+aggregates aren't journaled, and properties computed by formulas are
+journaled as their formula.
+"""
+
+from cStringIO import StringIO
+import os
+import struct
+import threading
+import zlib
+from basemodel import batch_notify, private
+from formula import Formula
+from serialize import Reader, Writer, BEGIN, END, CLASS, encode_varint, \
+    get_properties
+
+SNAPSHOT_MAGIC = "PYMJ"
+LOG_MAGIC = "PYML"
+
+# kinds of records
+SET, ADD, REMOVE = range(3)
+
+# SNAPSHOT_MAGIC, sequence number of the last record included
+_snapshot_header = struct.Struct("<4sQ")
+
+# sequence number, size and CRC-32 of the record
+_record_header = struct.Struct("<QII")
+
+def iter_preorder(root):
+    """Iterate over root and its descendants, parents first"""
+    yield root
+    stack = [root.iter_children()]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+        else:
+            yield node
+            stack.append(node.iter_children())
+
+# key: (class, property name)
+# value: default value of the property
+_defaults = {}
+
+def get_default(cls, name):
+    key = (cls, name)
+    if key not in _defaults:
+        _defaults[key] = getattr(cls.__new__(cls), private(name), None)
+    return _defaults[key]
+
+class RawNode(object):
+
+    """A model as stored, without building it"""
+
+    __slots__ = ("cls", "values", "children")
+
+    def __init__(self, cls):
+        self.cls = cls
+        # key: property name
+        # value: its value, or Formula
+        self.values = {}
+        self.children = []
+
+    def iter_children(self):
+        return iter(self.children)
+
+class RawReader(Reader):
+
+    """Reads RawNodes instead of models"""
+
+    def read_tree(self):
+        # the open nodes
+        stack = []
+        while True:
+            tag = self.read_byte()
+            if tag == BEGIN:
+                cls, properties = self.classes[self.read_varint()]
+                node = RawNode(cls)
+                for prop, attrname in properties:
+                    value = self.read_value()
+                    if attrname is not None:
+                        node.values[prop] = value
+                if stack:
+                    stack[-1].children.append(node)
+                stack.append(node)
+            elif tag == END:
+                node = stack.pop()
+                if not stack:
+                    return node
+            elif tag == CLASS:
+                self.read_class()
+            else:
+                raise Exception("invalid model stream record %d" % tag)
+
+class RawWriter(Writer):
+
+    """Writes RawNodes instead of models"""
+
+    def get_class(self, node):
+        return node.cls
+
+    def write_property(self, node, name):
+        values = node.values
+        if name in values:
+            value = values[name]
+        else:
+            value = get_default(node.cls, name)
+        if isinstance(value, Formula):
+            self.write_formula(value.text)
+        else:
+            self.write_value(value)
+
+class ModelTree(object):
+
+    """A tree of models, to which records are applied"""
+
+    reader = Reader
+    writer = Writer
+
+    def __init__(self, root, numbers):
+        self.root = root
+        # key: model number
+        # value: model. Removed models are left in, as numbers aren't
+        # reused while the tree is journaled.
+        self.nodes = dict(zip(numbers, iter_preorder(root)))
+
+    def get_numbers(self):
+        """Return the numbers of the models of the tree, in pre-order"""
+        numbers = dict((id(node), number) for number, node in
+            self.nodes.iteritems())
+        return [numbers[id(node)] for node in iter_preorder(self.root)]
+
+    def set(self, node, name, value):
+        setattr(node, name, value)
+
+    def add(self, parent, index, children):
+        parent.add_children(children, index)
+
+    def remove(self, parent, children):
+        parent.remove_children(children)
+
+    def apply(self, record):
+        reader = self.reader(StringIO(record))
+        kind = reader.read_byte()
+        if kind == SET:
+            node = self.nodes[reader.read_varint()]
+            name = reader.read_string()
+            self.set(node, name, reader.read_value())
+        elif kind == ADD:
+            parent = self.nodes[reader.read_varint()]
+            index = reader.read_varint()
+            number = reader.read_varint()
+            children = [reader.read_tree()
+                for i in xrange(reader.read_varint())]
+            for child in children:
+                for node in iter_preorder(child):
+                    self.nodes[number] = node
+                    number += 1
+            self.add(parent, index, children)
+        elif kind == REMOVE:
+            parent = self.nodes[reader.read_varint()]
+            self.remove(parent, [self.nodes[reader.read_varint()]
+                for i in xrange(reader.read_varint())])
+        else:
+            raise Exception("invalid journal record %d" % kind)
+
+class RawTree(ModelTree):
+
+    """A tree of RawNodes, to which records are applied"""
+
+    reader = RawReader
+    writer = RawWriter
+
+    def set(self, node, name, value):
+        node.values[name] = value
+
+    def add(self, parent, index, children):
+        parent.children[index:index] = children
+
+    def remove(self, parent, children):
+        removed = set(id(child) for child in children)
+        parent.children = [child for child in parent.children
+            if id(child) not in removed]
+
+def read_snapshot(path, tree_class):
+    """Return the sequence number of the last record included in the
+    snapshot at path, and its tree, an instance of tree_class"""
+    with open(path, "rb") as file:
+        header = file.read(_snapshot_header.size)
+        if len(header) < _snapshot_header.size:
+            raise Exception("truncated journal snapshot")
+        magic, sequence = _snapshot_header.unpack(header)
+        if magic != SNAPSHOT_MAGIC:
+            raise Exception("not a journal snapshot")
+        reader = tree_class.reader(file)
+        reader.read_header()
+        numbers = [reader.read_varint() for i in
+            xrange(reader.read_varint())]
+        return sequence, tree_class(reader.read_tree(), numbers)
+
+def write_snapshot(path, sequence, tree):
+    """Replace the snapshot at path by tree, which includes the records up
+    to sequence"""
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(_snapshot_header.pack(SNAPSHOT_MAGIC, sequence))
+        writer = tree.writer(file)
+        writer.write_header()
+        numbers = tree.get_numbers()
+        writer.write(encode_varint(len(numbers)))
+        for number in numbers:
+            writer.write(encode_varint(number))
+        writer.write_tree(tree.root)
+        writer.flush()
+        file.flush()
+        os.fsync(file.fileno())
+    os.rename(temporary, path)
+
+def read_records(path):
+    """Iterate over the complete records of the log at path, as (sequence
+    number, record, offset of the end of the record) tuples"""
+    with open(path, "rb") as file:
+        magic = file.read(len(LOG_MAGIC))
+        if not magic:
+            # created, but not written to
+            return
+        if magic != LOG_MAGIC:
+            raise Exception("not a journal log")
+        offset = len(LOG_MAGIC)
+        while True:
+            header = file.read(_record_header.size)
+            if len(header) < _record_header.size:
+                return
+            sequence, size, crc = _record_header.unpack(header)
+            record = file.read(size)
+            if len(record) < size or zlib.crc32(record) & 0xffffffff != crc:
+                return
+            offset += len(header) + size
+            yield sequence, record, offset
+
+class Journal(object):
+
+    """Journals the changes of the tree of model to the files at path,
+    which are replaced. If model is None, the tree is recovered from the
+    files instead, and is then the model attribute.
+
+    If writing the log fails, for example when the disk is full, the
+    changes are no longer journaled, and flush(), compact() and close()
+    raise the error."""
+
+    # size of the log past which it is compacted
+    compact_size = 1 << 22
+
+    def __init__(self, path, model=None):
+        self.path = path
+        self.log_path = path + ".log"
+        self.old_path = path + ".old"
+        # key: model
+        # value: its number
+        self.numbers = {}
+        self.next_number = 0
+        self.lock = threading.Condition()
+        # records not yet written
+        self.queue = []
+        # sequence numbers of the last record queued and written
+        self.queued = self.written = 0
+        self.closing = False
+        self.compact_requested = False
+        self.compactor = None
+        # True once writing failed, which stops journaling
+        self.failed = False
+        # exception raised by writing, or by the last compaction
+        self.error = None
+
+        if model is None:
+            model = self.recover()
+        else:
+            tree = ModelTree(model, xrange(sum(1 for node in
+                iter_preorder(model))))
+            write_snapshot(path, 0, tree)
+            for filename in (self.log_path, self.old_path):
+                if os.path.exists(filename):
+                    os.remove(filename)
+            self.numbers = dict((node, number) for number, node in
+                tree.nodes.iteritems())
+            self.next_number = len(self.numbers)
+        self.model = model
+
+        self.log = open(self.log_path, "ab")
+        self.log.seek(0, os.SEEK_END)
+        if not self.log.tell():
+            self.log.write(LOG_MAGIC)
+            self.log.flush()
+        self.log_size = self.log.tell()
+        for node in iter_preorder(model):
+            self.connect(node)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def recover(self):
+        sequence, tree = read_snapshot(self.path, ModelTree)
+        # offset of the end of the last complete record of the log
+        log_end = len(LOG_MAGIC)
+        with batch_notify():
+            for filename in (self.old_path, self.log_path):
+                if not os.path.exists(filename):
+                    continue
+                for number, record, end in read_records(filename):
+                    if number > sequence + 1:
+                        # the records after a missing one can't be applied
+                        break
+                    if number > sequence:
+                        tree.apply(record)
+                        sequence = number
+                    if filename == self.log_path:
+                        log_end = end
+                else:
+                    continue
+                break
+        # drop the records which weren't replayed, such as one left
+        # incomplete by a crash
+        if os.path.exists(self.log_path) and \
+                os.path.getsize(self.log_path) > log_end:
+            with open(self.log_path, "r+b") as log:
+                log.truncate(log_end)
+        self.queued = self.written = sequence
+        self.numbers = dict((node, number) for number, node in
+            zip(tree.get_numbers(), iter_preorder(tree.root)))
+        self.next_number = max(tree.nodes) + 1
+        return tree.root
+
+    def connect(self, model):
+        model.connect("attribute-changed", self.attribute_changed)
+        model.connect("attribute-invalidated", self.attribute_changed)
+        model.connect("child-added", self.child_added)
+        model.connect("child-removed", self.child_removed)
+        model.connect("children-added", self.children_added)
+        model.connect("children-removed", self.children_removed)
+
+    def disconnect(self, model):
+        for function in (self.attribute_changed, self.child_added,
+                self.child_removed, self.children_added,
+                self.children_removed):
+            model.disconnect_by_function(function)
+
+    # records, made from the signals of the models
+
+    def attribute_changed(self, model, name, *args):
+        # lazy properties only emit attribute-invalidated: reading their
+        # value to journal it computes it
+        if name not in get_properties(model.__class__):
+            return
+        output = StringIO()
+        writer = Writer(output)
+        writer.write(chr(SET) + encode_varint(self.numbers[model]))
+        writer.write_string(name)
+        writer.write_property(model, name)
+        writer.flush()
+        self.queue_record(output.getvalue())
+
+    def child_added(self, model, child):
+        # add_child() appends, and index_of_child() walks the children
+        children = model._get_children()
+        index = len(children) - 1
+        if children[index] is not child:
+            index = model.index_of_child(child)
+        self.children_added(model, index, [child])
+
+    def children_added(self, model, index, children):
+        output = StringIO()
+        writer = Writer(output)
+        writer.write(chr(ADD) + encode_varint(self.numbers[model]) +
+            encode_varint(index) + encode_varint(self.next_number) +
+            encode_varint(len(children)))
+        for child in children:
+            writer.write_tree(child)
+            for node in iter_preorder(child):
+                self.numbers[node] = self.next_number
+                self.next_number += 1
+                self.connect(node)
+        writer.flush()
+        self.queue_record(output.getvalue())
+
+    def child_removed(self, model, child):
+        self.children_removed(model, [(None, [child])])
+
+    def children_removed(self, model, ranges):
+        children = [child for index, run in ranges for child in run]
+        data = [chr(REMOVE), encode_varint(self.numbers[model]),
+            encode_varint(len(children))]
+        for child in children:
+            data.append(encode_varint(self.numbers[child]))
+            for node in iter_preorder(child):
+                del self.numbers[node]
+                self.disconnect(node)
+        self.queue_record("".join(data))
+
+    def queue_record(self, record):
+        with self.lock:
+            if self.failed:
+                return
+            self.queued += 1
+            self.queue.append(_record_header.pack(self.queued, len(record),
+                zlib.crc32(record) & 0xffffffff) + record)
+            self.lock.notify_all()
+
+    # background threads
+
+    def run(self):
+        try:
+            self.write_records()
+        except Exception as error:
+            # the log ends with the records synced so far
+            with self.lock:
+                self.failed = True
+                self.error = error
+                self.queue = []
+                self.lock.notify_all()
+
+    def write_records(self):
+        while True:
+            with self.lock:
+                while not (self.queue or self.closing or
+                        self.compact_requested):
+                    self.lock.wait()
+                records = self.queue
+                self.queue = []
+                queued = self.queued
+                requested = self.compact_requested
+            if records:
+                data = "".join(records)
+                self.log.write(data)
+                self.log.flush()
+                os.fsync(self.log.fileno())
+                self.log_size += len(data)
+            if requested or self.log_size >= self.compact_size:
+                self.rotate(requested)
+            with self.lock:
+                self.written = queued
+                if requested:
+                    self.compact_requested = False
+                self.lock.notify_all()
+                if self.closing and not self.queue:
+                    return
+
+    def rotate(self, requested):
+        compactor = self.compactor
+        if compactor is not None and compactor.is_alive():
+            if not requested:
+                return
+            compactor.join()
+        # the old log of a failed compaction is compacted again first
+        if not os.path.exists(self.old_path):
+            self.log.close()
+            os.rename(self.log_path, self.old_path)
+            self.log = open(self.log_path, "wb")
+            self.log.write(LOG_MAGIC)
+            self.log.flush()
+            self.log_size = len(LOG_MAGIC)
+        self.compactor = threading.Thread(target=self.compact_old)
+        self.compactor.daemon = True
+        self.compactor.start()
+
+    def compact_old(self):
+        try:
+            sequence, tree = read_snapshot(self.path, RawTree)
+            last = sequence
+            for number, record, end in read_records(self.old_path):
+                if number > last + 1:
+                    break
+                if number > last:
+                    tree.apply(record)
+                    last = number
+            write_snapshot(self.path, last, tree)
+            os.remove(self.old_path)
+        except Exception as error:
+            # the old log is kept, and replayed by recovery
+            self.error = error
+        else:
+            with self.lock:
+                if not self.failed:
+                    self.error = None
+
+    # control
+
+    def flush(self):
+        """Wait until the changes made so far are written. Raises the
+        exception which stopped the writing of the log, or made the last
+        compaction fail."""
+        with self.lock:
+            queued = self.queued
+            while self.written < queued and not self.failed:
+                self.lock.wait()
+        if self.error is not None:
+            raise self.error
+
+    def compact(self):
+        """Compact the log into the snapshot, and wait until it is done"""
+        with self.lock:
+            self.compact_requested = True
+            self.lock.notify_all()
+            while self.compact_requested and not self.failed:
+                self.lock.wait()
+        if self.compactor is not None:
+            self.compactor.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """Stop journaling, once the changes made so far are written.
+        Raises as flush() does."""
+        with self.lock:
+            self.closing = True
+            self.lock.notify_all()
+        self.thread.join()
+        if self.compactor is not None:
+            self.compactor.join()
+        self.log.close()
+        for node in iter_preorder(self.model):
+            self.disconnect(node)
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,318 @@
+"""
+Observable lists
+
+An ObservableList is a list which emits a splice signal for every
+mutation, so that observers can update incrementally instead of scanning
+the whole list:
+
+    splice(list, index, removed, inserted)
+
+removed is the list of the items which were at index, and inserted the
+list of the items which replaced them. Splices are relative to the list
+as left by the previous one.
+
+Inside batch_notify() and freeze_notify() blocks, consecutive splices
+touching the same region are merged, so that appending many items emits
+a single splice for example.
+
+Constraints reading the list depend on it as on a property. Those which
+can update their value from the changes, instead of reading the whole
+list, can use get_splices().
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from basemodel import propagate, _batch, _tracking
+from observable import Observable
+
+def merge_splices(first, second):
+    """Return the splice equivalent to first followed by second, or None if
+    they touch different regions of the list"""
+    index1, removed1, inserted1 = first
+    index2, removed2, inserted2 = second
+    end1 = index1 + len(inserted1)
+    end2 = index2 + len(removed2)
+    if index2 > end1 or end2 < index1:
+        return None
+
+    # the region covered by both splices, in the list as left by first:
+    # its items are either inserted by first or removed by second
+    start = min(index1, index2)
+    end = max(end1, end2)
+    def item(position):
+        if index1 <= position < end1:
+            return inserted1[position - index1]
+        return removed2[position - index2]
+
+    before = [item(position) for position in xrange(start, index2)]
+    after = [item(position) for position in xrange(end2, end)]
+    inserted = before + list(inserted2) + after
+
+    removed = [item(position) for position in xrange(start, index1)]
+    removed.extend(removed1)
+    removed.extend(item(position) for position in xrange(end1, end))
+    return start, removed, inserted
+
+class items_descriptor(object):
+
+    """Stands for the items of an ObservableList in the dependency graph.
+    The changes it propagates are splices."""
+
+    name = "items"
+    lazy = False
+    parallel = False
+
+    def _notify(self, instance, oldvalue, splice):
+        if instance._notify_frozen or _batch.depth:
+            instance._queue_splice(splice)
+        else:
+            instance.emit("splice", *splice)
+
+_items = items_descriptor()
+
+class ObservableList(Observable):
+
+    """A list emitting the splice signal when it is changed. It supports
+    the methods of list, except that slicing returns a plain list."""
+
+    __signals__ = {
+        "splice": ("index", "removed", "inserted"),
+    }
+
+    # number of splices kept for get_splices()
+    log_size = 256
+
+    _notify_frozen = 0
+    _dependents = None
+    _versions = None
+
+    def __init__(self, items=()):
+        self.items = list(items)
+        # number of splices made
+        self.version = 0
+        # (version, splice) pairs
+        self.log = deque(maxlen=self.log_size)
+        self._pending_splices = None
+
+    def __repr__(self):
+        return "ObservableList(%r)" % self.items
+
+    def _track(self):
+        frame = _tracking.frame
+        if frame is not None:
+            frame.add((self, _items.name))
+
+    def _splice(self, index, removed, inserted):
+        if not removed and not inserted:
+            return
+        splice = (index, removed, inserted)
+        self.version += 1
+        self.log.append((self.version, splice))
+        propagate(self, _items, None, splice)
+
+    def _replace(self, start, stop, inserted):
+        removed = self.items[start:stop]
+        # leave the items which didn't move out of the splice
+        prefix = 0
+        limit = min(len(removed), len(inserted))
+        while prefix < limit and removed[prefix] is inserted[prefix]:
+            prefix += 1
+        suffix = 0
+        limit -= prefix
+        while suffix < limit and removed[-1 - suffix] is \
+                inserted[-1 - suffix]:
+            suffix += 1
+        self.items[start:stop] = inserted
+        self._splice(start + prefix,
+            removed[prefix:len(removed) - suffix],
+            inserted[prefix:len(inserted) - suffix])
+
+    def get_version(self):
+        """Return the number of splices made, which get_splices() takes"""
+        self._track()
+        return self.version
+
+    def get_splices(self, version):
+        """Return the splices made since get_version() returned version, in
+        order, or None if they are no longer known, in which case the
+        whole list must be read again"""
+        self._track()
+        if version == self.version:
+            return []
+        if not self.log or self.log[0][0] > version + 1:
+            return None
+        return [splice for v, splice in self.log if v > version]
+
+    # reading
+
+    def __len__(self):
+        self._track()
+        return len(self.items)
+
+    def __iter__(self):
+        self._track()
+        return iter(self.items)
+
+    def __contains__(self, item):
+        self._track()
+        return item in self.items
+
+    def __getitem__(self, index):
+        self._track()
+        return self.items[index]
+
+    def __getslice__(self, start, stop):
+        return self.__getitem__(slice(start, stop))
+
+    def __eq__(self, other):
+        if isinstance(other, ObservableList):
+            other = other.items
+        return self.items == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def index(self, item, *args):
+        self._track()
+        return self.items.index(item, *args)
+
+    def count(self, item):
+        self._track()
+        return self.items.count(item)
+
+    # mutations
+
+    def __setitem__(self, index, value):
+        if not isinstance(index, slice):
+            if index < 0:
+                index += len(self.items)
+            old = self.items[index]
+            self.items[index] = value
+            if old is not value:
+                self._splice(index, [old], [value])
+            return
+
+        start, stop, step = index.indices(len(self.items))
+        if step == 1:
+            self._replace(start, max(start, stop), list(value))
+            return
+        # extended slice: splice the region from the first to the last
+        # replaced item
+        positions = xrange(start, stop, step)
+        value = list(value)
+        if len(value) != len(positions):
+            raise ValueError("attempt to assign sequence of size %d to "
+                "extended slice of size %d" % (len(value), len(positions)))
+        if not positions:
+            return
+        low, high = min(positions), max(positions) + 1
+        region = self.items[low:high]
+        for position, item in zip(positions, value):
+            region[position - low] = item
+        self._replace(low, high, region)
+
+    def __setslice__(self, start, stop, value):
+        self.__setitem__(slice(start, stop), value)
+
+    def __delitem__(self, index):
+        if not isinstance(index, slice):
+            if index < 0:
+                index += len(self.items)
+            old = self.items[index]
+            del self.items[index]
+            self._splice(index, [old], [])
+            return
+
+        start, stop, step = index.indices(len(self.items))
+        if step == 1:
+            self._replace(start, max(start, stop), [])
+            return
+        positions = xrange(start, stop, step)
+        if not positions:
+            return
+        low, high = min(positions), max(positions) + 1
+        removed = set(positions)
+        region = [item for position, item in
+            enumerate(self.items[low:high], low) if position not in removed]
+        self._replace(low, high, region)
+
+    def __delslice__(self, start, stop):
+        self.__delitem__(slice(start, stop))
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def append(self, item):
+        self.items.append(item)
+        self._splice(len(self.items) - 1, [], [item])
+
+    def extend(self, items):
+        index = len(self.items)
+        self.items.extend(items)
+        self._splice(index, [], self.items[index:])
+
+    def insert(self, index, item):
+        size = len(self.items)
+        if index < 0:
+            index = max(index + size, 0)
+        index = min(index, size)
+        self.items.insert(index, item)
+        self._splice(index, [], [item])
+
+    def pop(self, index=-1):
+        size = len(self.items)
+        item = self.items.pop(index)
+        if index < 0:
+            index += size
+        self._splice(index, [item], [])
+        return item
+
+    def remove(self, item):
+        index = self.items.index(item)
+        del self[index]
+
+    def sort(self, *args, **kwargs):
+        items = list(self.items)
+        items.sort(*args, **kwargs)
+        self._replace(0, len(self.items), items)
+
+    def reverse(self):
+        self._replace(0, len(self.items), self.items[::-1])
+
+    # deferred notification, see basemodel.batch_notify()
+
+    @contextmanager
+    def freeze_notify(self):
+        """Defer the splice signals until the outermost freeze_notify()
+        block exits, merging consecutive splices"""
+        self._notify_frozen += 1
+        try:
+            yield self
+        finally:
+            self._notify_frozen -= 1
+            if not self._notify_frozen and not _batch.depth:
+                self._thaw_notify()
+
+    def _queue_splice(self, splice):
+        pending = self._pending_splices
+        if pending is None:
+            pending = self._pending_splices = []
+            _batch.models[self] = None
+        if pending:
+            merged = merge_splices(pending[-1], splice)
+            if merged is not None:
+                pending[-1] = merged
+                return
+        pending.append(splice)
+
+    def _thaw_notify(self):
+        pending = self._pending_splices
+        self._pending_splices = None
+        _batch.models.pop(self, None)
+        if not pending:
+            return
+        for index, removed, inserted in pending:
+            # a merged splice may cancel out
+            if removed or inserted:
+                self.emit("splice", index, removed, inserted)
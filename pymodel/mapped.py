@@ -0,0 +1,272 @@
+"""
+Memory mapped model documents
+
+save() writes a model tree to a file which load() maps into memory
+instead of reading it. Only the root is read at first: the children of a
+model are read when they are first used, through iter_children() or any
+other method of the model accessing them, and so on down the tree, so that
+opening a document costs time and memory proportional to the part of it
+which is used. get_child_count() doesn't read the children.
+
+Saving a model tree loaded from a file copies the subtrees which were
+never read directly from the old file, without decoding them.
+
+The file is written depth first, children before their parent:
+
+    header: MAGIC, format version (byte)
+    records, in post-order
+    class table: number of classes, then for each one its module, name,
+        number of properties and property names
+    trailer: offset of the class table, offset of the root record
+        (unsigned 64 bit little endian integers), MAGIC
+
+A record is the class number, one value per property of the class, in the
+format of the serialize module, and the index of its children: their
+number, then if there are any, the offset of the first byte of their
+subtrees and the size of those subtrees, which are contiguous, and the
+offset of the record of each child. Offsets are stored as distances back
+from the index, so that a block of subtrees can be copied elsewhere
+unchanged.
+
+Unlike the serialize module, aggregate properties are stored, so that
+they have their value before the children they aggregate are read.
+"""
+
+import mmap
+import os
+import struct
+from weakref import WeakKeyDictionary
+from basemodel import get_property_names
+from childlist import ChildList
+from serialize import Reader, Writer, encode_varint
+
+MAGIC = "PYMM"
+VERSION = 1
+
+# offset of the class table, offset of the root record, MAGIC
+_trailer = struct.Struct("<QQ4s")
+
+# key: model loaded as the root of a document
+# value: its MappedFile
+_documents = WeakKeyDictionary()
+
+class LazyChildList(ChildList):
+
+    """The children of a model loaded from a MappedFile, before they are
+    read. Any use but len() reads them, and turns the list into a plain
+    ChildList. Until then, root holds (file, model, offset of the index,
+    number of children)."""
+
+    __slots__ = ()
+
+    def __init__(self, file, model, index, count):
+        self.root = (file, model, index, count)
+        self.nodes = None
+
+    def __len__(self):
+        return self.root[3]
+
+    def materialize(self):
+        file, model, index, count = self.root
+        children = file.read_children(index)
+        self.__class__ = ChildList
+        ChildList.__init__(self, children)
+        # binds the aggregates of model, which already have their values
+        model._children_changed(children, ())
+
+def _materializing(name):
+    def method(self, *args):
+        self.materialize()
+        return getattr(self, name)(*args)
+    method.__name__ = name
+    return method
+
+for name in ("__contains__", "__iter__", "__getitem__", "__reduce_ex__",
+        "append", "extend", "insert", "insert_before", "remove_all",
+        "remove", "index", "get_ranges"):
+    setattr(LazyChildList, name, _materializing(name))
+del name
+
+class MappedReader(Reader):
+
+    """Decodes values from a string or memory map"""
+
+    magic = MAGIC
+    version = VERSION
+    get_properties = staticmethod(get_property_names)
+
+    def __init__(self, data, classes=None):
+        Reader.__init__(self, None, classes)
+        self.buffer = data
+
+    def new_model(self, cls):
+        # its children are set by MappedFile.read_node()
+        return cls.__new__(cls)
+
+    def read(self, size):
+        end = self.position + size
+        if end > len(self.buffer):
+            raise Exception("truncated model document")
+        data = self.buffer[self.position:end]
+        self.position = end
+        return data
+
+class MappedFile(object):
+
+    """A model document mapped into memory"""
+
+    def __init__(self, path, classes=None):
+        self.path = path
+        with open(path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.reader = reader = MappedReader(self.data, classes)
+        reader.read_header()
+        if len(self.data) < reader.position + _trailer.size:
+            raise Exception("truncated model document")
+        table, self.root, magic = _trailer.unpack(
+            self.data[-_trailer.size:])
+        if magic != MAGIC:
+            raise Exception("truncated model document")
+        reader.position = table
+        for i in xrange(reader.read_varint()):
+            reader.read_class()
+
+    def read_index(self, index):
+        """Return the offset and size of the subtrees of the children of
+        the record whose index is at index, and the offsets of their
+        records"""
+        reader = self.reader
+        reader.position = index
+        count = reader.read_varint()
+        if not count:
+            return index, 0, []
+        start = index - reader.read_varint()
+        size = reader.read_varint()
+        return start, size, [index - reader.read_varint()
+            for i in xrange(count)]
+
+    def read_children(self, index):
+        start, size, offsets = self.read_index(index)
+        return [self.read_node(offset) for offset in offsets]
+
+    def read_node(self, offset):
+        reader = self.reader
+        reader.position = offset
+        model, formulas = reader.read_node()
+        index = reader.position
+        count = reader.read_varint()
+        if count:
+            model._set_children(LazyChildList(self, model, index, count))
+        else:
+            model._set_children(ChildList())
+        for prop, value in formulas:
+            setattr(model, prop, value)
+        return model
+
+class MappedWriter(Writer):
+
+    """Writes a model tree in the mapped format. The subtrees which were
+    never read from source, the MappedFile the tree was loaded from, are
+    copied from it."""
+
+    magic = MAGIC
+    version = VERSION
+    get_properties = staticmethod(get_property_names)
+
+    def __init__(self, file, source=None):
+        Writer.__init__(self, file)
+        self.source = source
+        # (class, property names) of the class table, which starts with
+        # that of source, so that copied records keep their class numbers
+        self.table = []
+        if source is not None:
+            for cls, properties in source.reader.classes:
+                names = tuple(prop for prop, attrname in properties)
+                if names == self.get_properties(cls):
+                    self.classes.setdefault(cls, len(self.table))
+                self.table.append((cls, names))
+
+    def get_class_number(self, cls):
+        number = self.classes.get(cls)
+        if number is None:
+            number = self.classes[cls] = len(self.table)
+            self.table.append((cls, self.get_properties(cls)))
+        return number
+
+    def open_node(self, model):
+        """Return [model, iterator over the children left to write,
+        offsets of the children written, offset of their subtrees]"""
+        children = model._get_children()
+        if isinstance(children, LazyChildList) and \
+                children.root[0] is self.source:
+            start, size, offsets = self.source.read_index(children.root[2])
+            self.flush()
+            position = self.offset
+            self.file.write(buffer(self.source.data, start, size))
+            self.offset += size
+            return [model, iter(()), [position + offset - start
+                for offset in offsets], position]
+        return [model, iter(children), [], self.offset]
+
+    def write_tree(self, root):
+        """Write the records of root and its descendants, and return the
+        offset of that of root"""
+        stack = [self.open_node(root)]
+        while stack:
+            child = next(stack[-1][1], None)
+            if child is None:
+                model, children, offsets, start = stack.pop()
+                offset = self.write_record(model, offsets, start)
+                if stack:
+                    stack[-1][2].append(offset)
+            else:
+                stack.append(self.open_node(child))
+        return offset
+
+    def write_record(self, model, offsets, start):
+        offset = self.offset
+        cls = model.__class__
+        number = self.get_class_number(cls)
+        self.write(encode_varint(number))
+        self.write_properties(model, self.table[number][1])
+        index = self.offset
+        self.write(encode_varint(len(offsets)))
+        if offsets:
+            self.write(encode_varint(index - start) +
+                encode_varint(offset - start))
+            self.write("".join(encode_varint(index - child)
+                for child in offsets))
+        return offset
+
+    def write_table(self):
+        offset = self.offset
+        self.write(encode_varint(len(self.table)))
+        for cls, names in self.table:
+            self.write_description(cls, names)
+        return offset
+
+def save(model, path):
+    """Write model and its descendants to the file path. The file is
+    replaced once it is complete and on disk."""
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        writer = MappedWriter(file, _documents.get(model))
+        writer.write_header()
+        root = writer.write_tree(model)
+        table = writer.write_table()
+        writer.write(_trailer.pack(table, root, MAGIC))
+        writer.flush()
+        file.flush()
+        os.fsync(file.fileno())
+    # a file mapped by the models still being read is left in place for
+    # them, as it is only unlinked
+    os.rename(temporary, path)
+
+def load(path, classes=None):
+    """Return the root model of the document at path. classes maps
+    (module, class name) pairs to the classes to use instead, as in
+    serialize.load()."""
+    file = MappedFile(path, classes)
+    model = file.read_node(file.root)
+    _documents[model] = file
+    return model
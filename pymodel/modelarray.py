@@ -0,0 +1,227 @@
+"""
+Column storage for the properties of many models of the same class
+"""
+
+from functools import partial
+from basemodel import private, evaluate, propagate, _tracking
+from constraint import Constraint
+from observable import Observable
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def column_storage(name):
+    """Return a descriptor which stores the value of the property name of
+    an element of a ModelArray in the array's column"""
+    def get(instance):
+        return instance._array._columns[name][instance._index]
+
+    def set(instance, value):
+        instance._array._set_element(name, instance._index, value)
+
+    return property(get, set)
+
+class ColumnDescriptor(object):
+
+    """Plays the part of a property_descriptor for a whole column, so that
+    vectorized constraints are scheduled by the propagator like any other
+    constraint"""
+
+    lazy = False
+    parallel = False
+
+    def __init__(self, name):
+        self.name = name
+
+    def compare(self, old, new):
+        if old is None:
+            # elements were written through the models
+            return False
+        return numpy.array_equal(old, new)
+
+    def _recompute(self, array, constraint):
+        if array._constraints.get(self.name) is not constraint:
+            return None
+        column = array._columns[self.name][:len(array)]
+        old = column.copy()
+        column[:] = evaluate(constraint)
+        return old, column
+
+    def _invalidate(self, array, constraint):
+        return False
+
+    def _notify(self, array, old, new):
+        array._notify_column(self.name, old, new)
+
+class LengthDescriptor(ColumnDescriptor):
+
+    """Describes the number of elements of a ModelArray, on which all the
+    vectorized constraints depend"""
+
+    def __init__(self):
+        ColumnDescriptor.__init__(self, "__len__")
+
+    def compare(self, old, new):
+        return old == new
+
+    def _notify(self, array, old, new):
+        pass
+
+class ModelArray(Observable):
+
+    """Stores the given properties of many instances of a BaseModel subclass
+    in contiguous numpy arrays, one per property.
+
+    The instances created with new() are views onto the array: reading and
+    writing their properties, and per-instance constraints, work as usual.
+
+    A column can also be computed as a whole with constrain(), by a
+    function taking the array and returning a numpy array (or a scalar). It
+    may read the properties of other models, and the columns of this array
+    through column(). It is recomputed when they change, in the same waves
+    as the other constraints, and when elements are added (use
+    batch_notify() when adding many). When a column changes this way, the
+    models don't emit their -changed signals. Instead, the array emits a
+    single column-changed signal with the indices of the elements which
+    changed. Per-instance constraints which depend on those elements are
+    still updated."""
+
+    __signals__ = {
+        "column-changed": ("name", "indices"),
+    }
+
+    def __init__(self, cls, names, dtype=float, capacity=16):
+        if numpy is None:
+            raise Exception("ModelArray requires numpy")
+        self.cls = cls
+        self.names = tuple(names)
+        self._size = 0
+        self._instances = []
+        self._columns = {}
+        self._defaults = {}
+        self._descriptors = {}
+        self._length = LengthDescriptor()
+        self._constraints = {}
+        # key: column name
+        # value: set of indices written through the models since the last
+        # column-changed emission
+        self._element_writes = {}
+
+        storage = {}
+        for name in self.names:
+            default = getattr(cls, private(name))
+            if default is None:
+                default = 0
+            column = numpy.empty(capacity, dtype)
+            column.fill(default)
+            self._columns[name] = column
+            self._defaults[name] = default
+            self._descriptors[name] = ColumnDescriptor(name)
+            storage[private(name)] = column_storage(name)
+        storage["__slots__"] = ("_array", "_index")
+        storage["__initial__"] = tuple((name, value)
+            for name, value in cls.__initial__ if name not in storage)
+        self._view_class = type(cls.__name__, (cls,), storage)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        return self._instances[index]
+
+    def __iter__(self):
+        return iter(self._instances)
+
+    def new(self, *args, **kwargs):
+        """Append an element, and return its model, created with the given
+        constructor arguments"""
+        if self._size == len(self._columns[self.names[0]]):
+            self._grow()
+        index = self._size
+        self._size += 1
+        instance = self._view_class.__new__(self._view_class)
+        instance._array = self
+        instance._index = index
+        self._instances.append(instance)
+        instance.__init__(*args, **kwargs)
+        # vectorized constraints override the values set by the constructor
+        propagate(self, self._length, index, self._size)
+        return instance
+
+    def column(self, name):
+        """Return the column of the property name, as a numpy array which
+        should be treated as read-only. Reading it from a vectorized
+        constraint makes the constraint depend on it."""
+        frame = _tracking.frame
+        if frame is not None:
+            frame.add((self, name))
+        return self._columns[name][:self._size]
+
+    def constrain(self, name, function):
+        """Compute the column of the property name with function(array)"""
+        descriptor = self._descriptors[name]
+        constraint = Constraint(self, descriptor,
+            partial(self._compute, function))
+        value = evaluate(constraint)
+        try:
+            constraint.check_cycle()
+        except:
+            constraint.clear()
+            raise
+        self.unconstrain(name)
+        self._constraints[name] = constraint
+        column = self._columns[name][:self._size]
+        old = column.copy()
+        column[:] = value
+        propagate(self, descriptor, old, column)
+
+    def unconstrain(self, name):
+        """Remove the vectorized constraint of the column name, if any"""
+        constraint = self._constraints.pop(name, None)
+        if constraint is not None:
+            constraint.clear()
+
+    def _compute(self, function):
+        # every vectorized constraint depends on the number of elements
+        _tracking.frame.add((self, "__len__"))
+        return function(self)
+
+    def _grow(self):
+        for name, column in self._columns.items():
+            grown = numpy.empty(len(column) * 2, column.dtype)
+            grown[:len(column)] = column
+            grown[len(column):] = self._defaults[name]
+            self._columns[name] = grown
+
+    def _set_element(self, name, index, value):
+        self._columns[name][index] = value
+        self._element_writes.setdefault(name, set()).add(index)
+        # the model reports its own change, which runs the propagator
+        propagate(self, self._descriptors[name], None, None, run=False)
+
+    def _notify_column(self, name, old, new):
+        if old is None:
+            indices = self._element_writes.pop(name, None)
+            if not indices:
+                return
+            self.emit("column-changed", name,
+                numpy.array(sorted(indices), dtype=int))
+            return
+
+        indices = numpy.flatnonzero(old != new)
+        if not len(indices):
+            return
+        self.emit("column-changed", name, indices)
+
+        # models with per-instance constraints depending on the changed
+        # elements report their change, which the propagator handles after
+        # the current wave
+        descriptor = getattr(self.cls, name)
+        for index in indices:
+            instance = self._instances[index]
+            dependents = instance._dependents
+            if dependents and name in dependents:
+                propagate(instance, descriptor, old[index], new[index],
+                    run=False)
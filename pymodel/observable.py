@@ -21,7 +21,6 @@
 
 # FIXME/IDEA : Add a decorator to easily add signals (ex: @signal(name="mysignal"))
 # FIXME/IDEA : Add a function to quickly define signals (a-la pygobject gsignals)
-# FIXME/IDEA : Use Weak dictionnaries for tracking connected callbacks/objects
 # FIXME/IDEA : Make specific exceptions !
 # FIXME : How to handle classes which are already using gobject (i.e. gst.Pipeline)
 
@@ -29,7 +28,51 @@
 Interfaces for event-based programming
 """
 
-from random import randint
+from itertools import count
+import threading
+import types
+import weakref
+from dispatch import asyncio, QueuedCallback, get_dispatcher, \
+    get_main_dispatcher
+
+# serializes the creation of signal groups of thread-safe observables
+_group_lock = threading.Lock()
+
+class WeakMethod(object):
+    """
+    Calls a bound method without keeping its instance alive.
+
+    @ivar key: hashable identity of the method, shared with the bound method
+    it was created from (see L{callback_key})
+    """
+
+    __slots__ = ("ref", "func", "key")
+
+    def __init__(self, method, callback=None):
+        self.ref = weakref.ref(method.im_self, callback)
+        self.func = method.im_func
+        self.key = callback_key(method)
+
+    def __call__(self, *args, **kwargs):
+        obj = self.ref()
+        if obj is None:
+            return None
+        return self.func(obj, *args, **kwargs)
+
+def is_bound_method(cb):
+    return isinstance(cb, types.MethodType) and cb.im_self is not None
+
+def callback_key(cb):
+    """ Return the key under which a callback's signal ids are tracked """
+    if isinstance(cb, QueuedCallback):
+        return callback_key(cb.callback)
+    if isinstance(cb, WeakMethod):
+        return cb.key
+    if is_bound_method(cb):
+        # bound methods are created anew on every attribute access, and
+        # must not be kept alive through this key
+        return (id(cb.im_self), cb.im_func)
+    return cb
 
 class Observable(object):
     """
@@ -41,68 +84,127 @@ class Observable(object):
     @type __signals__: Dictionnary of L{str} : List of L{str}
     """
 
+    class Handler(object):
+        # internal
+        # A single connection. Disconnected handlers are tombstoned by
+        # clearing their callback, so that removal doesn't have to search
+        # the per-signal handler list.
+        __slots__ = ("sigid", "signame", "callback", "args", "kwargs")
+
+        def __init__(self, sigid, signame, callback, args, kwargs):
+            self.sigid = sigid
+            self.signame = signame
+            self.callback = callback
+            # None means no bound arguments, which selects the fast
+            # path in emit()
+            self.args = args or None
+            self.kwargs = kwargs or None
+
     class SignalGroup:
         # internal
+
+        # a per-signal handler list is compacted once at least this many
+        # (and at least half) of its entries are dead
+        compact_threshold = 8
+
+        # number of weak handlers pruned in all groups
+        total_pruned = 0
+
         def __init__(self, observable):
-            self.siglist = observable.get_signals()
+            # shared by all instances of the class
+            self.signals = observable.get_signal_names()
             # self.ids is a dictionnary of
-            # key: signal name (string)
-            # value: list of:
-            #    (callback (callable),
-            #     args (list),
-            #     kwargs (dictionnary))
+            # key: signal id (int)
+            # value: Handler instance
             self.ids = {}
+            # self.callback_ids is a dictionnary of
+            # key: callback_key() of the callback
+            # value: set of signal ids
             self.callback_ids = {}
-            # self.handlers is a dictionnary of callback ids per
-            # signals.
+            # self.handlers is a dictionnary of Handler lists per
+            # signals, in connection order. Lists are only created for
+            # signals which have been connected to.
             self.handlers = {}
-            for signame in self.siglist.keys():
-                self.handlers[signame] = []
+            # self.dead counts tombstoned handlers per signals
+            self.dead = {}
+            self._counter = count(1)
+            # number of weak handlers dropped because their instance died
+            self.pruned = 0
 
-        def connect(self, signame, cb, args, kwargs):
+        def connect(self, signame, cb, args, kwargs, weak=False,
+                    queued=False):
             """ connect """
-            # get a unique id
-            if not signame in self.handlers.keys():
+            if not signame in self.signals:
                 raise Exception("Signal %s is not one of %s" % (signame,
-                ",\n\t".join(self.handlers.keys())))
+                ",\n\t".join(sorted(self.signals))))
             if not callable(cb):
                 raise Exception("Provided callable '%r' is not callable" % cb)
 
-            uuid = randint(0, 2**64)
-            while uuid in self.ids:
-                uuid = randint(0, 2**64)
+            # ids are never reused during the lifetime of the group
+            uuid = self._counter.next()
+            if asyncio is not None and asyncio.iscoroutinefunction(cb):
+                queued = True
+            if weak and is_bound_method(cb):
+                cb = WeakMethod(cb, self._make_pruner(uuid))
+            if queued:
+                cb = QueuedCallback(cb)
+            handler = Observable.Handler(uuid, signame, cb, args, kwargs)
 
-            self.ids[uuid] = (cb, args, kwargs)
-            self.callback_ids.setdefault(cb, []).append(uuid)
-            self.handlers[signame].append(uuid)
+            self.ids[uuid] = handler
+            self.callback_ids.setdefault(callback_key(cb), set()).add(uuid)
+            handlers = self.handlers.get(signame)
+            if handlers is None:
+                handlers = self.handlers[signame] = []
+                self.dead[signame] = 0
+            handlers.append(handler)
             return uuid
 
         def disconnect(self, sigid):
             """ disconnect """
             try:
-                cb = self.ids[sigid][0]
-                del self.ids[sigid]
+                handler = self.ids.pop(sigid)
             except KeyError:
                 raise Exception("unknown signal id")
 
-            for lists in self.handlers.itervalues():
-                try:
-                    lists.remove(sigid)
-                except ValueError:
-                    continue
+            key = callback_key(handler.callback)
+            sigids = self.callback_ids.get(key)
+            if sigids is not None:
+                sigids.discard(sigid)
+                if not sigids:
+                    del self.callback_ids[key]
 
-                self.callback_ids.get(cb, []).remove(sigid)
+            handler.callback = None
+            signame = handler.signame
+            dead = self.dead[signame] + 1
+            handlers = self.handlers[signame]
+            if dead >= self.compact_threshold and dead * 2 >= len(handlers):
+                # build a new list rather than filtering in place, so
+                # that an emission iterating the old list is unaffected
+                self.handlers[signame] = [h for h in handlers
+                    if h.callback is not None]
+                dead = 0
+            self.dead[signame] = dead
 
         def disconnect_by_function(self, function):
             try:
-                sig_ids = self.callback_ids[function]
+                sig_ids = self.callback_ids[callback_key(function)]
             except KeyError:
                 raise Exception("function is not a known callback")
 
             for sigid in list(sig_ids):
                 self.disconnect(sigid)
 
-            del self.callback_ids[function]
+        def _make_pruner(self, sigid):
+            # the weakref callback only holds the group weakly, so that it
+            # doesn't form a reference cycle through the handler table
+            group = weakref.ref(self)
+            def prune(ref):
+                self = group()
+                if self is not None and sigid in self.ids:
+                    self.disconnect(sigid)
+                    self.pruned += 1
+                    Observable.SignalGroup.total_pruned += 1
+            return prune
 
         def emit(self, signame, *args, **kwargs):
             """ emit """
@@ -110,20 +212,78 @@ class Observable(object):
             # will concatenate the given args/kwargs with
             # the ones supplied in .connect()
             res = None
-            for sigid in self.handlers[signame]:
-                # cb: callable
-                cb, orar, kwar = self.ids[sigid]
-                ar = args[:] + orar
-                kw = kwargs.copy()
-                kw.update(kwar)
+            handlers = self.handlers.get(signame)
+            if handlers is None:
+                if not signame in self.signals:
+                    raise Exception("unknown signal %s" % signame)
+                return res
+            for handler in handlers:
+                cb = handler.callback
+                if cb is None:
+                    continue
+                if handler.args is None and handler.kwargs is None:
+                    res = cb(*args, **kwargs)
+                    continue
+                ar = args
+                if handler.args is not None:
+                    ar = args + handler.args
+                kw = kwargs
+                if handler.kwargs is not None:
+                    kw = dict(kwargs)
+                    kw.update(handler.kwargs)
                 res = cb(*ar, **kw)
             return res
 
+    class ThreadSafeSignalGroup(SignalGroup):
+        # internal
+        # Handler tables are mutated under a lock. Emissions from threads
+        # other than the one owning the main dispatcher (see
+        # dispatch.set_main_dispatcher()) are marshalled to its loop,
+        # and return None.
+
+        def __init__(self, observable):
+            Observable.SignalGroup.__init__(self, observable)
+            self.lock = threading.RLock()
+
+        def connect(self, *args, **kwargs):
+            with self.lock:
+                return Observable.SignalGroup.connect(self, *args, **kwargs)
+
+        def disconnect(self, sigid):
+            with self.lock:
+                Observable.SignalGroup.disconnect(self, sigid)
+
+        def disconnect_by_function(self, function):
+            with self.lock:
+                Observable.SignalGroup.disconnect_by_function(self, function)
+
+        def emit(self, signame, *args, **kwargs):
+            dispatcher = get_main_dispatcher()
+            if dispatcher is None or dispatcher.is_owner():
+                return Observable.SignalGroup.emit(self, signame,
+                    *args, **kwargs)
+            dispatcher.queue(Observable.SignalGroup.emit,
+                (self, signame) + args, kwargs)
+
 
     # key : name (string)
     # value : signature (list of any strings)
     __signals__ = { }
 
+    # instances of subclasses have a __dict__ unless they declare
+    # __slots__ too
+    __slots__ = ()
+
+    # when True, connect() holds bound methods through weak references,
+    # as connect_weak() does
+    __weak_connections__ = False
+
+    # when True, signal handlers may be connected, disconnected and emitted
+    # from any thread; see ThreadSafeSignalGroup. The properties and
+    # children of thread-safe models may be changed from any thread too,
+    # see basemodel.queue_to_main().
+    __threadsafe__ = False
+
     def emit(self, signame, *args, **kwargs):
         """
         Emit the given signal.
@@ -144,6 +304,17 @@ class Observable(object):
         return self._signal_group.emit(signame, self,
                                        *args, **kwargs)
 
+    def emit_async(self, signame, *args, **kwargs):
+        """
+        Like emit(), but the emission is queued on the default dispatcher
+        (see L{dispatch.get_dispatcher}) and happens from its event loop.
+        Handlers are the ones connected at delivery time.
+        """
+        if not hasattr(self, "_signal_group"):
+            return
+        get_dispatcher().queue(self._signal_group.emit,
+            (signame, self) + args, kwargs)
+
     def connect(self, signame, cb, *args, **kwargs):
         """
         Connect a callback (with optional arguments) to the given
@@ -154,10 +325,38 @@ class Observable(object):
         * args/kwargs : (optional) arguments
         """
         if not hasattr(self, "_signal_group"):
-            self._signal_group = self.SignalGroup(self)
+            self._create_signal_group()
+
+        return self._signal_group.connect(signame,
+                                           cb, args, kwargs,
+                                           self.__weak_connections__)
+
+    def connect_weak(self, signame, cb, *args, **kwargs):
+        """
+        Like connect(), but if cb is a bound method, its instance is only
+        weakly referenced. The handler is disconnected automatically when
+        the instance is collected. Other callables are held strongly.
+        """
+        if not hasattr(self, "_signal_group"):
+            self._create_signal_group()
+
+        return self._signal_group.connect(signame,
+                                           cb, args, kwargs, True)
+
+    def connect_async(self, signame, cb, *args, **kwargs):
+        """
+        Like connect(), but each call of cb is queued on the default
+        dispatcher (see L{dispatch.get_dispatcher}) instead of running
+        from emit(). Coroutine functions are always connected this way,
+        and the coroutines they return are run as tasks on its loop.
+        """
+        if not hasattr(self, "_signal_group"):
+            self._create_signal_group()
 
         return self._signal_group.connect(signame,
-                                           cb, args, kwargs)
+                                           cb, args, kwargs,
+                                           self.__weak_connections__,
+                                           True)
 
     def disconnect(self, sigid):
         """
@@ -179,6 +378,35 @@ class Observable(object):
 
     disconnect_by_func = disconnect_by_function
 
+    def _create_signal_group(self):
+        if not self.__threadsafe__:
+            self._signal_group = self.SignalGroup(self)
+            return
+        with _group_lock:
+            if not hasattr(self, "_signal_group"):
+                self._signal_group = self.ThreadSafeSignalGroup(self)
+
+    def get_pruned_count(self):
+        """
+        Return the number of weak handlers which have been disconnected
+        because their instance was collected
+        """
+        if not hasattr(self, "_signal_group"):
+            return 0
+        return self._signal_group.pruned
+
+    @classmethod
+    def get_signal_names(cls):
+        """
+        Return the names of the signals implemented by this class, as a
+        frozenset computed once per class
+        """
+        names = cls.__dict__.get("__signal_names__")
+        if names is None:
+            names = frozenset(cls.get_signals())
+            cls.__signal_names__ = names
+        return names
+
     @classmethod
     def get_signals(cls):
         """ Get the full list of signals implemented by this class """
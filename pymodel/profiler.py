@@ -0,0 +1,218 @@
+"""
+Signal dispatch profiler
+
+While enabled, every emission through Observable.SignalGroup is timed. The
+statistics are kept per observable class and signal name: emission count,
+fan-out, cascade depth (emissions made from inside other emissions), and a
+latency histogram per handler. Handler times include the time spent in any
+emission they cause.
+
+The instrumented emit() is only installed while profiling is enabled, so
+that a disabled profiler costs nothing.
+"""
+
+from contextlib import contextmanager
+from timeit import default_timer
+import math
+from dispatch import QueuedCallback
+from observable import Observable, WeakMethod
+
+class Histogram(object):
+
+    """Log-scale histogram of durations, in seconds. Each bucket covers a
+    quarter octave, so percentiles are accurate to about 20%."""
+
+    # buckets per octave
+    resolution = 4
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if value > 0:
+            bucket = int(math.floor(math.log(value, 2) * self.resolution))
+        else:
+            bucket = None
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, fraction):
+        """Return an upper bound of the given fraction of the values"""
+        if not self.count:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= wanted:
+                if bucket is None:
+                    return 0.0
+                return min(2 ** (float(bucket + 1) / self.resolution),
+                    self.max)
+        return self.max
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+class SignalStats(object):
+
+    """Statistics of one signal of one observable class"""
+
+    def __init__(self, cls, signame):
+        self.cls = cls
+        self.signame = signame
+        self.emits = 0
+        self.fanout = 0
+        self.max_fanout = 0
+        self.nested = 0
+        self.max_depth = 0
+        # key: handler description (string)
+        # value: Histogram
+        self.handlers = {}
+
+    def get_name(self):
+        return "%s::%s" % (self.cls.__name__, self.signame)
+
+    def get_total_time(self):
+        return sum(h.total for h in self.handlers.itervalues())
+
+    def get_mean_fanout(self):
+        if not self.emits:
+            return 0.0
+        return float(self.fanout) / self.emits
+
+def describe_callback(cb):
+    """Return a readable name for a signal handler"""
+    if isinstance(cb, QueuedCallback):
+        return describe_callback(cb.callback) + " (queued)"
+    if isinstance(cb, WeakMethod):
+        obj = cb.ref()
+        cls = obj.__class__.__name__ if obj is not None else "<dead>"
+        return "%s.%s (weak)" % (cls, cb.func.__name__)
+    if getattr(cb, "im_self", None) is not None:
+        return "%s.%s" % (cb.im_self.__class__.__name__, cb.im_func.__name__)
+    code = getattr(cb, "func_code", None)
+    if code is not None:
+        return "%s (%s:%d)" % (cb.__name__, code.co_filename,
+            code.co_firstlineno)
+    return repr(cb)
+
+# key: (class, signal name)
+# value: SignalStats
+_stats = {}
+_depth = 0
+_original_emit = Observable.SignalGroup.__dict__["emit"]
+
+def _profiled_emit(self, signame, *args, **kwargs):
+    # mirrors SignalGroup.emit()
+    global _depth
+    handlers = self.handlers.get(signame)
+    if handlers is None:
+        if not signame in self.signals:
+            raise Exception("unknown signal %s" % signame)
+        handlers = ()
+    cls = type(args[0]) if args else None
+    key = (cls, signame)
+    stats = _stats.get(key)
+    if stats is None:
+        stats = _stats[key] = SignalStats(cls, signame)
+
+    stats.emits += 1
+    if _depth:
+        stats.nested += 1
+    _depth += 1
+    if _depth > stats.max_depth:
+        stats.max_depth = _depth
+
+    res = None
+    fanout = 0
+    try:
+        for handler in handlers:
+            cb = handler.callback
+            if cb is None:
+                continue
+            ar = args
+            if handler.args is not None:
+                ar = args + handler.args
+            kw = kwargs
+            if handler.kwargs is not None:
+                kw = dict(kwargs)
+                kw.update(handler.kwargs)
+            start = default_timer()
+            res = cb(*ar, **kw)
+            elapsed = default_timer() - start
+            fanout += 1
+            name = describe_callback(cb)
+            histogram = stats.handlers.get(name)
+            if histogram is None:
+                histogram = stats.handlers[name] = Histogram()
+            histogram.add(elapsed)
+    finally:
+        _depth -= 1
+        stats.fanout += fanout
+        if fanout > stats.max_fanout:
+            stats.max_fanout = fanout
+    return res
+
+def enable():
+    """Start recording signal emissions"""
+    Observable.SignalGroup.emit = _profiled_emit
+
+def disable():
+    """Stop recording signal emissions. Statistics are kept."""
+    Observable.SignalGroup.emit = _original_emit
+
+def is_enabled():
+    return Observable.SignalGroup.__dict__["emit"] is _profiled_emit
+
+def reset():
+    """Forget all recorded statistics"""
+    _stats.clear()
+
+@contextmanager
+def profile():
+    """Record signal emissions within a with block"""
+    enable()
+    try:
+        yield
+    finally:
+        disable()
+
+def get_stats():
+    """Return the recorded SignalStats, sorted by decreasing total handler
+    time"""
+    return sorted(_stats.itervalues(), key=SignalStats.get_total_time,
+        reverse=True)
+
+def report(limit=None):
+    """Return the recorded statistics as text. Times are in milliseconds.
+    Only the limit signals with the largest total handler time are
+    included, if given."""
+    lines = []
+    stats = get_stats()
+    if limit is not None:
+        stats = stats[:limit]
+    for signal in stats:
+        lines.append("%s: %d emits (%d nested, max depth %d), "
+            "fan-out %.1f (max %d), %.3f ms" % (signal.get_name(),
+                signal.emits, signal.nested, signal.max_depth,
+                signal.get_mean_fanout(), signal.max_fanout,
+                signal.get_total_time() * 1000))
+        handlers = sorted(signal.handlers.iteritems(),
+            key=lambda item: item[1].total, reverse=True)
+        for name, histogram in handlers:
+            lines.append("    %s: %d calls, %.3f ms total, p50 %.3f ms, "
+                "p99 %.3f ms, max %.3f ms" % (name, histogram.count,
+                    histogram.total * 1000,
+                    histogram.percentile(0.5) * 1000,
+                    histogram.percentile(0.99) * 1000,
+                    histogram.max * 1000))
+    return "\n".join(lines)
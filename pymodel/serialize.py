@@ -0,0 +1,407 @@
+"""
+Streaming binary serialization of model trees
+
+dump() writes a model and its descendants depth first, and load() reads
+them back. Memory use is proportional to the depth of the tree, not to its
+size, apart from the loaded models themselves.
+
+The stream is made of a header and records:
+
+    header: MAGIC, format version (byte)
+    CLASS: module, class name, number of properties, property names
+    BEGIN: class number, one value per property of the class record
+    END: closes the last BEGIN; the nodes between them are its children
+
+Classes are numbered in order of their CLASS record, written before their
+first node. As properties are stored by name, documents can be loaded by
+classes which gained or lost properties: unknown properties are ignored,
+and missing ones keep their default.
+
+Properties computed by formulas are stored as formulas. Those computed by
+other constraints are stored as values, and aggregates aren't stored, as
+they are computed again from the children.
+
+Values are None, booleans, integers, floats, strings, unicode strings,
+lists, tuples and dictionaries of those. Other values are pickled.
+"""
+
+from cStringIO import StringIO
+import cPickle
+import struct
+import sys
+from basemodel import BaseModel, batch_notify, get_formula, \
+    get_property_names, private
+from formula import Formula, formula
+
+MAGIC = "PYMD"
+VERSION = 1
+
+# record tags
+CLASS, BEGIN, END = range(3)
+
+# value tags
+(NONE, FALSE, TRUE, INT, NEGATIVE, FLOAT, STR, UNICODE, LIST, TUPLE, DICT,
+    FORMULA, PICKLE) = range(13)
+
+_double = struct.Struct("<d")
+
+# key: class
+# value: names of its stored properties
+_properties = {}
+
+def get_properties(cls):
+    """Return the sorted names of the properties of cls which are stored"""
+    names = _properties.get(cls)
+    if names is None:
+        aggregates = set(name for name, declaration in cls.__aggregates__)
+        names = _properties[cls] = tuple(name for name in
+            get_property_names(cls) if name not in aggregates)
+    return names
+
+def encode_varint(value):
+    """Return the unsigned integer value as a little endian base 128
+    string"""
+    if value < 0x80:
+        return chr(value)
+    chars = []
+    while value >= 0x80:
+        chars.append(chr(value & 0x7f | 0x80))
+        value >>= 7
+    chars.append(chr(value))
+    return "".join(chars)
+
+class Writer(object):
+
+    """Writes models to a file. Output is buffered in chunks of about
+    buffer_size bytes."""
+
+    buffer_size = 65536
+    magic = MAGIC
+    version = VERSION
+    get_properties = staticmethod(get_properties)
+
+    def __init__(self, file):
+        self.file = file
+        self.chunks = []
+        self.size = 0
+        # number of bytes written
+        self.offset = 0
+        # key: class
+        # value: class number
+        self.classes = {}
+        self.encoders = {
+            type(None): self.write_none,
+            bool: self.write_bool,
+            int: self.write_int,
+            long: self.write_int,
+            float: self.write_float,
+            str: self.write_str,
+            unicode: self.write_unicode,
+            list: self.write_list,
+            tuple: self.write_tuple,
+            dict: self.write_dict,
+        }
+
+    def write_header(self):
+        self.write(self.magic + chr(self.version))
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        self.offset += len(data)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.file.write("".join(self.chunks))
+        self.chunks = []
+        self.size = 0
+
+    def write_string(self, data):
+        self.write(encode_varint(len(data)) + data)
+
+    def write_class(self, cls):
+        number = self.classes[cls] = len(self.classes)
+        names = self.get_properties(cls)
+        self.write(chr(CLASS))
+        self.write_description(cls, names)
+        return number
+
+    def write_description(self, cls, names):
+        self.write_string(cls.__module__)
+        self.write_string(cls.__name__)
+        self.write(encode_varint(len(names)))
+        for name in names:
+            self.write_string(name)
+
+    def get_class(self, model):
+        return model.__class__
+
+    def write_node(self, model):
+        cls = self.get_class(model)
+        number = self.classes.get(cls)
+        if number is None:
+            number = self.write_class(cls)
+        self.write(chr(BEGIN) + encode_varint(number))
+        self.write_properties(model, self.get_properties(cls))
+
+    def write_properties(self, model, names):
+        for name in names:
+            self.write_property(model, name)
+
+    def write_property(self, model, name):
+        text = get_formula(model, name)
+        if text is not None:
+            self.write_formula(text)
+        else:
+            self.write_value(getattr(model, name))
+
+    def write_formula(self, text):
+        self.write(chr(FORMULA))
+        self.write_string(text.encode("utf-8"))
+
+    def write_tree(self, root):
+        self.write_node(root)
+        # iterators over the children of the open nodes
+        stack = [root.iter_children()]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                self.write(chr(END))
+            else:
+                self.write_node(child)
+                stack.append(child.iter_children())
+
+    def write_value(self, value):
+        encoder = self.encoders.get(type(value))
+        if encoder is None:
+            self.write_pickle(value)
+        else:
+            encoder(value)
+
+    def write_none(self, value):
+        self.write(chr(NONE))
+
+    def write_bool(self, value):
+        self.write(chr(TRUE if value else FALSE))
+
+    def write_int(self, value):
+        if value >= 0:
+            self.write(chr(INT) + encode_varint(value))
+        else:
+            self.write(chr(NEGATIVE) + encode_varint(-value))
+
+    def write_float(self, value):
+        self.write(chr(FLOAT) + _double.pack(value))
+
+    def write_str(self, value):
+        self.write(chr(STR))
+        self.write_string(value)
+
+    def write_unicode(self, value):
+        self.write(chr(UNICODE))
+        self.write_string(value.encode("utf-8"))
+
+    def write_list(self, value, tag=LIST):
+        self.write(chr(tag) + encode_varint(len(value)))
+        for item in value:
+            self.write_value(item)
+
+    def write_tuple(self, value):
+        self.write_list(value, TUPLE)
+
+    def write_dict(self, value):
+        self.write(chr(DICT) + encode_varint(len(value)))
+        for key, item in value.iteritems():
+            self.write_value(key)
+            self.write_value(item)
+
+    def write_pickle(self, value):
+        self.write(chr(PICKLE))
+        self.write_string(cPickle.dumps(value, 2))
+
+class Reader(object):
+
+    """Reads models from a file, in chunks of buffer_size bytes"""
+
+    buffer_size = 65536
+    magic = MAGIC
+    version = VERSION
+    get_properties = staticmethod(get_properties)
+
+    def __init__(self, file, classes=None):
+        self.file = file
+        self.buffer = ""
+        self.position = 0
+        # key: (module, class name)
+        # value: class to load in place of the one named
+        self.renamed = classes or {}
+        # class records, in order: (class, [(property name, attribute name
+        # or None if the property is unknown)])
+        self.classes = []
+        self.decoders = {
+            NONE: lambda : None,
+            FALSE: lambda : False,
+            TRUE: lambda : True,
+            INT: self.read_varint,
+            NEGATIVE: lambda : -self.read_varint(),
+            FLOAT: lambda : _double.unpack(self.read(8))[0],
+            STR: self.read_string,
+            UNICODE: lambda : self.read_string().decode("utf-8"),
+            LIST: lambda : [self.read_value()
+                for i in xrange(self.read_varint())],
+            TUPLE: lambda : tuple([self.read_value()
+                for i in xrange(self.read_varint())]),
+            DICT: self.read_dict,
+            FORMULA: lambda : formula(self.read_string().decode("utf-8")),
+            PICKLE: lambda : cPickle.loads(self.read_string()),
+        }
+
+    def read_header(self):
+        header = self.read(len(self.magic) + 1)
+        if header[:len(self.magic)] != self.magic:
+            raise Exception("not a model stream")
+        if ord(header[-1]) > self.version:
+            raise Exception("unsupported model stream version %d" %
+                ord(header[-1]))
+
+    def read(self, size):
+        end = self.position + size
+        if end > len(self.buffer):
+            data = self.buffer[self.position:]
+            while len(data) < size:
+                chunk = self.file.read(max(self.buffer_size, size))
+                if not chunk:
+                    raise Exception("truncated model stream")
+                data += chunk
+            self.buffer = data
+            self.position = 0
+            end = size
+        data = self.buffer[self.position:end]
+        self.position = end
+        return data
+
+    def read_byte(self):
+        position = self.position
+        if position < len(self.buffer):
+            self.position = position + 1
+            return ord(self.buffer[position])
+        return ord(self.read(1))
+
+    def read_varint(self):
+        byte = self.read_byte()
+        if byte < 0x80:
+            return byte
+        value = byte & 0x7f
+        shift = 7
+        while True:
+            byte = self.read_byte()
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def read_string(self):
+        return self.read(self.read_varint())
+
+    def read_value(self):
+        return self.decoders[self.read_byte()]()
+
+    def read_dict(self):
+        value = {}
+        for i in xrange(self.read_varint()):
+            key = self.read_value()
+            value[key] = self.read_value()
+        return value
+
+    def resolve(self, module, name):
+        cls = self.renamed.get((module, name))
+        if cls is None:
+            __import__(module)
+            cls = getattr(sys.modules[module], name)
+        return cls
+
+    def read_class(self):
+        module = self.read_string()
+        name = self.read_string()
+        cls = self.resolve(module, name)
+        known = set(self.get_properties(cls))
+        properties = []
+        for i in xrange(self.read_varint()):
+            prop = self.read_string()
+            properties.append((prop, private(prop) if prop in known
+                else None))
+        self.classes.append((cls, properties))
+
+    def new_model(self, cls):
+        """Return a new instance of cls, without calling its constructor"""
+        model = cls.__new__(cls)
+        BaseModel.__init__(model)
+        return model
+
+    def read_node(self):
+        """Read a class number and the values of the properties of the
+        class. Returns the new model, and the (property, Formula) pairs of
+        its formulas, which are left for the caller to set."""
+        cls, properties = self.classes[self.read_varint()]
+        model = self.new_model(cls)
+        formulas = []
+        for prop, attrname in properties:
+            value = self.read_value()
+            if attrname is None:
+                continue
+            if isinstance(value, Formula):
+                formulas.append((prop, value))
+            else:
+                # a new model has no observers nor dependents
+                setattr(model, attrname, value)
+        return model, formulas
+
+    def read_tree(self):
+        # [model, children, formulas] of the open nodes
+        stack = []
+        while True:
+            tag = self.read_byte()
+            if tag == BEGIN:
+                model, formulas = self.read_node()
+                stack.append((model, [], formulas))
+            elif tag == END:
+                model, children, formulas = stack.pop()
+                if children:
+                    model.add_children(children)
+                # once the children they may read are there
+                for prop, value in formulas:
+                    setattr(model, prop, value)
+                if not stack:
+                    return model
+                stack[-1][1].append(model)
+            elif tag == CLASS:
+                self.read_class()
+            else:
+                raise Exception("invalid model stream record %d" % tag)
+
+def dump(model, file):
+    """Write model and its descendants to file"""
+    writer = Writer(file)
+    writer.write_header()
+    writer.write_tree(model)
+    writer.flush()
+
+def load(file, classes=None):
+    """Read a model and its descendants from file. Models are created
+    without calling their constructor. classes maps (module, class name)
+    pairs to the classes to use instead, for classes which were renamed
+    or moved since the file was written."""
+    reader = Reader(file, classes)
+    reader.read_header()
+    with batch_notify():
+        return reader.read_tree()
+
+def dumps(model):
+    output = StringIO()
+    dump(model, output)
+    return output.getvalue()
+
+def loads(data, classes=None):
+    return load(StringIO(data), classes)
@@ -0,0 +1,243 @@
+"""
+Snapshots of model trees, and differences between them
+
+    tracker = Tracker(document)
+    before = tracker.snapshot()
+    ...
+    after = tracker.snapshot()
+    for change in diff(before, after):
+        ...
+
+A Snapshot is the immutable state of a model and its descendants: the
+values of their properties, and their children. A Tracker keeps the last
+snapshot of each model of a tree, and follows the changes of the tree
+from its signals. Taking a snapshot only makes new Snapshots for the
+models which changed since the previous one and for their ancestors;
+the others are shared. Its cost is thus proportional to the changes made
+in between, and a snapshot of an unchanged tree is free.
+
+Snapshots can be read from any thread, for example to save or export a
+document while it is being edited. Values are shared with the models, not
+copied, and changes are only seen once notified, so that a snapshot taken
+inside a batch_notify() block misses the changes of the block.
+
+diff() compares two snapshots of the same tree. Shared subtrees are
+skipped, so that its cost is proportional to the differences.
+"""
+
+from basemodel import get_property_names
+
+# flags of the models changed since their last snapshot
+VALUES, CHILDREN = 1, 2
+
+class Snapshot(object):
+
+    """The state of model and its descendants. values are those of the
+    properties of model, in the order of get_property_names(), and
+    children the Snapshots of its children."""
+
+    __slots__ = ("model", "values", "children")
+
+    def __init__(self, model, values, children):
+        self.model = model
+        self.values = values
+        self.children = children
+
+    def __repr__(self):
+        return "<Snapshot of %r>" % self.model
+
+    def get(self, name):
+        """Return the value of the property name"""
+        names = get_property_names(self.model.__class__)
+        return self.values[names.index(name)]
+
+    def iter_children(self):
+        return iter(self.children)
+
+class Tracker(object):
+
+    """Takes snapshots of the tree of root"""
+
+    def __init__(self, root):
+        self.root = root
+        # key: model
+        # value: its parent, None for root
+        self.parents = {root: None}
+        # key: model
+        # value: its last Snapshot
+        self.snapshots = {}
+        # key: model changed since its last snapshot
+        # value: VALUES if its properties changed, CHILDREN if its children
+        # or their descendants did, or both. The ancestors of a changed
+        # model are always flagged CHILDREN.
+        self.changed = {}
+        self.watch(root)
+
+    def watch(self, model):
+        stack = [model]
+        while stack:
+            model = stack.pop()
+            self.changed[model] = VALUES | CHILDREN
+            model.connect("attribute-changed", self.attribute_changed)
+            model.connect("attribute-invalidated", self.attribute_changed)
+            model.connect("child-added", self.child_added)
+            model.connect("child-removed", self.child_removed)
+            model.connect("children-added", self.children_added)
+            model.connect("children-removed", self.children_removed)
+            for child in model.iter_children():
+                self.parents[child] = model
+                stack.append(child)
+
+    def unwatch(self, model):
+        stack = [model]
+        while stack:
+            model = stack.pop()
+            for function in (self.attribute_changed, self.child_added,
+                    self.child_removed, self.children_added,
+                    self.children_removed):
+                model.disconnect_by_function(function)
+            del self.parents[model]
+            self.snapshots.pop(model, None)
+            self.changed.pop(model, None)
+            stack.extend(model.iter_children())
+
+    def close(self):
+        """Stop following the changes of the tree"""
+        self.unwatch(self.root)
+
+    def invalidate(self, model, flag):
+        changed = self.changed
+        parents = self.parents
+        while model is not None:
+            flags = changed.get(model, 0)
+            if flags & flag:
+                return
+            changed[model] = flags | flag
+            if flags:
+                # its ancestors are already flagged
+                return
+            model = parents[model]
+            flag = CHILDREN
+
+    # signals
+
+    def attribute_changed(self, model, name, *args):
+        self.invalidate(model, VALUES)
+
+    def child_added(self, model, child):
+        self.children_added(model, None, [child])
+
+    def children_added(self, model, index, children):
+        for child in children:
+            self.parents[child] = model
+            self.watch(child)
+        self.invalidate(model, CHILDREN)
+
+    def child_removed(self, model, child):
+        self.unwatch(child)
+        self.invalidate(model, CHILDREN)
+
+    def children_removed(self, model, ranges):
+        for index, run in ranges:
+            for child in run:
+                self.unwatch(child)
+        self.invalidate(model, CHILDREN)
+
+    # snapshots
+
+    def snapshot(self, model=None):
+        """Return the Snapshot of model, root by default"""
+        if model is None:
+            model = self.root
+        if model not in self.changed:
+            return self.snapshots[model]
+        stack = [self.open(model)]
+        while stack:
+            top = stack[-1]
+            child = next(top[1], None)
+            if child is None:
+                stack.pop()
+                snapshot = self.close_snapshot(*top)
+                if stack:
+                    stack[-1][2].append(snapshot)
+            elif child in self.changed:
+                stack.append(self.open(child))
+            else:
+                top[2].append(self.snapshots[child])
+        return snapshot
+
+    def open(self, model):
+        """Return [model, iterator over the children to snapshot, their
+        snapshots], or None for the snapshots if the previous ones are
+        still current"""
+        if self.changed[model] & CHILDREN:
+            return [model, model.iter_children(), []]
+        return [model, iter(()), None]
+
+    def close_snapshot(self, model, children, snapshots):
+        flags = self.changed.pop(model)
+        previous = self.snapshots.get(model)
+        if flags & VALUES:
+            values = tuple([getattr(model, name) for name in
+                get_property_names(model.__class__)])
+        else:
+            values = previous.values
+        if snapshots is None:
+            snapshots = previous.children
+        else:
+            snapshots = tuple(snapshots)
+        snapshot = self.snapshots[model] = Snapshot(model, values, snapshots)
+        return snapshot
+
+def diff(old, new):
+    """Return the differences from the Snapshot old to new, of the same
+    model, as a list of tuples:
+
+        ("changed", model, name, oldvalue, value)
+        ("removed", parent, index, snapshot)
+        ("added", parent, index, snapshot)
+        ("reordered", parent, children)
+
+    Values are compared with the comparators of their properties. Removed
+    children are given with their index in old, added ones with their
+    index in new. reordered is reported when the children in both
+    aren't in the same order, with the list of the children of new."""
+    changes = []
+    stack = [(old, new)]
+    while stack:
+        old, new = stack.pop()
+        if old is new:
+            continue
+        model = new.model
+        if old.values is not new.values:
+            cls = model.__class__
+            names = get_property_names(cls)
+            for name, oldvalue, value in zip(names, old.values, new.values):
+                if oldvalue is not value and \
+                        not getattr(cls, name).compare(oldvalue, value):
+                    changes.append(("changed", model, name, oldvalue,
+                        value))
+        if old.children is new.children:
+            continue
+
+        # children are matched by identity
+        previous = dict((id(child.model), child) for child in old.children)
+        current = set(id(child.model) for child in new.children)
+        kept = []
+        for index, child in enumerate(old.children):
+            if id(child.model) in current:
+                kept.append(child.model)
+            else:
+                changes.append(("removed", model, index, child))
+        order = []
+        for index, child in enumerate(new.children):
+            before = previous.get(id(child.model))
+            if before is None:
+                changes.append(("added", model, index, child))
+            else:
+                order.append(child.model)
+                stack.append((before, child))
+        if any(a is not b for a, b in zip(kept, order)):
+            changes.append(("reordered", model,
+                [child.model for child in new.children]))
+    return changes
@@ -0,0 +1,101 @@
+import operator
+import random
+import unittest
+import basemodel
+from aggregate import aggregate, Sum, Count, Mean, Min, Max, Fold
+
+TestCase = unittest.TestCase
+
+class Transaction(basemodel.BaseModel):
+
+    debit = basemodel.property(0)
+    credit = basemodel.property(0)
+
+    def __init__(self, debit=0, credit=0):
+        basemodel.BaseModel.__init__(self)
+        self.debit = debit
+        self.credit = credit
+
+class Account(basemodel.BaseModel):
+
+    debit = aggregate(Sum, "debit")
+    credit = aggregate(Sum, "credit")
+    count = aggregate(Count)
+    mean = aggregate(Mean, "debit")
+    smallest = aggregate(Min, "debit")
+    largest = aggregate(Max, "debit")
+
+    def __init__(self):
+        basemodel.BaseModel.__init__(self)
+
+class ProductAccount(Account):
+
+    # the credits aren't 0
+    product = aggregate(Fold, "credit", operator.mul, operator.div, 1)
+
+class TestAggregate(TestCase):
+
+    def check(self, account):
+        debits = [t.debit for t in account.iter_children()]
+        credits = [t.credit for t in account.iter_children()]
+        self.failUnlessEqual(account.debit, sum(debits))
+        self.failUnlessEqual(account.credit, sum(credits))
+        self.failUnlessEqual(account.count, len(debits))
+        self.failUnlessEqual(account.product, reduce(operator.mul, credits,
+            1))
+        if debits:
+            self.failUnlessEqual(account.mean,
+                sum(debits) / float(len(debits)))
+            self.failUnlessEqual(account.smallest, min(debits))
+            self.failUnlessEqual(account.largest, max(debits))
+        else:
+            self.failUnlessEqual((account.mean, account.smallest,
+                account.largest), (None, None, None))
+
+    def testAggregates(self):
+        rand = random.Random(1)
+        account = ProductAccount()
+        self.check(account)
+        transactions = [Transaction(rand.randrange(100), rand.randint(1, 3))
+            for i in xrange(50)]
+        account.add_children(transactions[:20])
+        self.check(account)
+        for i in xrange(200):
+            operation = rand.randrange(3)
+            children = list(account.iter_children())
+            if operation == 0 and children:
+                account.remove_child(rand.choice(children))
+            elif operation == 1:
+                outside = [t for t in transactions if t not in children]
+                if outside:
+                    account.add_child(rand.choice(outside))
+            else:
+                transaction = rand.choice(transactions)
+                transaction.debit = rand.randrange(100)
+            self.check(account)
+        account.remove_children(list(account.iter_children()))
+        self.check(account)
+
+    def testNested(self):
+        root = Account()
+        accounts = [root]
+        for depth in xrange(3):
+            account = Account()
+            accounts[-1].add_child(account)
+            accounts.append(account)
+        transaction = Transaction(5, 1)
+        accounts[-1].add_child(transaction)
+        changes = []
+        root.connect("debit-changed",
+            lambda model, old, new: changes.append(new))
+
+        with basemodel.batch_notify():
+            transaction.debit = 7
+            transaction.debit = 8
+        transaction.debit = 9
+        self.failUnlessEqual([a.debit for a in accounts], [9] * 4)
+        self.failUnlessEqual(changes, [8, 9])
+
+
+if __name__ == '__main__':
+    unittest.main()
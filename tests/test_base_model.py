@@ -1,5 +1,9 @@
+import json
+import multiprocessing.pool
+import threading
 import unittest
 import basemodel as basemodel
+import graph
 
 TestCase = unittest.TestCase
 
@@ -30,6 +34,33 @@ class MyModelThree(MyModel):
         self.bar = lambda : self.foo + "bar"
         self.baz = lambda : self.bar + "baz"
 
+class LazyModel(basemodel.BaseModel):
+
+    foo = basemodel.property("foo")
+    bar = basemodel.property(lazy=True)
+    baz = basemodel.property()
+
+class ParallelModel(basemodel.BaseModel):
+
+    value = basemodel.property(0, parallel=True)
+
+class CompactModel(basemodel.BaseModel):
+
+    __compact__ = True
+
+    foo = basemodel.property("foo")
+    bar = basemodel.property(lazy=True)
+
+class CompactModelTwo(CompactModel):
+
+    __slots__ = ("extra",)
+
+    baz = basemodel.property(0)
+
+class FloatModel(basemodel.BaseModel):
+
+    value = basemodel.property(0.0, compare=basemodel.close(1e-6))
+
 class TestBaseModel (TestCase):
 
     def setUp(self):
@@ -114,6 +145,367 @@ class TestBaseModel (TestCase):
         m.foo = "snickers"
         self.failUnlessEqual(m.bar, "snickerscandybar")
 
+    def testFreezeNotify(self):
+        m = MyModel()
+        m.connect("attribute-changed", self.attrChanged)
+        m.connect("foo-changed", self.fooChanged)
+        changes = []
+        m.connect("bar-changed", lambda m, old, new: changes.append((old,
+            new)))
+
+        with m.freeze_notify():
+            m.foo = "a"
+            m.foo = "b"
+            m.bar = "c"
+            m.bar = "d"
+            m.baz = "quux"
+            m.baz = "baz"
+            self.failUnlessEqual(self.attrchangedcount, 0)
+
+        self.failUnlessEqual(self.attrchangedcount, 2)
+        self.failUnlessEqual(self.foochangedcount, 1)
+        self.failUnlessEqual(changes, [("bar", "d")])
+
+        m.foo = "e"
+        self.failUnlessEqual(self.attrchangedcount, 3)
+
+    def testBatchNotify(self):
+        m = MyModel()
+        m.bar = lambda : m.foo + "bar"
+        m2 = MyModel()
+        m2.bar = lambda : m.bar + m.foo
+        m2.connect("attribute-changed", self.attrChanged)
+        m2.connect("bar-changed", self.fooChanged)
+
+        with basemodel.batch_notify():
+            with m.freeze_notify():
+                m.foo = "a"
+            m.foo = "b"
+            m.foo = "c"
+            self.failUnlessEqual(self.attrchangedcount, 0)
+
+        self.failUnlessEqual(m2.bar, "cbarc")
+        self.failUnlessEqual(self.foochangedcount, 1)
+
+    def testGlitchFreePropagation(self):
+        m = MyModel()
+        m.bar = lambda : m.foo + "bar"
+        m2 = MyModel()
+        m2.foo = lambda : m.foo + "!"
+        m2.bar = lambda : m.bar + m2.foo
+        seen = []
+        def check(model, oldvalue, newvalue):
+            seen.append((m.foo, m.bar, m2.foo, m2.bar))
+        m.connect("foo-changed", check)
+        m2.connect("bar-changed", check)
+
+        recomputes = basemodel._propagator.recomputes
+        m.foo = "a"
+        # m.bar, m2.foo and m2.bar are each computed once
+        self.failUnlessEqual(basemodel._propagator.recomputes - recomputes,
+            3)
+        self.failUnlessEqual(seen, [("a", "abar", "a!", "abara!")] * 2)
+
+    def testLazyProperty(self):
+        m = LazyModel()
+        calls = []
+        def bar():
+            calls.append(None)
+            return m.foo + "bar"
+        m.bar = bar
+        m.baz = lambda : m.bar + "baz"
+        invalidated = []
+        m.connect("attribute-invalidated",
+            lambda model, name: invalidated.append(name))
+        m.connect("bar-changed", self.fooChanged)
+        self.failUnlessEqual(len(calls), 1)
+
+        m.foo = "a"
+        # baz is eager, and pulls the new value of bar
+        self.failUnlessEqual(m.baz, "abarbaz")
+        self.failUnlessEqual(len(calls), 2)
+        self.failUnlessEqual(invalidated, ["bar"])
+
+        m2 = LazyModel()
+        m2.bar = lambda : m.foo + m2.foo
+        m2.connect("attribute-invalidated",
+            lambda model, name: invalidated.append(name))
+        m2.connect("bar-changed", self.fooChanged)
+        m.foo = "b"
+        m.foo = "c"
+        # m.bar is pulled by m.baz each time, m2.bar stays dirty
+        self.failUnlessEqual(invalidated, ["bar"] * 4)
+        self.failUnlessEqual(m2.bar, "cfoo")
+        self.failUnlessEqual(m2.bar, "cfoo")
+        self.failUnlessEqual(self.foochangedcount, 0)
+
+    def testDependencyTracking(self):
+        from constraint import get_dependents
+        m = MyModel()
+        m2 = MyModel()
+        m2.foo = lambda : m.foo + m.foo + m.foo
+        constraint = m2._foo_private_func
+        self.failUnlessEqual(constraint.dependencies, set([(m, "foo")]))
+        self.failUnlessEqual(get_dependents(m, "foo"), set([constraint]))
+
+        # the dependencies follow the control flow of the function
+        m2.bar = lambda : m.bar if m.foo == "foo" else m.baz
+        constraint = m2._bar_private_func
+        self.failUnlessEqual(constraint.dependencies,
+            set([(m, "foo"), (m, "bar")]))
+        m.foo = "quux"
+        self.failUnlessEqual(m2.bar, "baz")
+        self.failUnlessEqual(constraint.dependencies,
+            set([(m, "foo"), (m, "baz")]))
+        self.failUnlessEqual(get_dependents(m, "bar"), ())
+        m.baz = "new"
+        self.failUnlessEqual(m2.bar, "new")
+
+        # replacing the constraints removes their subscriptions
+        m2.foo = "foo"
+        m2.bar = lambda : m.baz
+        m2.bar = "bar"
+        self.failUnlessEqual(m._dependents, {})
+        m.foo = "foo"
+        self.failUnlessEqual((m2.foo, m2.bar), ("foo", "bar"))
+
+    def testConcurrentTracking(self):
+        m = MyModel()
+        m2 = MyModel()
+        a_read, b_read, a_done = [threading.Event() for i in xrange(3)]
+
+        # a and b are evaluated in two threads, and interleave their reads
+        def a():
+            value = m.foo
+            a_read.set()
+            b_read.wait(5)
+            return value + m.bar
+
+        def b():
+            value = m.baz
+            b_read.set()
+            a_done.wait(5)
+            return value
+
+        def install_b():
+            a_read.wait(5)
+            m2.bar = b
+
+        thread = threading.Thread(target=install_b)
+        thread.start()
+        m2.foo = a
+        a_done.set()
+        thread.join()
+
+        self.failUnlessEqual(m2._foo_private_func.dependencies,
+            set([(m, "foo"), (m, "bar")]))
+        self.failUnlessEqual(m2._bar_private_func.dependencies,
+            set([(m, "baz")]))
+
+    def testEqualityCutoff(self):
+        m = MyModel()
+        m.foo = 1
+        m.bar = lambda : "positive" if m.foo > 0 else "negative"
+        calls = []
+        def baz():
+            calls.append(None)
+            return m.bar + "!"
+        m.baz = baz
+        m.connect("attribute-changed", self.attrChanged)
+
+        propagator = basemodel._propagator
+        recomputes, skipped = propagator.recomputes, propagator.skipped
+        m.foo = 2
+        # bar is recomputed, but its value didn't change
+        self.failUnlessEqual(propagator.recomputes - recomputes, 1)
+        self.failUnlessEqual(propagator.skipped - skipped, 1)
+        self.failUnlessEqual(len(calls), 1)
+        self.failUnlessEqual(self.attrchangedcount, 1)
+
+        m.foo = -1
+        self.failUnlessEqual(m.baz, "negative!")
+        self.failUnlessEqual(len(calls), 2)
+        self.failUnlessEqual(self.attrchangedcount, 4)
+
+    def testComparator(self):
+        m = FloatModel()
+        m2 = FloatModel()
+        m2.value = lambda : m.value * 2
+        m2.connect("value-changed", self.fooChanged)
+        m.value = 1e-9
+        self.failUnlessEqual(m.value, 0.0)
+        m.value = 1.0
+        m.value = 1.0 + 1e-7
+        self.failUnlessEqual(m2.value, 2.0)
+        self.failUnlessEqual(self.foochangedcount, 1)
+
+        # coalesced notifications use the comparator too
+        changes = []
+        m.connect("value-changed", lambda m, old, new: changes.append(new))
+        with m.freeze_notify():
+            m.value = 2.0
+            m.value = 1.0 + 2e-7
+        self.failUnlessEqual(changes, [])
+
+    def testCycleDetection(self):
+        m = MyModel()
+        m2 = MyModel()
+        m.foo = lambda : m2.foo + "!"
+        m2.bar = lambda : m.foo
+        self.failUnlessRaises(Exception, setattr, m2, "foo",
+            lambda : m2.bar)
+        # the assignment was rejected
+        self.failUnlessEqual(m2.foo, "foo")
+        self.failIf(hasattr(m2, "_foo_private_func"))
+        self.failUnlessEqual(basemodel.get_dependents(m2, "bar"), ())
+
+        m.bar = lambda : m.foo
+        self.failUnlessRaises(Exception, setattr, m, "bar",
+            lambda : m.bar + "!")
+        # the previous constraint is kept
+        m2.foo = "baz"
+        self.failUnlessEqual(m.bar, "baz!")
+        self.failUnlessEqual(m2.bar, "baz!")
+
+    def testGraph(self):
+        m = MyModel()
+        m2 = MyModel()
+        m2.bar = lambda : m.foo + m.bar
+        m2.baz = lambda : m2.bar + "!"
+        m.foo = "x"
+        constraints = [m2._bar_private_func, m2._baz_private_func]
+        for constraint in constraints:
+            self.failUnless(constraint in basemodel.get_constraints())
+        self.failUnlessEqual([c.evaluations for c in constraints], [2, 2])
+        self.failUnless(constraints[0].time > 0)
+
+        self.failUnlessEqual(graph.get_upstream(constraints[1:]),
+            constraints[::-1])
+        self.failUnlessEqual(graph.to_dot(constraints).replace(
+            "\\n", " ").splitlines()[1:-1], [
+            '    n0 [shape=box, label="MyModel.bar 2 evals, %.3f ms"];' %
+                (constraints[0].time * 1000),
+            '    n1 [shape=box, label="MyModel.baz 2 evals, %.3f ms"];' %
+                (constraints[1].time * 1000),
+            '    n2 [label="MyModel.bar"];',
+            '    n3 [label="MyModel.foo"];',
+            '    n2 -> n0;',
+            '    n3 -> n0;',
+            '    n0 -> n1;',
+        ])
+        data = json.loads(graph.to_json(constraints))
+        self.failUnlessEqual(len(data["nodes"]), 4)
+        self.failUnlessEqual(data["nodes"][1]["evaluations"], 2)
+        self.failUnlessEqual(data["edges"][2], {"from": "n0", "to": "n1"})
+
+        m2.baz = "baz"
+        self.failIf(constraints[1] in basemodel.get_constraints())
+
+    def testParallelConstraints(self):
+        source = MyModel()
+        source.foo = 1
+        threads = []
+        def function(i):
+            def compute():
+                threads.append(threading.current_thread())
+                return source.foo * i
+            return compute
+        models = []
+        for i in xrange(4):
+            model = ParallelModel()
+            model.value = function(i)
+            models.append(model)
+        # depends on the parallel constraints, and on one of their
+        # dependencies
+        sink = ParallelModel()
+        sink.value = lambda : sum(m.value for m in models) + source.foo
+        changes = []
+        for model in models + [sink]:
+            model.connect("value-changed", lambda model, old, new:
+                changes.append((model, new, threading.current_thread())))
+
+        pool = basemodel._propagator.pool
+        basemodel.set_pool(multiprocessing.pool.ThreadPool(2))
+        try:
+            del threads[:]
+            source.foo = 2
+        finally:
+            basemodel._propagator.pool.close()
+            basemodel.set_pool(pool)
+        self.failUnlessEqual(len(threads), 4)
+        self.failIf(threading.current_thread() in threads)
+        self.failUnlessEqual(sink.value, 14)
+        # committed and notified from this thread, in topological order
+        self.failUnlessEqual(sorted(changes[:3]), sorted([
+            (models[1], 2, threading.current_thread()),
+            (models[2], 4, threading.current_thread()),
+            (models[3], 6, threading.current_thread())]))
+        self.failUnlessEqual(changes[3:],
+            [(sink, 14, threading.current_thread())])
+
+        self.failUnlessEqual([b[:] for b in basemodel._propagator.schedule(
+            basemodel._propagator.plan([(source, "foo")]))][1:],
+            [[sink._value_private_func]])
+
+    def testCompactModel(self):
+        m = CompactModelTwo()
+        self.failIf(hasattr(m, "__dict__"))
+        self.failUnlessEqual((m.foo, m.bar, m.baz), ("foo", None, 0))
+        m.extra = 1
+        self.failUnlessRaises(AttributeError, setattr, m, "other", 1)
+
+        m.connect("attribute-changed", self.attrChanged)
+        m.bar = lambda : m.foo + "bar"
+        m.baz = lambda : len(m.bar)
+        with m.freeze_notify():
+            m.foo = "x"
+        self.failUnlessEqual(self.attrchangedcount, 4)
+        self.failUnlessEqual((m.bar, m.baz), ("xbar", 4))
+        m.bar = "bar"
+        self.failUnlessEqual(m.baz, 3)
+
+        m.add_child(CompactModel())
+        self.failUnlessEqual(len(list(m.iter_children())), 1)
+        m.connect_weak("attribute-changed", self.attrChanged)
+
+        # the default layout has a __dict__ and the state slots
+        self.failUnless(hasattr(MyModel(), "__dict__"))
+        self.failUnlessEqual(MyModel.__initial__,
+            basemodel.BaseModel.__initial__)
+        self.failUnlessEqual(sorted(CompactModel.__initial__[-2:]),
+            [("_bar_private", None), ("_foo_private", "foo")])
+
+    def testBulkChildren(self):
+        m = MyModel()
+        m.connect("child-added", self.childAdded)
+        signals = []
+        m.connect("children-added", lambda model, index, children:
+            signals.append(("added", index, children)))
+        m.connect("children-removed", lambda model, ranges:
+            signals.append(("removed", ranges)))
+
+        children = [MyModel() for i in xrange(6)]
+        m.add_children(children[:2])
+        m.add_children(children[3:5], index=1)
+        m.insert_child(2, children[2])
+        m.add_child(children[5])
+        self.failUnlessEqual(list(m.iter_children()), [children[i]
+            for i in (0, 3, 2, 4, 1, 5)])
+        self.failUnlessEqual(self.children, [children[2], children[5]])
+        self.failUnlessEqual(m.get_child_count(), 6)
+        self.failUnlessEqual(m.index_of_child(children[1]), 4)
+
+        m.remove_children([children[i] for i in (5, 0, 1, 3)])
+        self.failUnlessEqual(list(m.iter_children()),
+            [children[2], children[4]])
+        self.failUnlessEqual(signals, [
+            ("added", 0, children[:2]),
+            ("added", 1, children[3:5]),
+            ("removed", [(4, [children[1], children[5]]),
+                (0, [children[0], children[3]])]),
+        ])
+        self.failUnlessRaises(Exception, m.add_child, children[2])
+
 
 if __name__ == '__main__':
     print unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from childlist import ChildList
+
+TestCase = unittest.TestCase
+
+class TestChildList(TestCase):
+
+    def testOrder(self):
+        children = ChildList(range(5))
+        children.append(5)
+        children.insert(0, [-1])
+        children.insert(3, ["a", "b"])
+        children.insert(-1, ["c"])
+        children.insert_before(5, ["d"])
+        self.failUnlessEqual(list(children),
+            [-1, 0, 1, "a", "b", 2, 3, 4, "c", "d", 5])
+        self.failUnlessEqual(len(children), 11)
+        self.failUnlessEqual((children[3], children[-2]), ("a", "d"))
+        self.failUnlessEqual(children.index("c"), 8)
+        self.failUnlessRaises(IndexError, children.__getitem__, 11)
+
+        # a failed insertion changes nothing
+        self.failUnlessRaises(Exception, children.extend, ["e", 3])
+        self.failUnlessRaises(Exception, children.extend, ["e", "e"])
+        self.failUnlessEqual(len(children), 11)
+
+    def testRemove(self):
+        children = ChildList(range(10))
+        for child in children:
+            if child % 3 == 0:
+                children.remove(child)
+        self.failUnlessEqual(list(children), [1, 2, 4, 5, 7, 8])
+        self.failIf(3 in children)
+        self.failUnlessRaises(ValueError, children.remove, 3)
+
+        ranges = children.remove_all([8, 1, 4, 2])
+        self.failUnlessEqual(ranges, [(5, [8]), (0, [1, 2, 4])])
+        self.failUnlessEqual(list(children), [5, 7])
+        self.failUnlessRaises(ValueError, children.remove_all, [5, 5])
+        self.failUnlessEqual(list(children), [5, 7])
+
+        # siblings removed while iterating aren't yielded
+        children = ChildList(range(6))
+        seen = []
+        for child in children:
+            seen.append(child)
+            if child + 1 in children:
+                children.remove(child + 1)
+        self.failUnlessEqual(seen, [0, 2, 4])
+        self.failUnlessEqual(list(children), [0, 2, 4])
+
+        children = ChildList(range(6))
+        for child in children:
+            if child == 1:
+                children.remove(1)
+                children.remove(2)
+                children.remove(3)
+            seen.append(child)
+        self.failUnlessEqual(seen[3:], [0, 1, 4, 5])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import basemodel
+from basemodel import formula
+
+TestCase = unittest.TestCase
+
+class Account(basemodel.BaseModel):
+
+    credit = basemodel.property(0)
+    debit = basemodel.property(0)
+    balance = basemodel.property(0)
+
+    def get_debit(self):
+        return self.debit
+
+class TestFormula(TestCase):
+
+    def setUp(self):
+        self.changes = []
+
+    def balanceChanged(self, model, oldvalue, newvalue):
+        self.changes.append(newvalue)
+
+    def testAnalysis(self):
+        f = formula("self.credit - self.debit")
+        self.failUnless(formula("self.credit - self.debit") is f)
+        self.failUnlessEqual(f.attributes, ("credit", "debit"))
+        self.failUnless(f.static)
+
+        f = formula("sum(c.balance for c in children if c.credit) + self.debit")
+        self.failUnlessEqual(f.attributes, ("debit",))
+        self.failUnlessEqual(f.child_attributes, ("balance", "credit"))
+        self.failUnless(f.uses_children)
+        self.failUnless(f.static)
+
+        self.failIf(formula("self.get_debit()").static)
+        self.failIf(formula("[a.credit for a in self.accounts]").static)
+        self.failUnlessRaises(Exception, formula, "self.credit - debit")
+        self.failUnless(formula("max(self.credit, 0)").static)
+        for text in ("getattr(self, 'credit')", "eval('self.credit')",
+                "__import__('os')", "open('/etc/passwd')",
+                "[c for c in ().__class__.__base__.__subclasses__() if "
+                    "c.__name__ == 'catch_warnings'][0]()._module."
+                    "__builtins__['__import__']('os').getpid()",
+                "self.iter_children().gi_frame.f_globals['__builtins__']"):
+            self.failUnlessRaises(Exception, formula, text)
+        self.failUnlessRaises(SyntaxError, formula, "self.credit -")
+
+    def testFormula(self):
+        account = Account()
+        account.credit = 10
+        account.balance = formula("self.credit - self.debit")
+        account.connect("balance-changed", self.balanceChanged)
+        self.failUnlessEqual(account.balance, 10)
+        self.failUnlessEqual(account._balance_private_func.dependencies,
+            set([(account, "credit"), (account, "debit")]))
+        account.debit = 3
+        account.credit = 5
+        self.failUnlessEqual(self.changes, [7, 2])
+        self.failUnlessEqual(basemodel.get_formula(account, "balance"),
+            "self.credit - self.debit")
+        self.failUnlessEqual(basemodel.get_formula(account, "credit"), None)
+
+        # tracked as usual
+        account.balance = formula("-self.get_debit()")
+        self.failUnlessEqual(account._balance_private_func.dependencies,
+            set([(account, "debit")]))
+        account.debit = 4
+        self.failUnlessEqual(self.changes, [7, 2, -3, -4])
+
+        self.failUnlessRaises(Exception, setattr, account, "balance",
+            formula("self.balance + 1"))
+
+    def testChildren(self):
+        total = Account()
+        basemodel.BaseModel.__init__(total)
+        total.balance = formula("sum(c.balance for c in children)")
+        total.connect("balance-changed", self.balanceChanged)
+        accounts = []
+        for i in xrange(3):
+            account = Account()
+            account.credit = i + 1
+            account.balance = formula("self.credit - self.debit")
+            total.add_child(account)
+            accounts.append(account)
+        accounts[1].debit = 2
+        total.remove_child(accounts[2])
+        accounts[2].credit = 10
+        self.failUnlessEqual(self.changes, [1, 3, 6, 4, 1])
+
+        # the children of formulas which aren't static are tracked too
+        total.balance = formula("sum(c.get_debit() for c in children)")
+        self.failUnlessEqual(total.balance, 2)
+        accounts[2].debit = 7
+        total.add_child(accounts[2])
+        self.failUnlessEqual(total.balance, 9)
+        total.remove_child(accounts[0])
+        self.failUnlessEqual(total.balance, 9)
+        total.remove_child(accounts[1])
+        self.failUnlessEqual(total.balance, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import basemodel
+from index import index, HashIndex, SortedIndex, SortedList
+
+TestCase = unittest.TestCase
+
+class Transaction(basemodel.BaseModel):
+
+    payee = basemodel.property("")
+    debit = basemodel.property(0)
+
+    def __init__(self, payee, debit):
+        basemodel.BaseModel.__init__(self)
+        self.payee = payee
+        self.debit = debit
+
+class Account(basemodel.BaseModel):
+
+    debit = basemodel.property(0)
+
+    by_payee = index(HashIndex, "payee")
+    by_debit = index(SortedIndex, "debit", Transaction)
+    all_debits = index(SortedIndex, "debit")
+    payees = index(SortedIndex, "payee")
+
+class TestIndex(TestCase):
+
+    def setUp(self):
+        self.ledger = Account()
+        self.savings = Account()
+        self.ledger.add_child(self.savings)
+        self.rent = Transaction("rent", 500)
+        self.food = Transaction("food", 40)
+        self.fuel = Transaction("fuel", 60)
+        self.ledger.add_children([self.rent, self.food])
+        self.savings.add_child(self.fuel)
+
+    def testSortedList(self):
+        items = SortedList()
+        items.load = 2
+        values = [5, 3, 9, 1, 7, 2, 8, 6, 4, 0]
+        for value in values:
+            items.add(value)
+        self.failUnlessEqual(list(items.iter_from(0)), range(10))
+        self.failUnless(len(items.lists) > 1)
+        for value in values[::2]:
+            items.remove(value)
+        self.failUnlessEqual(list(items.iter_from(3)), [3, 6])
+        self.failUnlessEqual(len(items), 5)
+        self.failUnlessRaises(ValueError, items.remove, 5)
+        self.failUnlessRaises(ValueError, items.remove, 10)
+
+    def testLookups(self):
+        ledger = self.ledger
+        self.failUnlessEqual(ledger.by_payee.get("rent"), [self.rent])
+        self.failUnlessEqual(ledger.by_payee.get("tax"), [])
+        self.failUnlessEqual(list(ledger.by_debit.range(50, None)),
+            [self.fuel, self.rent])
+        self.failUnlessEqual(list(ledger.by_debit.range(40, 500,
+            (False, False))), [self.fuel])
+        self.failUnlessEqual(list(ledger.by_debit.range(None, 60)),
+            [self.food, self.fuel])
+        self.failUnlessEqual(list(ledger.payees.prefix("f")),
+            [self.food, self.fuel])
+        self.failUnlessEqual(list(ledger.payees.prefix("z")), [])
+        self.failUnlessEqual(ledger.by_debit.get(60), [self.fuel])
+        # without a class, models having the property are indexed
+        self.failUnlessEqual(list(ledger.all_debits.range()),
+            [self.savings, self.food, self.fuel, self.rent])
+        self.failUnless(ledger.by_debit is ledger.by_debit)
+        self.failIf(self.savings.by_debit is ledger.by_debit)
+        self.failUnless(ledger.by_debit.get_memory() > 0)
+
+    def testUpdates(self):
+        ledger = self.ledger
+        by_payee = ledger.by_payee
+        by_debit = ledger.by_debit
+        self.fuel.debit = 1000
+        self.food.payee = "groceries"
+        self.failUnlessEqual(list(by_debit.range(100)),
+            [self.rent, self.fuel])
+        self.failUnlessEqual(by_payee.get("food"), [])
+        self.failUnlessEqual(by_payee.get("groceries"), [self.food])
+
+        tax = Transaction("tax", 100)
+        self.savings.insert_child(0, tax)
+        nested = Account()
+        nested.add_child(Transaction("rent", 1))
+        ledger.add_children([nested])
+        self.failUnlessEqual([t.debit for t in by_payee.get("rent")
+            if t is not self.rent], [1])
+        self.failUnlessEqual(by_debit.get(100), [tax])
+
+        ledger.remove_children([self.savings, nested])
+        self.failUnlessEqual(list(by_debit.range()), [self.food, self.rent])
+        self.failUnlessEqual(by_payee.get("tax"), [])
+        tax.debit = 5
+        self.failUnlessEqual(len(by_debit), 2)
+
+        with basemodel.batch_notify():
+            self.rent.debit = 1
+            self.rent.debit = 2
+        self.failUnlessEqual(list(by_debit.range()), [self.rent, self.food])
+
+        by_debit.close()
+        self.food.debit = 0
+        self.failUnlessEqual(len(by_debit), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+import basemodel
+import journal
+from aggregate import aggregate, Sum
+from formula import formula
+
+TestCase = unittest.TestCase
+
+class Node(basemodel.BaseModel):
+
+    name = basemodel.property("")
+    value = basemodel.property(0)
+    total = aggregate(Sum, "value")
+
+    def __init__(self, name, value=0):
+        basemodel.BaseModel.__init__(self)
+        self.name = name
+        self.value = value
+
+class LazyNode(basemodel.BaseModel):
+
+    foo = basemodel.property("foo")
+    bar = basemodel.property(lazy=True)
+
+class FullFile(object):
+
+    def write(self, data):
+        raise IOError(errno.ENOSPC, "No space left on device")
+
+    def close(self):
+        pass
+
+class TestJournal(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "document")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def tree(self):
+        root = Node("root")
+        for i in xrange(3):
+            child = Node("child%d" % i, i)
+            root.add_child(child)
+            child.add_child(Node("leaf%d" % i, 10 * i))
+        return root
+
+    def dump(self, model):
+        return (model.__class__, model.name, model.value, model.total,
+            basemodel.get_formula(model, "value"),
+            [self.dump(child) for child in model.iter_children()])
+
+    def edit(self, root):
+        children = list(root.iter_children())
+        children[0].name = "renamed"
+        children[1].value = formula("sum(c.value for c in children) + 1")
+        new = Node("new", 5)
+        new.add_child(Node("grandchild", 6))
+        root.insert_child(1, new)
+        root.add_children([Node("a", 1), Node("b", 2)], 0)
+        root.remove_child(children[2])
+        new.value = 7
+        list(children[1].iter_children())[0].value = 100
+        with basemodel.batch_notify():
+            root.remove_children([children[0], new])
+            children[0].value = 50
+
+    def recover(self):
+        recovered = journal.Journal(self.path)
+        recovered.close()
+        return recovered.model
+
+    def testRecover(self):
+        root = self.tree()
+        log = journal.Journal(self.path, root)
+        self.failUnlessEqual(self.dump(self.recover()), self.dump(root))
+
+        log = journal.Journal(self.path, root)
+        self.edit(root)
+        log.flush()
+        # as if the process had been killed
+        recovered = self.recover()
+        log.close()
+        self.failUnlessEqual(self.dump(recovered), self.dump(root))
+        self.failUnlessEqual(recovered.total, root.total)
+
+        # recovered documents are journaled in turn
+        log = journal.Journal(self.path)
+        model = log.model
+        model.add_child(Node("last", 1000))
+        list(model.iter_children())[0].value = -1
+        log.close()
+        self.failUnlessEqual(self.dump(self.recover()), self.dump(model))
+
+    def testLazyProperty(self):
+        model = LazyNode()
+        log = journal.Journal(self.path, model)
+        model.bar = lambda : model.foo + "bar"
+        model.foo = "a"
+        log.close()
+        self.failUnlessEqual(model.bar, "abar")
+        self.failUnlessEqual(self.recover().bar, "abar")
+
+    def testIncompleteRecord(self):
+        root = self.tree()
+        log = journal.Journal(self.path, root)
+        root.name = "changed"
+        log.close()
+        expected = self.dump(root)
+        with open(self.path + ".log", "ab") as file:
+            file.write("\x05\x00\x00")
+        self.failUnlessEqual(self.dump(self.recover()), expected)
+
+        # the incomplete record is dropped before appending
+        log = journal.Journal(self.path)
+        log.model.value = 3
+        log.close()
+        self.failUnlessEqual(self.recover().value, 3)
+
+    def testMissingRecord(self):
+        root = self.tree()
+        log = journal.Journal(self.path, root)
+        root.name = "first"
+        root.value = 2
+        root.name = "third"
+        log.close()
+        records = list(journal.read_records(self.path + ".log"))
+        with open(self.path + ".log", "rb") as file:
+            data = file.read()
+        with open(self.path + ".log", "wb") as file:
+            file.write(data[:records[0][2]] + data[records[1][2]:])
+        # replay stops before the record following the missing one
+        recovered = self.recover()
+        self.failUnlessEqual((recovered.name, recovered.value),
+            ("first", 0))
+
+        log = journal.Journal(self.path)
+        log.model.value = 3
+        log.close()
+        recovered = self.recover()
+        self.failUnlessEqual((recovered.name, recovered.value),
+            ("first", 3))
+
+    def testWriteError(self):
+        root = self.tree()
+        log = journal.Journal(self.path, root)
+        log.log.close()
+        log.log = FullFile()
+        root.name = "lost"
+        self.failUnlessRaises(IOError, log.flush)
+        root.name = "ignored"
+        self.failUnlessRaises(IOError, log.flush)
+        self.failUnlessRaises(IOError, log.close)
+        self.failUnlessEqual(self.recover().name, "root")
+
+    def testCompact(self):
+        root = self.tree()
+        log = journal.Journal(self.path, root)
+        self.edit(root)
+        log.flush()
+        with open(self.path + ".log", "rb") as file:
+            records = file.read()
+        log.compact()
+        self.failIf(os.path.exists(self.path + ".old"))
+        self.failUnlessEqual(os.path.getsize(self.path + ".log"),
+            len(journal.LOG_MAGIC))
+        self.failUnlessEqual(self.dump(self.recover()), self.dump(root))
+
+        # records already in the snapshot aren't replayed again, as when
+        # a crash happens before the old log is removed
+        with open(self.path + ".old", "wb") as file:
+            file.write(records)
+        root.add_child(Node("after", 3))
+        log.close()
+        self.failUnlessEqual(self.dump(self.recover()), self.dump(root))
+
+    def testAutomaticCompaction(self):
+        root = self.tree()
+        log = journal.Journal(self.path, root)
+        log.compact_size = 200
+        for i in xrange(50):
+            root.value = i
+            log.flush()
+        log.close()
+        self.failUnless(os.path.getsize(self.path + ".log") < 200)
+        self.failUnlessEqual(self.dump(self.recover()), self.dump(root))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import random
+import unittest
+import basemodel
+from listmodel import ObservableList, merge_splices
+
+TestCase = unittest.TestCase
+
+class Total(basemodel.BaseModel):
+
+    value = basemodel.property(0)
+
+class ShortLogList(ObservableList):
+
+    log_size = 2
+
+class TestObservableList(TestCase):
+
+    def setUp(self):
+        self.splices = []
+
+    def splice(self, items, index, removed, inserted):
+        self.splices.append((index, removed, inserted))
+
+    def apply(self, mirror):
+        for index, removed, inserted in self.splices:
+            self.failUnlessEqual(mirror[index:index + len(removed)], removed)
+            mirror[index:index + len(removed)] = inserted
+        return mirror
+
+    def mutate(self, items, rand):
+        operation = rand.randrange(11)
+        size = len(items)
+        index = rand.randint(-size, size)
+        new = [rand.randrange(100) for i in xrange(rand.randrange(3))]
+        if operation == 0:
+            items.append(new and new[0])
+        elif operation == 1:
+            items.extend(new)
+        elif operation == 2:
+            items.insert(index, 7)
+        elif operation == 3 and size:
+            items.pop(rand.randrange(size))
+        elif operation == 4:
+            items[index:index + 2] = new
+        elif operation == 5:
+            del items[index:rand.randint(-size, size)]
+        elif operation == 6:
+            items.sort()
+        elif operation == 7:
+            items.reverse()
+        elif operation == 8 and size:
+            items[rand.randrange(size)] = 5
+        elif operation == 9:
+            step = rand.choice([-2, 2, 3])
+            items[index::step] = [0] * len(items[index::step])
+        elif operation == 10:
+            del items[index::rand.choice([-2, 2])]
+
+    def testSplices(self):
+        rand = random.Random(42)
+        for batch in (False, True):
+            original = [rand.randrange(100) for i in xrange(10)]
+            items = ObservableList(original)
+            reference = list(original)
+            items.connect("splice", self.splice)
+            self.splices = []
+            for i in xrange(20):
+                with basemodel.batch_notify():
+                    for j in xrange(5 if batch else 1):
+                        self.mutate(items, rand)
+                self.failUnlessEqual(self.apply(list(reference)), items)
+                reference = list(items)
+                self.splices = []
+
+    def testMerge(self):
+        items = ObservableList([1, 2, 3])
+        items.connect("splice", self.splice)
+        with items.freeze_notify():
+            for i in xrange(4, 8):
+                items.append(i)
+            items.insert(0, 0)
+            del items[1]
+        with items.freeze_notify():
+            items.append(8)
+            items.pop()
+        self.failUnlessEqual(self.splices, [(3, [], [4, 5, 6, 7]),
+            (0, [1], [0])])
+        self.failUnlessEqual(merge_splices((3, [], [4]), (5, [], [6])),
+            None)
+
+        del self.splices[:]
+        items.sort(reverse=True)
+        items[1:3] = items[1:3]
+        self.failUnlessEqual(self.splices, [(0, [0, 2, 3, 4, 5, 6, 7],
+            [7, 6, 5, 4, 3, 2, 0])])
+
+    def testConstraint(self):
+        items = ShortLogList([1, 2, 3])
+        total = Total()
+        total.value = lambda : sum(items)
+        items.extend([4, 5])
+        self.failUnlessEqual(total.value, 15)
+
+        # incremental sum
+        state = {"version": items.get_version(), "sum": sum(items)}
+        def incremental():
+            splices = items.get_splices(state["version"])
+            if splices is None:
+                state["sum"] = sum(items)
+            else:
+                for index, removed, inserted in splices:
+                    state["sum"] += sum(inserted) - sum(removed)
+            state["version"] = items.get_version()
+            return state["sum"]
+        total.value = incremental
+        items[0] = 10
+        del items[-2:]
+        self.failUnlessEqual(total.value, 15)
+        self.failUnlessEqual(items.get_splices(0), None)
+        self.failUnlessEqual(items.get_splices(items.get_version() - 1),
+            [(3, [4, 5], [])])
+
+
+if __name__ == '__main__':
+    unittest.main()
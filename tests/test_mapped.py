@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import unittest
+import basemodel
+import mapped
+from aggregate import aggregate, Sum
+from formula import formula
+
+TestCase = unittest.TestCase
+
+class Node(basemodel.BaseModel):
+
+    name = basemodel.property("")
+    value = basemodel.property(0)
+    total = aggregate(Sum, "value")
+
+    def __init__(self, name, value=0):
+        basemodel.BaseModel.__init__(self)
+        self.name = name
+        self.value = value
+
+class TestMapped(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "document")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def tree(self):
+        root = Node("root")
+        for i in xrange(3):
+            child = Node("child%d" % i, i)
+            root.add_child(child)
+            for j in xrange(i):
+                child.add_child(Node("leaf%d" % j, 10 * j))
+        return root
+
+    def dump(self, model):
+        return (model.name, model.value, model.total,
+            [self.dump(child) for child in model.iter_children()])
+
+    def isLazy(self, model):
+        return isinstance(model._get_children(), mapped.LazyChildList)
+
+    def testLoad(self):
+        root = self.tree()
+        expected = self.dump(root)
+        mapped.save(root, self.path)
+        loaded = mapped.load(self.path)
+
+        # aggregates are loaded, and counting doesn't read the children
+        self.failUnlessEqual((loaded.name, loaded.total), ("root", 3))
+        self.failUnlessEqual(loaded.get_child_count(), 3)
+        self.failUnless(self.isLazy(loaded))
+
+        children = list(loaded.iter_children())
+        self.failIf(self.isLazy(loaded))
+        self.failUnlessEqual([child.name for child in children],
+            ["child0", "child1", "child2"])
+        self.failIf(self.isLazy(children[0]))
+        self.failUnless(self.isLazy(children[2]))
+
+        # aggregates are maintained once the children are read
+        children[2].value = 7
+        self.failUnlessEqual((children[2].total, loaded.total), (10, 8))
+        list(children[2].iter_children())[1].value = 5
+        self.failUnlessEqual((children[2].total, loaded.total), (5, 8))
+
+        loaded = mapped.load(self.path)
+        self.failUnlessEqual(self.dump(loaded), expected)
+
+    def testMutateLazy(self):
+        mapped.save(self.tree(), self.path)
+        loaded = mapped.load(self.path)
+        child = Node("child3", 100)
+        loaded.insert_child(1, child)
+        self.failUnlessEqual(loaded.index_of_child(child), 1)
+        self.failUnlessEqual((loaded.get_child_count(), loaded.total),
+            (4, 103))
+
+    def testSaveCopies(self):
+        root = self.tree()
+        mapped.save(root, self.path)
+        loaded = mapped.load(self.path)
+        children = list(loaded.iter_children())
+        children[1].name = "renamed"
+        children[0].add_child(Node("new", 1))
+        expected = self.dump(mapped.load(self.path))
+        expected[3][1] = ("renamed",) + expected[3][1][1:]
+        expected[3][0] = ("child0", 0, 1, [("new", 1, 0, [])])
+
+        # the subtrees of child1 and child2 aren't read
+        mapped.save(loaded, self.path)
+        self.failUnless(self.isLazy(children[1]))
+        self.failUnless(self.isLazy(children[2]))
+        self.failUnlessEqual(self.dump(mapped.load(self.path)), expected)
+
+        # nor are they when the saved copy is saved in turn
+        copy = os.path.join(self.directory, "copy")
+        reloaded = mapped.load(self.path)
+        mapped.save(reloaded, copy)
+        self.failUnless(self.isLazy(reloaded))
+        self.failUnlessEqual(self.dump(mapped.load(copy)), expected)
+        self.failUnlessEqual(self.dump(loaded), expected)
+
+    def testFormula(self):
+        root = self.tree()
+        root.value = formula("sum(c.value for c in children) * 2")
+        mapped.save(root, self.path)
+        loaded = mapped.load(self.path)
+        self.failUnlessEqual(loaded.value, 6)
+        self.failUnlessEqual(basemodel.get_formula(loaded, "value"),
+            "sum(c.value for c in children) * 2")
+        list(loaded.iter_children())[0].value = 10
+        self.failUnlessEqual(loaded.value, 26)
+
+    def testInvalid(self):
+        with open(self.path, "wb") as file:
+            file.write("PYMD\x01")
+        self.failUnlessRaises(Exception, mapped.load, self.path)
+        mapped.save(self.tree(), self.path)
+        with open(self.path, "rb") as file:
+            data = file.read()
+        with open(self.path, "wb") as file:
+            file.write(data[:-1])
+        self.failUnlessRaises(Exception, mapped.load, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import basemodel
+from modelarray import ModelArray, numpy
+
+TestCase = unittest.TestCase
+
+class Clock(basemodel.BaseModel):
+
+    time = basemodel.property(0)
+
+class Shape(basemodel.BaseModel):
+
+    x = basemodel.property(0)
+    width = basemodel.property(10)
+    label = basemodel.property("")
+
+    def __init__(self, x=0):
+        basemodel.BaseModel.__init__(self)
+        self.x = x
+
+class CompactShape(Shape):
+
+    __compact__ = True
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestModelArray(TestCase):
+
+    def setUp(self):
+        self.changes = []
+
+    def columnChanged(self, array, name, indices):
+        self.changes.append((name, list(indices)))
+
+    def testViews(self):
+        shapes = ModelArray(Shape, ["x", "width"], capacity=2)
+        for i in xrange(5):
+            shapes.new(i)
+        self.failUnlessEqual(list(shapes.column("x")), range(5))
+        self.failUnlessEqual(list(shapes.column("width")), [10] * 5)
+
+        shapes.connect("column-changed", self.columnChanged)
+        attrs = []
+        shapes[3].connect("attribute-changed",
+            lambda model, name, old, new: attrs.append((name, old, new)))
+        shapes[3].x = 7
+        shapes[3].label = "label"
+        self.failUnlessEqual(shapes.column("x")[3], 7)
+        self.failUnlessEqual(attrs, [("x", 3, 7), ("label", "", "label")])
+        self.failUnlessEqual(self.changes, [("x", [3])])
+
+    def testVectorizedConstraint(self):
+        clock = Clock()
+        shapes = ModelArray(Shape, ["x", "width"])
+        with basemodel.batch_notify():
+            for i in xrange(4):
+                shapes.new()
+        shapes.constrain("x",
+            lambda shapes: numpy.arange(len(shapes)) * clock.time)
+        shapes.constrain("width", lambda shapes: shapes.column("x") + 10)
+        other = Shape()
+        other.x = lambda : shapes[2].x + 1
+        shapes.connect("column-changed", self.columnChanged)
+        shapes[1].connect("attribute-changed", self.fail)
+
+        clock.time = 2
+        self.failUnlessEqual(list(shapes.column("x")), [0, 2, 4, 6])
+        self.failUnlessEqual(list(shapes.column("width")), [10, 12, 14, 16])
+        self.failUnlessEqual(self.changes, [("x", [1, 2, 3]),
+            ("width", [1, 2, 3])])
+        self.failUnlessEqual(shapes[3].width, 16)
+        self.failUnlessEqual(other.x, 5)
+
+        shapes.new()
+        self.failUnlessEqual(list(shapes.column("x")), [0, 2, 4, 6, 8])
+
+    def testCompactClass(self):
+        shapes = ModelArray(CompactShape, ["x"])
+        shape = shapes.new(3)
+        shape.width = 5
+        self.failUnlessEqual((shape.x, shape.width), (3, 5))
+        self.failUnlessEqual(list(shapes.column("x")), [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,336 @@
+import gc
+import threading
+import unittest
+from observable import Observable
+import basemodel
+import dispatch
+import profiler
+
+TestCase = unittest.TestCase
+
+class MyObservable(Observable):
+
+    __signals__ = {
+        "foo": ("value",),
+        "bar": (),
+    }
+
+class ThreadSafeObservable(MyObservable):
+
+    __threadsafe__ = True
+
+class ThreadSafeModel(basemodel.BaseModel):
+
+    __threadsafe__ = True
+
+    value = basemodel.property(0)
+
+class PlainModel(basemodel.BaseModel):
+
+    value = basemodel.property(0)
+
+class WeakObservable(MyObservable):
+
+    __weak_connections__ = True
+
+class Receiver(object):
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def handler(self, sender, *args):
+        self.calls.append(args)
+
+class ManualLoop(object):
+
+    """Implements the part of the asyncio loop interface used by
+    AsyncDispatcher, running callbacks only when asked to"""
+
+    def __init__(self):
+        self.callbacks = []
+        self.now = 0.0
+
+    def call_soon(self, callback, *args):
+        self.callbacks.append((callback, args))
+
+    call_soon_threadsafe = call_soon
+
+    def time(self):
+        return self.now
+
+    def run_once(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback, args in callbacks:
+            callback(*args)
+
+class TestObservable(TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def handler(self, sender, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+    def otherHandler(self, sender, *args, **kwargs):
+        self.calls.append(("other", args, kwargs))
+
+    def testConnectEmit(self):
+        o = MyObservable()
+        o.connect("foo", self.handler)
+        o.connect("foo", self.handler, "bound", key="value")
+        o.emit("foo", 1, key="emitted", other=2)
+
+        self.failUnlessEqual(self.calls, [
+            ((1,), {"key": "emitted", "other": 2}),
+            ((1, "bound"), {"key": "value", "other": 2}),
+        ])
+
+    def testUnknownSignal(self):
+        o = MyObservable()
+        self.failUnlessRaises(Exception, o.connect, "baz", self.handler)
+
+    def testSignalTable(self):
+        o = MyObservable()
+        o2 = WeakObservable()
+        o.connect("foo", self.handler)
+        o2.connect("foo", self.handler)
+
+        self.failUnlessEqual(o.get_signal_names(), frozenset(["foo", "bar"]))
+        self.failUnless(o._signal_group.signals is
+            MyObservable().get_signal_names())
+        self.failUnless("__signal_names__" in WeakObservable.__dict__)
+        self.failUnlessEqual(o._signal_group.handlers.keys(), ["foo"])
+        o.emit("bar")
+        self.failUnlessRaises(Exception, o.emit, "baz")
+
+    def testIdsAreUnique(self):
+        o = MyObservable()
+        ids = [o.connect("foo", self.handler) for i in xrange(100)]
+        self.failUnlessEqual(len(set(ids)), 100)
+        o.disconnect(ids[-1])
+        self.failIf(o.connect("foo", self.handler) in ids)
+
+    def testDisconnect(self):
+        o = MyObservable()
+        ids = [o.connect("foo", self.handler, i) for i in xrange(20)]
+        for sigid in ids[:15]:
+            o.disconnect(sigid)
+        o.emit("foo")
+
+        self.failUnlessEqual([args for args, kwargs in self.calls],
+            [(i,) for i in xrange(15, 20)])
+        self.failUnlessRaises(Exception, o.disconnect, ids[0])
+
+    def testDisconnectDuringEmit(self):
+        o = MyObservable()
+        def disconnecting(sender):
+            self.calls.append("disconnecting")
+            for sigid in ids:
+                o.disconnect(sigid)
+        ids = [o.connect("bar", disconnecting)]
+        ids.extend(o.connect("bar", self.handler) for i in xrange(10))
+        o.emit("bar")
+
+        self.failUnlessEqual(self.calls, ["disconnecting"])
+
+    def testDisconnectByFunction(self):
+        o = MyObservable()
+        o.connect("foo", self.handler)
+        o.connect("bar", self.handler)
+        o.connect("foo", self.otherHandler)
+        o.disconnect_by_function(self.handler)
+        o.emit("foo")
+        o.emit("bar")
+
+        self.failUnlessEqual(self.calls, [("other", (), {})])
+        self.failUnlessRaises(Exception, o.disconnect_by_function,
+            self.handler)
+
+    def testConnectWeak(self):
+        o = MyObservable()
+        r = Receiver(self.calls)
+        o.connect_weak("foo", r.handler, "bound")
+        o.connect("foo", self.handler)
+        o.emit("foo", 1)
+        self.failUnlessEqual(self.calls, [(1, "bound"), ((1,), {})])
+
+        del r
+        gc.collect()
+        self.calls = []
+        o.emit("foo", 2)
+        self.failUnlessEqual(self.calls, [((2,), {})])
+        self.failUnlessEqual(o.get_pruned_count(), 1)
+
+    def testWeakPolicy(self):
+        o = WeakObservable()
+        r = Receiver(self.calls)
+        o.connect("foo", r.handler)
+        o.connect("bar", r.handler)
+        o.disconnect_by_function(r.handler)
+        o.connect("foo", r.handler)
+        o.emit("foo", 1)
+        self.failUnlessEqual(self.calls, [(1,)])
+
+        del r
+        gc.collect()
+        self.failUnlessEqual(o.get_pruned_count(), 1)
+        self.failUnlessEqual(o._signal_group.ids, {})
+        self.failUnlessEqual(o._signal_group.callback_ids, {})
+
+class TestProfiler(TestCase):
+
+    def tearDown(self):
+        profiler.disable()
+        profiler.reset()
+
+    def testProfile(self):
+        o = MyObservable()
+        o.connect("foo", lambda sender, value: o.emit("bar"))
+        r = Receiver([])
+        o.connect("bar", r.handler)
+        o.connect("bar", r.handler, 1)
+
+        o.emit("foo", 1)
+        self.failIf(profiler.get_stats())
+        with profiler.profile():
+            self.failUnless(profiler.is_enabled())
+            for i in xrange(3):
+                o.emit("foo", 1)
+            self.failUnlessRaises(Exception, o.emit, "unknown")
+        self.failIf(profiler.is_enabled())
+        o.emit("foo", 1)
+
+        foo, bar = sorted(profiler.get_stats(), key=lambda s: s.signame,
+            reverse=True)
+        self.failUnlessEqual(foo.get_name(), "MyObservable::foo")
+        self.failUnlessEqual((foo.emits, foo.nested, foo.max_depth), (3, 0, 1))
+        self.failUnlessEqual((bar.emits, bar.nested, bar.max_depth), (3, 3, 2))
+        self.failUnlessEqual((bar.fanout, bar.max_fanout), (6, 2))
+        self.failUnlessEqual(bar.handlers.keys(), ["Receiver.handler"])
+        histogram = bar.handlers["Receiver.handler"]
+        self.failUnlessEqual(histogram.count, 6)
+        self.failUnless(histogram.percentile(0.5) <=
+            histogram.percentile(0.99) <= histogram.max)
+        self.failUnless("Receiver.handler: 6 calls" in profiler.report())
+
+class TestAsyncDelivery(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.loop = ManualLoop()
+        self.dispatcher = dispatch.AsyncDispatcher(self.loop, maxsize=4)
+        dispatch.set_dispatcher(self.dispatcher)
+
+    def tearDown(self):
+        dispatch.set_dispatcher(None)
+
+    def handler(self, sender, *args):
+        self.calls.append(args)
+
+    def testConnectAsync(self):
+        o = MyObservable()
+        o.connect_async("foo", self.handler, "bound")
+        o.emit("foo", 1)
+        o.emit("foo", 2)
+        self.failUnlessEqual(self.calls, [])
+        self.failUnlessEqual(len(self.loop.callbacks), 1)
+
+        self.loop.now = 0.5
+        self.loop.run_once()
+        self.failUnlessEqual(self.calls, [(1, "bound"), (2, "bound")])
+        stats = self.dispatcher.get_stats()
+        self.failUnlessEqual(stats["delivered"], 2)
+        self.failUnlessEqual(stats["max_depth"], 2)
+        self.failUnlessEqual(stats["max_latency"], 0.5)
+
+        o.disconnect_by_function(self.handler)
+        o.emit("foo", 3)
+        self.failUnlessEqual(self.loop.callbacks, [])
+
+    def testEmitAsync(self):
+        o = MyObservable()
+        o.connect("foo", self.handler)
+        o.emit_async("foo", 1)
+        self.failUnlessEqual(self.calls, [])
+        self.loop.run_once()
+        self.failUnlessEqual(self.calls, [(1,)])
+
+    def testBackpressure(self):
+        o = MyObservable()
+        o.connect_async("foo", self.handler)
+        for i in xrange(6):
+            o.emit("foo", i)
+        # the producer delivered the first four itself
+        self.failUnlessEqual(self.calls, [(i,) for i in xrange(4)])
+        self.failUnlessEqual(self.dispatcher.get_depth(), 2)
+        self.loop.run_once()
+        self.failUnlessEqual(self.calls, [(i,) for i in xrange(6)])
+        self.failUnlessEqual(self.dispatcher.get_stats()["overflows"], 1)
+
+    def testCrossThreadEmit(self):
+        main = dispatch.ThreadSafeDispatcher(self.loop)
+        dispatch.set_main_dispatcher(main)
+        try:
+            o = ThreadSafeObservable()
+            threads = []
+            def handler(sender, value):
+                self.calls.append(value)
+                threads.append(threading.current_thread())
+            o.connect("foo", handler)
+
+            o.emit("foo", 0)
+            def worker():
+                for i in xrange(1, 11):
+                    o.emit("foo", i)
+            t = threading.Thread(target=worker)
+            t.start()
+            t.join()
+
+            self.failUnlessEqual(self.calls, [0])
+            self.failUnlessEqual(len(self.loop.callbacks), 1)
+            self.loop.run_once()
+            self.failUnlessEqual(self.calls, range(11))
+            self.failUnlessEqual(set(threads),
+                set([threading.current_thread()]))
+        finally:
+            dispatch.set_main_dispatcher(None)
+
+    def testCrossThreadWrite(self):
+        main = dispatch.ThreadSafeDispatcher(self.loop)
+        dispatch.set_main_dispatcher(main)
+        try:
+            model = ThreadSafeModel()
+            plain = PlainModel()
+            plain.value = lambda : model.value * 2
+            threads = []
+            def handler(sender, oldvalue, value):
+                self.calls.append((sender, value))
+                threads.append(threading.current_thread())
+            model.connect("value-changed", handler)
+            plain.connect("value-changed", handler)
+
+            def worker():
+                model.value = 1
+                model.add_child(PlainModel())
+                model.value = 2
+            with basemodel.batch_notify():
+                t = threading.Thread(target=worker)
+                t.start()
+                t.join()
+                model.value = 3
+            # the writes of the worker are made from the main loop, and
+            # weren't absorbed by the batch
+            self.failUnlessEqual(self.calls, [(model, 3), (plain, 6)])
+            self.failUnlessEqual(model.get_child_count(), 0)
+
+            self.loop.run_once()
+            self.failUnlessEqual(self.calls[2:], [(model, 1), (plain, 2),
+                (model, 2), (plain, 4)])
+            self.failUnlessEqual(model.get_child_count(), 1)
+            self.failUnlessEqual(set(threads),
+                set([threading.current_thread()]))
+        finally:
+            dispatch.set_main_dispatcher(None)
+
+if __name__ == '__main__':
+    unittest.main()
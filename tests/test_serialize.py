@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import cPickle
+import unittest
+import basemodel
+import serialize
+from aggregate import aggregate, Sum
+from formula import formula
+
+TestCase = unittest.TestCase
+
+class Node(basemodel.BaseModel):
+
+    name = basemodel.property("")
+    value = basemodel.property(0)
+    data = basemodel.property()
+    total = aggregate(Sum, "value")
+
+    def __init__(self, name):
+        basemodel.BaseModel.__init__(self)
+        self.name = name
+
+class OtherNode(basemodel.BaseModel):
+
+    name = basemodel.property("")
+    extra = basemodel.property("extra")
+
+class TestSerialize(TestCase):
+
+    def tree(self):
+        root = Node("root")
+        root.data = {"a": [1, -2, 2 ** 70, 1.5], (None, True): u"\xe9t\xe9"}
+        for i in xrange(3):
+            child = Node("child%d" % i)
+            child.value = i * 10
+            root.add_child(child)
+            for j in xrange(2):
+                leaf = Node("leaf")
+                leaf.value = -j
+                leaf.data = set([i, j])
+                child.add_child(leaf)
+        last = child
+        last.value = formula("sum(c.value for c in children) + 100")
+        return root
+
+    def check(self, original, loaded):
+        self.failUnless(loaded is not original)
+        self.failUnlessEqual(type(loaded), type(original))
+        for name in ("name", "value", "data", "total"):
+            self.failUnlessEqual(getattr(loaded, name),
+                getattr(original, name))
+        children = list(original.iter_children())
+        loaded_children = list(loaded.iter_children())
+        self.failUnlessEqual(len(loaded_children), len(children))
+        for child, loaded_child in zip(children, loaded_children):
+            self.check(child, loaded_child)
+
+    def testRoundTrip(self):
+        root = self.tree()
+        data = serialize.dumps(root)
+        self.failUnless(data.startswith(serialize.MAGIC))
+        loaded = serialize.loads(data)
+        self.check(root, loaded)
+
+        # formulas are stored as such, and aggregates recomputed
+        last = list(loaded.iter_children())[-1]
+        self.failUnlessEqual(basemodel.get_formula(last, "value"),
+            "sum(c.value for c in children) + 100")
+        list(last.iter_children())[0].value = 5
+        self.failUnlessEqual((last.value, loaded.total), (104, 114))
+
+        self.failUnlessRaises(Exception, serialize.loads, "PYMX\x01")
+        self.failUnlessRaises(Exception, serialize.loads, data[:-1])
+
+    def testSmallBuffers(self):
+        root = self.tree()
+        writer = serialize.Writer
+        reader = serialize.Reader
+        try:
+            writer.buffer_size = reader.buffer_size = 3
+            loaded = serialize.loads(serialize.dumps(root))
+        finally:
+            del writer.buffer_size, reader.buffer_size
+        self.check(root, loaded)
+
+    def testRenamedClass(self):
+        data = serialize.dumps(Node("root"))
+        loaded = serialize.loads(data,
+            {("test_serialize", "Node"): OtherNode})
+        self.failUnlessEqual(type(loaded), OtherNode)
+        self.failUnlessEqual((loaded.name, loaded.extra), ("root", "extra"))
+
+    def testPickleChildList(self):
+        root = OtherNode()
+        for i in xrange(3):
+            child = OtherNode()
+            child.name = "child%d" % i
+            root.add_child(child)
+        loaded = cPickle.loads(cPickle.dumps(root, 2))
+        self.failUnlessEqual([c.name for c in loaded.iter_children()],
+            ["child0", "child1", "child2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
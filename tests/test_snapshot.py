@@ -0,0 +1,110 @@
+import unittest
+import basemodel
+from aggregate import aggregate, Sum
+from snapshot import Tracker, diff
+
+TestCase = unittest.TestCase
+
+class Node(basemodel.BaseModel):
+
+    name = basemodel.property("")
+    value = basemodel.property(0)
+    total = aggregate(Sum, "value")
+
+    def __init__(self, name, value=0):
+        basemodel.BaseModel.__init__(self)
+        self.name = name
+        self.value = value
+
+class Point(basemodel.BaseModel):
+
+    x = basemodel.property(0.0, compare=basemodel.close(1e-6))
+
+class TestSnapshot(TestCase):
+
+    def setUp(self):
+        self.root = Node("root")
+        self.children = [Node("child%d" % i, i) for i in xrange(3)]
+        self.root.add_children(self.children)
+        self.leaf = Node("leaf", 10)
+        self.children[0].add_child(self.leaf)
+        self.tracker = Tracker(self.root)
+
+    def testSharing(self):
+        tracker = self.tracker
+        first = tracker.snapshot()
+        self.failUnless(tracker.snapshot() is first)
+        self.failUnlessEqual((first.get("name"), first.get("total")),
+            ("root", 3))
+
+        self.leaf.value = 11
+        second = tracker.snapshot()
+        self.failIf(second is first)
+        self.failUnlessEqual(first.children[0].children[0].get("value"), 10)
+        self.failUnlessEqual(second.children[0].children[0].get("value"), 11)
+        # only the path to the leaf is copied
+        self.failUnless(second.children[1] is first.children[1])
+        self.failUnless(second.values is first.values)
+        self.failUnless(tracker.snapshot(self.children[1]) is
+            first.children[1])
+
+        self.failUnlessEqual(diff(first, second),
+            [("changed", self.children[0], "total", 10, 11),
+             ("changed", self.leaf, "value", 10, 11)])
+        self.failUnlessEqual(diff(second, second), [])
+
+    def testComparator(self):
+        point = Point()
+        tracker = Tracker(point)
+        first = tracker.snapshot()
+        point.x = 1.0
+        point.x = 1e-7
+        second = tracker.snapshot()
+        self.failIf(second is first)
+        # compared with the comparator of the property
+        self.failUnlessEqual(diff(first, second), [])
+
+    def testChildren(self):
+        tracker = self.tracker
+        first = tracker.snapshot()
+        new = Node("new", 5)
+        self.root.insert_child(1, new)
+        self.root.remove_child(self.children[2])
+        second = tracker.snapshot()
+        self.failUnlessEqual([child.model for child in second.children],
+            [self.children[0], new, self.children[1]])
+        changes = diff(first, second)
+        self.failUnlessEqual(changes[0], ("changed", self.root, "total", 3,
+            6))
+        self.failUnlessEqual([change[:3] for change in changes[1:]],
+            [("removed", self.root, 2), ("added", self.root, 1)])
+        self.failUnless(changes[1][3] is first.children[2])
+        self.failUnless(changes[2][3] is second.children[1])
+
+        # removed models aren't followed anymore
+        self.children[2].value = 100
+        self.failUnless(tracker.snapshot() is second)
+
+        # changes to added ones are
+        new.add_child(Node("grandchild"))
+        third = tracker.snapshot()
+        self.failUnlessEqual([change[0] for change in diff(second, third)],
+            ["added"])
+
+        with basemodel.batch_notify():
+            self.root.remove_children([self.children[0]])
+            self.root.add_child(self.children[0])
+        changes = diff(third, tracker.snapshot())
+        self.failUnlessEqual([change[0] for change in changes],
+            ["reordered"])
+        self.failUnlessEqual(changes[0][2],
+            [new, self.children[1], self.children[0]])
+
+    def testClose(self):
+        self.tracker.close()
+        self.failUnlessEqual(self.tracker.parents, {})
+        self.root.value = 1
+
+
+if __name__ == '__main__':
+    unittest.main()